@@ -1,18 +1,36 @@
+import asyncio
 import logging
 import time
+from typing import Optional
 from telegram.ext import Application, CommandHandler, CallbackQueryHandler, InlineQueryHandler
 from config import Config
 from handlers.start import start
 from handlers.inline import inline_query, handle_reveal_callback, handle_already_read_callback
 import logging
-from telegram.ext import Application, CommandHandler, CallbackQueryHandler, InlineQueryHandler
+from telegram import Update
+from telegram.ext import Application, BaseUpdateProcessor, CommandHandler, CallbackQueryHandler, ChosenInlineResultHandler, InlineQueryHandler, TypeHandler
 from handlers.start import start
 from handlers.create import create_conversation
-from handlers.list import list_whispers
+from handlers.list import list_whispers, list_page_callback
 from handlers.privacy import privacy, privacy_callback
 from handlers.notifications import notifications, notifications_callback
-from handlers.inline import inline_query, handle_reveal_callback
+from handlers.inline import inline_query, chosen_inline_result, handle_reveal_callback
 from handlers.reveal import reveal_handlers
+from handlers.users import record_user
+from handlers.admin import (
+    admin,
+    admin_callback,
+    admin_page_callback,
+    admin_whispers,
+    broadcast_conversation,
+    resume_broadcast,
+)
+from storage import storage
+from utils.metrics import InstrumentedRequest, MetricsServer, instrument_handlers
+from utils.profiler import profiler
+from utils.registry import user_registry
+from utils.scheduler import scheduler
+from utils.webhook import run_webhook
 
 # Set up logging
 logging.basicConfig(
@@ -20,18 +38,83 @@ logging.basicConfig(
     level=logging.INFO
 )
 
-def main():
-    # Create application
-    application = Application.builder().token("8369183040:AAFWREA6Nhz9P6opj4d5zJiw2k5OnwWcfYk").build()
+logger = logging.getLogger(__name__)
+
+async def post_init(application: Application):
+    """Start background maintenance tasks"""
+    # The Bot API can't tell whether inline feedback is on, so always say it
+    logger.warning(
+        "Inline whispers are stored when Telegram reports the chosen result, which "
+        "needs inline feedback enabled for the bot (@BotFather /setinlinefeedback). "
+        "Without it, an inline whisper is only stored when its reveal button is "
+        "pressed within INLINE_DRAFT_TTL (%.0fs).",
+        Config.INLINE_DRAFT_TTL,
+    )
+    await scheduler.start(application.bot)
+    user_registry.start()
+    if Config.METRICS_PORT:
+        server = MetricsServer(Config.METRICS_LISTEN, Config.METRICS_PORT + Config.WORKER_INDEX)
+        if await server.start():
+            application.bot_data["metrics_server"] = server
+    # One sweeper is enough when several worker processes share the data
+    if (Config.RETAIN_REVEALED_HOURS or Config.RETAIN_UNREVEALED_DAYS) and Config.WORKER_INDEX == 0:
+        application.bot_data["expiry_sweeper"] = asyncio.create_task(
+            storage.run_expiry_sweeper(Config.EXPIRY_SWEEP_INTERVAL)
+        )
+
+async def post_shutdown(application: Application):
+    """Stop background tasks, then flush and release the storage backend"""
+    sweeper = application.bot_data.pop("expiry_sweeper", None)
+    if sweeper:
+        sweeper.cancel()
+    metrics_server = application.bot_data.pop("metrics_server", None)
+    if metrics_server:
+        await metrics_server.stop()
+    await profiler.stop()
+    await scheduler.stop()
+    await user_registry.stop()
+    await storage.aclose()
+
+def build_application(base_url: Optional[str] = None, update_processor: Optional[BaseUpdateProcessor] = None) -> Application:
+    """Create the application with every handler registered.
+
+    base_url and update_processor are for the load harness
+    (scripts/load_harness.py), which points the bot at a fake Bot API and
+    times each update as it is processed.
+    """
+    builder = (
+        Application.builder()
+        .token("8369183040:AAFWREA6Nhz9P6opj4d5zJiw2k5OnwWcfYk")
+        # Same pool size as PTB's default request, plus Bot API timings
+        .request(InstrumentedRequest(connection_pool_size=256))
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+    )
+    if base_url:
+        builder.base_url(base_url)
+    if update_processor is not None:
+        builder.concurrent_updates(update_processor)
+    elif Config.CONCURRENT_UPDATES:
+        # Handlers that read-modify-write shared records take a keyed lock (utils.locks)
+        builder.concurrent_updates(Config.CONCURRENT_UPDATES)
+    if Config.BOT_MODE == "webhook":
+        # Bounded, so a backlog turns into 503s that Telegram retries later
+        builder.update_queue(asyncio.Queue(maxsize=Config.WEBHOOK_QUEUE_SIZE))
+    application = builder.build()
+
+    # Record every user before any other handler sees the update
+    application.add_handler(TypeHandler(Update, record_user), group=-1)
 
     # Add handlers
     application.add_handler(CommandHandler("start" , start))
     application.add_handler(CommandHandler("help" , start))
     application.add_handler(InlineQueryHandler(inline_query))
+    application.add_handler(ChosenInlineResultHandler(chosen_inline_result))
     application.add_handler(CallbackQueryHandler(handle_reveal_callback, pattern="^reveal_"))
     application.add_handler(CallbackQueryHandler(handle_already_read_callback, pattern="^already_read"))
     application.add_handler(create_conversation)
     application.add_handler(CommandHandler("list", list_whispers))
+    application.add_handler(CallbackQueryHandler(list_page_callback, pattern=r"^list:\d+:[np]:"))
     application.add_handler(CommandHandler("privacy", privacy))
     application.add_handler(CommandHandler("notifications", notifications))
     application.add_handler(CallbackQueryHandler(privacy_callback, pattern="^toggle_privacy$"))
@@ -39,9 +122,28 @@ def main():
     application.add_handler(CallbackQueryHandler(handle_reveal_callback, pattern="^reveal_"))
 
     application.add_handler(reveal_handlers)
+    application.add_handler(CommandHandler("admin", admin))
+    application.add_handler(CommandHandler("resume_broadcast", resume_broadcast))
+    application.add_handler(CommandHandler("admin_whispers", admin_whispers))
+    application.add_handler(broadcast_conversation)
+    application.add_handler(CallbackQueryHandler(admin_callback, pattern="^admin_"))
+    application.add_handler(CallbackQueryHandler(admin_page_callback, pattern="^adm_[uw]:[np]:"))
+
+    # Time every handler registered above
+    instrument_handlers(application)
+    # Counts updates for update-bounded profiling sessions; added after
+    # instrumenting so it stays out of the handler metrics
+    application.add_handler(TypeHandler(Update, profiler.count_update), group=-2)
+    return application
+
+def main():
+    application = build_application()
 
     # Start the bot
-    application.run_polling()
+    if Config.BOT_MODE == "webhook":
+        run_webhook(application)
+    else:
+        application.run_polling()
 
 if __name__ == "__main__":
     main()
@@ -8,5 +8,97 @@ class Config:
     BOT_USERNAME = os.getenv("WhispeyBot")  # Without @
     DATA_FILE = os.getenv("DATA_FILE", "data/whispers.json")
     OWNER_ID = 8429156335
+    # Storage backend: "json" (single JSON file), "log" (append-only journal)
+    # or "sqlite" (indexed tables in SQLITE_FILE)
+    STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "json")
+    SQLITE_FILE = os.getenv("SQLITE_FILE", "data/whispers.db")
+    # Sharded backend: directory and number of whisper shards (fixed once data exists)
+    SHARD_DIR = os.getenv("SHARD_DIR", "data/shards")
+    STORAGE_SHARDS = int(os.getenv("STORAGE_SHARDS", "8"))
+    # Keep the dataset in memory instead of re-reading the file on every call.
+    # The json backend only has running stats counters and the expiry index
+    # in this mode; without it admin stats recount the whole file per call
+    STORAGE_RESIDENT = os.getenv("STORAGE_RESIDENT", "0") == "1"
+    # Seconds between checks for external changes to the file (0 disables)
+    STORAGE_RELOAD_INTERVAL = float(os.getenv("STORAGE_RELOAD_INTERVAL", "5"))
+    # Encoding of the data file when it is rewritten: "json" (indented),
+    # "json-compact", "compact" (binary) or "compact-zlib"; any of them is read
+    SNAPSHOT_FORMAT = os.getenv("SNAPSHOT_FORMAT", "json")
+    # Coalesce writes into one flush per window / per N mutations
+    # (the json backend requires STORAGE_RESIDENT=1)
+    WRITE_BEHIND = os.getenv("WRITE_BEHIND", "0") == "1"
+    WRITE_BEHIND_WINDOW_MS = float(os.getenv("WRITE_BEHIND_WINDOW_MS", "50"))
+    WRITE_BEHIND_MAX_PENDING = int(os.getenv("WRITE_BEHIND_MAX_PENDING", "500"))
+    # Journal durability: "always" (fsync every write), "batch" or "never"
+    LOG_FSYNC = os.getenv("LOG_FSYNC", "batch")
+    # In batch mode, fsync after this many records or this many seconds
+    LOG_FSYNC_BATCH = int(os.getenv("LOG_FSYNC_BATCH", "100"))
+    LOG_FSYNC_INTERVAL = float(os.getenv("LOG_FSYNC_INTERVAL", "1"))
+    # Compact the journal into a snapshot once it exceeds this size
+    LOG_COMPACT_BYTES = int(os.getenv("LOG_COMPACT_BYTES", str(4 * 1024 * 1024)))
+    LOG_COMPACT_INTERVAL = float(os.getenv("LOG_COMPACT_INTERVAL", "60"))
+    # Seconds an unsent inline whisper draft is kept, and how many are kept
+    INLINE_DRAFT_TTL = float(os.getenv("INLINE_DRAFT_TTL", "600"))
+    INLINE_DRAFT_MAX = int(os.getenv("INLINE_DRAFT_MAX", "50000"))
+    # Parsed inline queries kept per user, and how many users are tracked
+    INLINE_CACHE_PER_USER = int(os.getenv("INLINE_CACHE_PER_USER", "16"))
+    INLINE_CACHE_USERS = int(os.getenv("INLINE_CACHE_USERS", "10000"))
+    # Wait this long for a newer keystroke before answering an inline query
+    # (only with CONCURRENT_UPDATES, otherwise the wait would block the queue)
+    INLINE_DEBOUNCE_MS = float(os.getenv("INLINE_DEBOUNCE_MS", "250"))
+    # Let Telegram cache the inline help result, shared by all users by default
+    INLINE_HELP_CACHE_TIME = int(os.getenv("INLINE_HELP_CACHE_TIME", "3600"))
+    INLINE_HELP_IS_PERSONAL = os.getenv("INLINE_HELP_IS_PERSONAL", "0") == "1"
+    # Retention: delete revealed whispers this many hours after the reveal
+    # and unrevealed ones this many days after creation (0 keeps them).
+    # Sweeps use an expiry index, so the json backend only enforces these
+    # with STORAGE_RESIDENT=1; without it the sweeper logs an error and stops
+    RETAIN_REVEALED_HOURS = float(os.getenv("RETAIN_REVEALED_HOURS", "0"))
+    RETAIN_UNREVEALED_DAYS = float(os.getenv("RETAIN_UNREVEALED_DAYS", "0"))
+    # Seconds between expiry sweeps, and width of the expiry index buckets
+    EXPIRY_SWEEP_INTERVAL = float(os.getenv("EXPIRY_SWEEP_INTERVAL", "300"))
+    EXPIRY_BUCKET_SECONDS = int(os.getenv("EXPIRY_BUCKET_SECONDS", "600"))
+    # How updates arrive: "polling" or "webhook"
+    BOT_MODE = os.getenv("BOT_MODE", "polling")
+    # Webhook listener address and URL path
+    WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+    WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+    WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+    # Public URL registered with setWebhook; leave empty to only run the listener
+    WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+    # Expected X-Telegram-Bot-Api-Secret-Token header (empty disables the check)
+    WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+    # Concurrent webhook connections, and updates buffered before answering 503
+    WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+    WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+    # supervisor.py: worker processes to run, and the first of their local ports
+    SUPERVISOR_WORKERS = int(os.getenv("SUPERVISOR_WORKERS", str(os.cpu_count() or 1)))
+    WORKER_BASE_PORT = int(os.getenv("WORKER_BASE_PORT", "8500"))
+    # Set by the supervisor: this process's worker number and the worker count
+    WORKER_INDEX = int(os.getenv("WORKER_INDEX", "0"))
+    WORKER_COUNT = int(os.getenv("WORKER_COUNT", "1"))
+    # Prometheus metrics endpoint (plus WORKER_INDEX under the supervisor);
+    # off unless a port is set, e.g. 9100
+    METRICS_LISTEN = os.getenv("METRICS_LISTEN", "127.0.0.1")
+    METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+    # Admin-triggered sampling profiler: sample interval, hard time cap and report length
+    PROFILER_INTERVAL_MS = float(os.getenv("PROFILER_INTERVAL_MS", "5"))
+    PROFILER_MAX_SECONDS = int(os.getenv("PROFILER_MAX_SECONDS", "600"))
+    PROFILER_TOP = int(os.getenv("PROFILER_TOP", "15"))
+    # Handle up to this many updates at once; 0 processes them one by one
+    CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "0"))
+    # Seconds between batched writes of changed users from the user registry
+    USER_FLUSH_INTERVAL = float(os.getenv("USER_FLUSH_INTERVAL", "5"))
+    # Seconds the user registry serves a user from memory, and how many it
+    # keeps; off by default with several workers, which change users too
+    USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "300" if WORKER_COUNT == 1 else "0"))
+    USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "100000"))
+    # Most due deferred actions (message edits/deletions) run in one batch
+    SCHEDULER_BATCH_SIZE = int(os.getenv("SCHEDULER_BATCH_SIZE", "50"))
+    # Broadcast: messages per second, parallel sends and the resume checkpoint
+    BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "25"))
+    BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "20"))
+    BROADCAST_PROGRESS_INTERVAL = float(os.getenv("BROADCAST_PROGRESS_INTERVAL", "5"))
+    BROADCAST_STATE_FILE = os.getenv("BROADCAST_STATE_FILE", "data/broadcast.json")
     # Create data directory if it doesn't exist
     os.makedirs(os.path.dirname(DATA_FILE), exist_ok=True)
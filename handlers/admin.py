@@ -1,12 +1,30 @@
+from datetime import datetime, timedelta
+from io import BytesIO
 from telegram import Update
-from telegram.ext import ContextTypes, ConversationHandler, MessageHandler, filters
+from telegram.error import BadRequest
+from telegram.ext import CallbackQueryHandler, ContextTypes, ConversationHandler, MessageHandler, filters
 from config import Config
 from storage import storage
-from utils.keyboards import get_admin_keyboard
+from utils.broadcast import BroadcastEngine
+from utils.registry import user_registry
+from utils.keyboards import get_admin_keyboard, get_admin_page_keyboard, get_profiler_keyboard
+from utils.metrics import metrics
+from utils.profiler import profiler
 
 # States for broadcast conversation
 BROADCAST_MESSAGE = range(1)
 
+# Rows per page in the admin user and whisper listings
+PAGE_SIZE = 10
+
+# Single engine, so only one broadcast runs at a time
+broadcast_engine = BroadcastEngine(
+    Config.BROADCAST_STATE_FILE,
+    rate=Config.BROADCAST_RATE,
+    concurrency=Config.BROADCAST_CONCURRENCY,
+    checkpoint_interval=Config.BROADCAST_PROGRESS_INTERVAL,
+)
+
 async def admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     
@@ -31,39 +49,36 @@ async def admin_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     action = query.data
     
-    if action == "admin_stats":
-        stats = storage.get_stats()
+    if action in ("admin_stats", "admin_recount"):
+        # Include users the registry hasn't written out yet
+        await user_registry.flush()
+        if action == "admin_recount":
+            stats = await storage.arebuild_stats()
+        else:
+            stats = await storage.aget_stats()
         message = f"""
 📊 Bot Statistics:
 • Total Users: {stats['users']}
 • Total Whispers: {stats['total']}
 • Read Whispers: {stats['read']}
 • Unread Whispers: {stats['unread']}
+• Inline Whispers: {stats['inline']}
+• Media Whispers: {stats['media']} ({stats['media_items']} items)
         """
+        message += format_metrics_summary()
         await query.edit_message_text(message, reply_markup=get_admin_keyboard())
     
+    elif action == "admin_panel":
+        await query.edit_message_text("Admin panel:", reply_markup=get_admin_keyboard())
+    
     elif action == "admin_list_users":
-        users = storage.get_all_users()
-        message = "👥 Users:\n\n"
-        for user_id, user in list(users.items())[:10]:  # Show first 10 users
-            message += f"• {user.get('first_name', 'Unknown')} (@{user.get('username', 'N/A')}) - ID: {user_id}\n"
-        
-        if len(users) > 10:
-            message += f"\n... and {len(users) - 10} more users."
-        
-        await query.edit_message_text(message, reply_markup=get_admin_keyboard())
+        message, keyboard = await build_users_page()
+        await query.edit_message_text(message, reply_markup=keyboard)
     
     elif action == "admin_list_whispers":
-        whispers = storage.get_all_whispers()
-        message = "📨 Whispers:\n\n"
-        for whisper_id, whisper in list(whispers.items())[:10]:  # Show first 10 whispers
-            status = "✓" if whisper.get("is_read", False) else "✗"
-            message += f"• #{whisper_id}: From {whisper.get('sender_id')} to {whisper.get('recipient')} {status}\n"
-        
-        if len(whispers) > 10:
-            message += f"\n... and {len(whispers) - 10} more whispers."
-        
-        await query.edit_message_text(message, reply_markup=get_admin_keyboard())
+        whisper_filters = context.user_data.get("admin_whisper_filters", {})
+        message, keyboard = await build_whispers_page(whisper_filters)
+        await query.edit_message_text(message, reply_markup=keyboard)
     
     elif action == "admin_broadcast":
         await query.edit_message_text(
@@ -71,6 +86,181 @@ async def admin_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             reply_markup=None
         )
         return BROADCAST_MESSAGE
+    
+    elif action.startswith("admin_profile"):
+        await profile_action(query, context, action)
+
+async def profile_action(query, context: ContextTypes.DEFAULT_TYPE, action: str):
+    """Start, stop or show the profiler; callback data is admin_profile[:updates|seconds:<n>|:stop]"""
+    parts = action.split(":")
+    
+    if parts[1:2] == ["stop"]:
+        # The report arrives as a separate message once the samples are in
+        await profiler.stop()
+        await query.edit_message_text("Admin panel:", reply_markup=get_admin_keyboard())
+        return
+    
+    if len(parts) == 3:
+        chat_id = query.message.chat_id
+        
+        async def deliver(profile):
+            await send_profile_report(context.bot, chat_id, profile)
+        
+        # Ignored while a session is running; the keyboard below then offers Stop
+        profiler.start(deliver, **{parts[1]: int(parts[2])})
+    
+    if profiler.running:
+        message = "🔬 Profiling... the report will be sent here when the session ends."
+    else:
+        message = "🔬 Profile the bot for the next:"
+    await query.edit_message_text(message, reply_markup=get_profiler_keyboard(profiler.running))
+
+async def send_profile_report(bot, chat_id: int, profile):
+    """Send the text report, plus the collapsed stacks for a flame graph"""
+    report = profile.format_report()
+    if len(report) > 4000:
+        report = report[:4000] + "\n…"
+    await bot.send_message(chat_id, report)
+    if profile.stacks:
+        await bot.send_document(
+            chat_id,
+            BytesIO(profile.folded().encode()),
+            filename=f"profile-{int(profile.started_at)}.folded",
+            caption="Collapsed stacks, for flamegraph.pl or speedscope",
+        )
+
+def format_metrics_summary() -> str:
+    """Busiest handlers, storage calls and Bot API methods since startup"""
+    message = ""
+    for title, family in (("Handlers", "handler"), ("Storage", "storage"), ("Bot API", "bot_api")):
+        lines = metrics.summary(family)
+        if lines:
+            message += f"\n⏱ {title}:\n" + "\n".join(f"• {line}" for line in lines) + "\n"
+    retry_after = sum(metrics.retry_after.values())
+    if retry_after:
+        message += f"\n🚦 Flood-control waits (RetryAfter): {retry_after}\n"
+    return message
+
+def page_cursors(items, cursor, direction, has_more):
+    """Cursors for the Prev/Next buttons around a keyset page (None hides a button)"""
+    if not items:
+        return None, None
+    if direction == "next":
+        has_prev, has_next = cursor is not None, has_more
+    else:
+        has_prev, has_next = has_more, True
+    return (0 if has_prev else None), (-1 if has_next else None)
+
+async def build_users_page(cursor=None, direction="next"):
+    await user_registry.flush()
+    users, has_more = await storage.aget_users_page(cursor=cursor, direction=direction, limit=PAGE_SIZE)
+    
+    message = "👥 Users:\n\n"
+    for user in users:
+        message += f"• {user.get('first_name', 'Unknown')} (@{user.get('username', 'N/A')}) - ID: {user['id']}\n"
+    if not users:
+        message += "No users here."
+    
+    prev_at, next_at = page_cursors(users, cursor, direction, has_more)
+    keyboard = get_admin_page_keyboard(
+        "adm_u",
+        users[prev_at]["id"] if prev_at is not None else None,
+        users[next_at]["id"] if next_at is not None else None,
+    )
+    return message, keyboard
+
+def whisper_cursor(whisper) -> str:
+    return f"{whisper.get('created_at') or 0}:{whisper['id']}"
+
+def describe_filters(whisper_filters) -> str:
+    parts = []
+    if "revealed" in whisper_filters:
+        parts.append("revealed" if whisper_filters["revealed"] else "unrevealed")
+    if "sender_id" in whisper_filters:
+        parts.append(f"sender {whisper_filters['sender_id']}")
+    if "since" in whisper_filters:
+        parts.append(f"from {datetime.fromtimestamp(whisper_filters['since']):%Y-%m-%d}")
+    if "until" in whisper_filters:
+        parts.append(f"to {datetime.fromtimestamp(whisper_filters['until']):%Y-%m-%d}")
+    return ", ".join(parts)
+
+async def build_whispers_page(whisper_filters, cursor=None, direction="next"):
+    whispers, has_more = await storage.aget_whispers_page(
+        cursor=cursor, direction=direction, limit=PAGE_SIZE, **whisper_filters
+    )
+    
+    message = "📨 Whispers"
+    if whisper_filters:
+        message += f" ({describe_filters(whisper_filters)})"
+    message += ":\n\n"
+    for whisper in whispers:
+        status = "✓" if whisper.get("is_revealed", False) else "✗"
+        recipient = whisper.recipient_label
+        message += f"• #{whisper['id']}: From {whisper.get('sender_id')} to {recipient} {status}\n"
+    if not whispers:
+        message += "No whispers here."
+    
+    prev_at, next_at = page_cursors(whispers, cursor, direction, has_more)
+    keyboard = get_admin_page_keyboard(
+        "adm_w",
+        whisper_cursor(whispers[prev_at]) if prev_at is not None else None,
+        whisper_cursor(whispers[next_at]) if next_at is not None else None,
+    )
+    return message, keyboard
+
+async def admin_page_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle Prev/Next in the admin listings; callback data is prefix:direction:cursor"""
+    query = update.callback_query
+    await query.answer()
+    
+    if query.from_user.id != Config.OWNER_ID:
+        await query.edit_message_text("You are not authorized to use this command.")
+        return
+    
+    prefix, direction, raw_cursor = query.data.split(":", 2)
+    direction = "next" if direction == "n" else "prev"
+    
+    if prefix == "adm_u":
+        message, keyboard = await build_users_page(raw_cursor, direction)
+    else:
+        created_at, whisper_id = raw_cursor.split(":", 1)
+        whisper_filters = context.user_data.get("admin_whisper_filters", {})
+        message, keyboard = await build_whispers_page(whisper_filters, (int(created_at), whisper_id), direction)
+    
+    await query.edit_message_text(message, reply_markup=keyboard)
+
+async def admin_whispers(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """List whispers with optional filters:
+    /admin_whispers [revealed|unrevealed] [sender=<id>] [from=YYYY-MM-DD] [to=YYYY-MM-DD]
+    """
+    if update.effective_user.id != Config.OWNER_ID:
+        await update.message.reply_text("You are not authorized to use this command.")
+        return
+    
+    whisper_filters = {}
+    try:
+        for arg in context.args:
+            if arg in ("revealed", "unrevealed"):
+                whisper_filters["revealed"] = arg == "revealed"
+            elif arg.startswith("sender="):
+                whisper_filters["sender_id"] = int(arg[len("sender="):])
+            elif arg.startswith("from="):
+                whisper_filters["since"] = int(datetime.strptime(arg[len("from="):], "%Y-%m-%d").timestamp())
+            elif arg.startswith("to="):
+                day = datetime.strptime(arg[len("to="):], "%Y-%m-%d") + timedelta(days=1)
+                whisper_filters["until"] = int(day.timestamp()) - 1
+            else:
+                raise ValueError(arg)
+    except ValueError:
+        await update.message.reply_text(
+            "Usage: /admin_whispers [revealed|unrevealed] [sender=<id>] [from=YYYY-MM-DD] [to=YYYY-MM-DD]"
+        )
+        return
+    
+    # Kept per admin so the Prev/Next buttons only need to carry the cursor
+    context.user_data["admin_whisper_filters"] = whisper_filters
+    message, keyboard = await build_whispers_page(whisper_filters)
+    await update.message.reply_text(message, reply_markup=keyboard)
 
 async def broadcast_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
@@ -80,14 +270,17 @@ async def broadcast_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return ConversationHandler.END
     
     message = update.message.text
-    users = storage.get_all_users()
+    await user_registry.flush()
+    users = await storage.aget_all_users()
+    # Skip users a previous broadcast found to be unreachable
+    recipients = [uid for uid, user in users.items() if not user.get("unreachable")]
     
     # Store message in context for confirmation
     context.user_data['broadcast_message'] = message
-    context.user_data['broadcast_users'] = list(users.keys())
+    context.user_data['broadcast_users'] = recipients
     
     await update.message.reply_text(
-        f"Are you sure you want to broadcast this message to {len(users)} users?\n\n"
+        f"Are you sure you want to broadcast this message to {len(recipients)} users?\n\n"
         f"Message: {message}\n\n"
         "Type /confirm to proceed or /cancel to abort."
     )
@@ -108,24 +301,61 @@ async def confirm_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Broadcast data missing. Please start over.")
         return ConversationHandler.END
     
-    # Send broadcast to all users
-    success = 0
-    failures = 0
+    if not broadcast_engine.claim():
+        await update.message.reply_text("A broadcast is already in progress.")
+        return ConversationHandler.END
     
-    for user_id in users:
-        try:
-            await context.bot.send_message(chat_id=user_id, text=f"📢 Broadcast from admin:\n\n{message}")
-            success += 1
-        except Exception as e:
-            failures += 1
+    state = broadcast_engine.new_state(message, users, update.effective_chat.id)
+    await start_broadcast(update, context, state)
+    return ConversationHandler.END
+
+async def resume_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Resume a broadcast interrupted by a restart from its last checkpoint"""
+    if update.effective_user.id != Config.OWNER_ID:
+        await update.message.reply_text("You are not authorized to use this command.")
+        return
     
-    await update.message.reply_text(
-        f"Broadcast completed!\n"
-        f"✅ Success: {success}\n"
-        f"❌ Failures: {failures}"
+    if not broadcast_engine.claim():
+        await update.message.reply_text("A broadcast is already in progress.")
+        return
+    
+    state = broadcast_engine.load_state()
+    if state is None:
+        broadcast_engine.release()
+        await update.message.reply_text("There is no interrupted broadcast to resume.")
+        return
+    
+    await start_broadcast(update, context, state)
+
+def format_broadcast_progress(state) -> str:
+    total = len(state["user_ids"])
+    title = "Broadcast completed!" if state["finished"] else "📢 Broadcasting..."
+    return (
+        f"{title}\n"
+        f"Progress: {state['cursor']}/{total}\n"
+        f"✅ Success: {state['success']}\n"
+        f"❌ Failures: {state['failures']}\n"
+        f"🚫 Unreachable: {state['unreachable']}"
     )
+
+async def start_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE, state):
+    """Run the broadcast in the background, editing a status message as it goes.
     
-    return ConversationHandler.END
+    The caller has claimed broadcast_engine; it is released if starting fails.
+    """
+    try:
+        status = await update.message.reply_text(format_broadcast_progress(state))
+    except Exception:
+        broadcast_engine.release()
+        raise
+    
+    async def report(current_state):
+        try:
+            await status.edit_text(format_broadcast_progress(current_state))
+        except BadRequest:
+            pass  # message not modified
+    
+    context.application.create_task(broadcast_engine.run(context.bot, state, report))
 
 async def cancel_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("Broadcast cancelled.")
@@ -133,7 +363,7 @@ async def cancel_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 # Create conversation handler for broadcast
 broadcast_conversation = ConversationHandler(
-    entry_points=[MessageHandler(filters.Regex(r'^/admin_broadcast$'), admin)],
+    entry_points=[CallbackQueryHandler(admin_callback, pattern="^admin_broadcast$")],
     states={
         BROADCAST_MESSAGE: [
             MessageHandler(filters.TEXT & ~filters.COMMAND, broadcast_message),
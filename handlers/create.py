@@ -25,28 +25,35 @@ ACTIVE_WHISPERS = {}
 async def create_whisper(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(
         "📝 Let's create a whisper!\n\n"
-        "Please enter the numeric ID of the recipient:"
+        "Please enter the recipient's numeric ID or @username:"
     )
     return SELECT_RECIPIENT
 
 
-# Step 2: Select recipient (numeric ID only)
+# Step 2: Select recipient (numeric ID or a username the bot has seen)
 async def select_recipient(update: Update, context: ContextTypes.DEFAULT_TYPE):
     recipient_input = update.message.text.strip()
 
-    if not recipient_input.isdigit():
-        await update.message.reply_text("❌ Invalid recipient. Please enter a numeric user ID only.")
-        return SELECT_RECIPIENT
-
-    recipient_id = int(recipient_input)
+    if recipient_input.isdigit():
+        recipient_id = recipient_input
+        recipient_display = recipient_input
+    else:
+        recipient_id = await storage.aresolve_username(recipient_input)
+        if recipient_id is None:
+            await update.message.reply_text(
+                "❌ I don't know that user yet. They need to have used the bot once, "
+                "or you can enter their numeric user ID instead."
+            )
+            return SELECT_RECIPIENT
+        recipient_display = "@" + recipient_input.lstrip("@")
 
     # Save into conversation data
     context.user_data["recipient_id"] = str(recipient_id)
-    context.user_data["recipient_display"] = recipient_id
+    context.user_data["recipient_display"] = recipient_display
     context.user_data["media_items"] = []
 
     await update.message.reply_text(
-        f"✅ Recipient set: `{recipient_id}`\n\n"
+        f"✅ Recipient set: `{recipient_display}`\n\n"
         "Now send me the media/text for your whisper.\n"
         "➡️ Type /done when finished or /cancel to abort.",
         parse_mode="Markdown",
@@ -99,7 +106,7 @@ async def finish_whisper(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ No media added. Whisper cancelled.")
         return ConversationHandler.END
 
-    whisper_id = storage.get_next_whisper_id()
+    whisper_id = await storage.aget_next_whisper_id()
     whisper_data = {
         "id": whisper_id,
         "sender_id": update.effective_user.id,
@@ -110,7 +117,7 @@ async def finish_whisper(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "is_revealed": False,
     }
 
-    storage.save_whisper(whisper_id, whisper_data)
+    await storage.asave_whisper(whisper_id, whisper_data, durable=True)
     ACTIVE_WHISPERS[str(whisper_id)] = whisper_data  # temporary cache
 
     # Inline button for reveal
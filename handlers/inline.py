@@ -1,6 +1,8 @@
 import re
 import time
 import asyncio
+import logging
+from typing import Dict, Optional
 from uuid import uuid4
 from telegram import (
     Update,
@@ -10,12 +12,53 @@ from telegram import (
 from telegram.ext import ContextTypes
 from config import Config
 from storage import storage
+from utils.cache import LRUCache, TTLCache
 from utils.keyboards import get_reveal_keyboard
+from utils.locks import whisper_locks
+from utils.records import Record, to_record
+from utils.scheduler import scheduler
+from utils.webhook import whisper_routing_key, worker_for
 
+logger = logging.getLogger(__name__)
 
 # Max words allowed in popup (otherwise DM)
 POPUP_WORD_LIMIT = 10
 
+# Whispers built for inline results but not sent yet, keyed by result id.
+# Telegram sends an inline query per keystroke, so only the draft the user
+# actually picks is committed to storage (see commit_draft).
+INLINE_DRAFTS = TTLCache(ttl=Config.INLINE_DRAFT_TTL, maxsize=Config.INLINE_DRAFT_MAX)
+
+# Per-user LRU of parsed queries (with the resolved recipient and display
+# text) keyed by query text, so repeated and backspaced queries skip the
+# parse and username lookup; each answer still gets a fresh draft
+INLINE_RESULTS = TTLCache(ttl=Config.INLINE_DRAFT_TTL, maxsize=Config.INLINE_CACHE_USERS)
+
+# Newest inline query id per user, for dropping superseded keystrokes
+INLINE_LATEST: Dict[int, str] = {}
+
+USERNAME_PATTERN = re.compile(r'@(\w+)$')
+USER_ID_PATTERN = re.compile(r'(\d+)$')
+
+THUMBNAIL_URL = "https://cdn-icons-png.flaticon.com/512/2955/2955806.png"
+
+# The help result is the same for everybody, so it is built once and
+# Telegram may cache it
+HELP_RESULTS = [
+    InlineQueryResultArticle(
+        id="help",
+        title="ℹ️ How to use this bot",
+        input_message_content=InputTextMessageContent(
+            f"💬 To send a whisper, use this format:\n\n"
+            f"@{Config.BOT_USERNAME} your message @username\n\n"
+            f"or\n\n"
+            f"@{Config.BOT_USERNAME} your message 123456789"
+        ),
+        description="Type your secret message followed by @username or user ID",
+        thumbnail_url=THUMBNAIL_URL,
+    )
+]
+
 
 # ---------------------------
 # Helpers
@@ -29,14 +72,14 @@ def parse_inline_query(query: str):
     query = query.strip()
 
     # Match @username
-    username_match = re.search(r'@(\w+)$', query)
+    username_match = USERNAME_PATTERN.search(query)
     if username_match:
         username = username_match.group(0)  # includes "@"
         message = query[:username_match.start()].strip()
         return message, username, "username"
 
     # Match user ID
-    id_match = re.search(r'(\d+)$', query)
+    id_match = USER_ID_PATTERN.search(query)
     if id_match:
         user_id = id_match.group(1)
         message = query[:id_match.start()].strip()
@@ -50,44 +93,45 @@ def count_words(text: str) -> int:
     return len(text.split())
 
 
-# ---------------------------
-# Inline Query Handler
-# ---------------------------
-async def inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.inline_query.query.strip()
-    if not query:
-        return
+def new_whisper_id() -> str:
+    """A fresh inline whisper id whose reveal taps are routed to this worker.
+
+    Drafts live only in the memory of the worker that answered the inline
+    query. Under supervisor.py, reveal taps are routed by whisper id, so
+    the id is drawn until it maps back here; that way the reveal-time
+    commit_draft() fallback finds the draft. Takes WORKER_COUNT draws on
+    average.
+    """
+    while True:
+        whisper_id = uuid4().hex[:16]
+        if worker_for(whisper_routing_key(whisper_id), Config.WORKER_COUNT) == Config.WORKER_INDEX:
+            return whisper_id
 
-    # Parse query
-    message, recipient, recipient_type = parse_inline_query(query)
-
-    if not message or not recipient:
-        # Help message if wrong format
-        results = [
-            InlineQueryResultArticle(
-                id=str(uuid4()),
-                title="ℹ️ How to use this bot",
-                input_message_content=InputTextMessageContent(
-                    f"💬 To send a whisper, use this format:\n\n"
-                    f"@{Config.BOT_USERNAME} your message @username\n\n"
-                    f"or\n\n"
-                    f"@{Config.BOT_USERNAME} your message 123456789"
-                ),
-                description="Type your secret message followed by @username or user ID",
-                thumbnail_url="https://cdn-icons-png.flaticon.com/512/2955/2955806.png",
-            )
-        ]
-        await update.inline_query.answer(results)
-        return
 
-    # Save whisper in storage
-    whisper_id = storage.get_next_whisper_id()
+def whisper_display(message: str, recipient: str, recipient_type: str) -> tuple:
+    """The (title, message text, description) shown for a whisper's inline result"""
+    display_recipient = recipient if recipient_type == "username" else f"user {recipient}"
+    return (
+        f"🔒 Whisper for {display_recipient}",
+        f"🔒 A whisper for {display_recipient}\n\nOnly they can reveal this message.",
+        (message[:50] + "...") if len(message) > 50 else message,
+    )
+
+
+def build_whisper_results(
+    user, message: str, recipient: str, recipient_type: str, recipient_id=None, display: Optional[tuple] = None
+):
+    """Create a new draft whisper and its inline result, returning (whisper_id, results)"""
+    # Keep the whisper as a draft until the result is actually sent. The
+    # result id doubles as the whisper id, so no storage round-trip is needed.
+    whisper_id = new_whisper_id()
     whisper_data = {
         "id": whisper_id,
-        "sender_id": update.inline_query.from_user.id,
-        "sender_name": update.inline_query.from_user.first_name,
+        "sender_id": user.id,
+        "sender_name": user.first_name,
         "recipient": recipient,
         "recipient_type": recipient_type,
+        "recipient_id": recipient_id,
         "message": message,
         "created_at": int(time.time()),
         "is_revealed": False,
@@ -95,27 +139,115 @@ async def inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "revealed_at": None,
         "word_count": count_words(message),
     }
-    storage.save_whisper(whisper_id, whisper_data)
+    INLINE_DRAFTS.set(whisper_id, whisper_data)
 
-    # Display recipient
-    display_recipient = recipient if recipient_type == "username" else f"user {recipient}"
+    title, text, description = display or whisper_display(message, recipient, recipient_type)
 
     # Inline preview result
     results = [
         InlineQueryResultArticle(
-            id=str(uuid4()),
-            title=f"🔒 Whisper for {display_recipient}",
-            input_message_content=InputTextMessageContent(
-                f"🔒 A whisper for {display_recipient}\n\n"
-                f"Only they can reveal this message."
-            ),
-            description=(message[:50] + "...") if len(message) > 50 else message,
+            id=whisper_id,
+            title=title,
+            input_message_content=InputTextMessageContent(text),
+            description=description,
             reply_markup=get_reveal_keyboard(whisper_id),
-            thumbnail_url="https://cdn-icons-png.flaticon.com/512/2955/2955806.png",
+            thumbnail_url=THUMBNAIL_URL,
         )
     ]
+    return whisper_id, results
+
+
+async def is_superseded(user_id: int, query_id: str) -> bool:
+    """Wait out the debounce window; True if a newer query from the user arrived"""
+    INLINE_LATEST[user_id] = query_id
+    await asyncio.sleep(Config.INLINE_DEBOUNCE_MS / 1000)
+    if INLINE_LATEST.get(user_id) != query_id:
+        return True
+    del INLINE_LATEST[user_id]
+    return False
+
+
+# ---------------------------
+# Inline Query Handler
+# ---------------------------
+async def inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    inline = update.inline_query
+    query = inline.query.strip()
+    if not query:
+        return
+
+    user_cache = INLINE_RESULTS.get(inline.from_user.id)
+    if user_cache is None:
+        user_cache = LRUCache(Config.INLINE_CACHE_PER_USER)
+        INLINE_RESULTS.set(inline.from_user.id, user_cache)
+
+    # Same text as a recent keystroke: reuse its parse, recipient lookup and
+    # display text. The draft and result are always new: a sent result can
+    # never be offered again, or two messages would share one whisper.
+    parsed = user_cache.get(query)
+    if parsed is None:
+        # With concurrent updates, let a burst of keystrokes settle first;
+        # only the newest query of the burst gets parsed and answered
+        if Config.CONCURRENT_UPDATES and Config.INLINE_DEBOUNCE_MS:
+            if await is_superseded(inline.from_user.id, inline.id):
+                return
+
+        # Parse query
+        message, recipient, recipient_type = parse_inline_query(query)
+
+        if not message or not recipient:
+            # Help message if wrong format
+            await inline.answer(
+                HELP_RESULTS,
+                cache_time=Config.INLINE_HELP_CACHE_TIME,
+                is_personal=Config.INLINE_HELP_IS_PERSONAL,
+            )
+            return
+
+        # Pin the recipient to a user id when we can, so the whisper stays theirs
+        # even if the username later changes hands
+        if recipient_type == "username":
+            recipient_id = await storage.aresolve_username(recipient)
+        else:
+            recipient_id = recipient
+
+        display = whisper_display(message, recipient, recipient_type)
+        parsed = (message, recipient, recipient_type, recipient_id, display)
+        user_cache.set(query, parsed)
+
+    _, results = build_whisper_results(inline.from_user, *parsed)
+
+    # Results carry a one-off draft, so Telegram must not cache them
+    await inline.answer(results, cache_time=0, is_personal=True)
+
+
+# ---------------------------
+# Chosen Inline Result Handler
+# ---------------------------
+async def chosen_inline_result(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Commit the draft behind an inline result once the user has sent it.
 
-    await update.inline_query.answer(results, cache_time=0)  # no caching
+    Requires inline feedback to be enabled for the bot via @BotFather.
+    """
+    result = update.chosen_inline_result
+    if await commit_draft(result.result_id, sent_at=int(time.time())) is None:
+        logger.warning("Inline draft %s expired before it was chosen", result.result_id)
+
+
+async def commit_draft(whisper_id: str, sent_at: Optional[int] = None) -> Optional[Record]:
+    """Move an inline draft into storage, returning it (None if there is no such draft).
+
+    Besides chosen_inline_result, the reveal button commits the draft when
+    it finds no stored whisper, so whispers still work while inline feedback
+    is disabled, as long as they are revealed within INLINE_DRAFT_TTL.
+    """
+    whisper_data = INLINE_DRAFTS.pop(whisper_id)
+    if whisper_data is None:
+        return None
+    if sent_at is not None:
+        whisper_data["created_at"] = sent_at
+    await storage.asave_whisper(whisper_data["id"], whisper_data)
+    return to_record(whisper_data)
 
 
 # ---------------------------
@@ -128,62 +260,72 @@ async def handle_reveal_callback(update: Update, context: ContextTypes.DEFAULT_T
         await query.answer()  # acknowledge invalid
         return
 
-    whisper_id = int(query.data.split("_")[1])
+    whisper_id = query.data.split("_", 1)[1]
     user_id = query.from_user.id
     username = query.from_user.username
     user_mention = f"@{username}" if username else query.from_user.first_name
 
-    # Fetch whisper
-    whisper = storage.get_whisper(whisper_id)
-    if not whisper:
-        await query.edit_message_text("❌ This whisper has expired or doesn’t exist.")
-        return
-
-    # Already revealed?
-    if whisper.get("is_revealed", False):
-        revealed_by = whisper.get("revealed_by", "someone")
-        revealed_at = whisper.get("revealed_at", 0)
-        time_ago = int(time.time()) - revealed_at
-
-        if time_ago < 60:
-            time_str = f"{time_ago} seconds ago"
-        elif time_ago < 3600:
-            time_str = f"{time_ago // 60} minutes ago"
-        else:
-            time_str = f"{time_ago // 3600} hours ago"
+    # Check, deliver and mark revealed under the whisper's lock, so two
+    # racing taps can't both reveal it
+    async with whisper_locks.lock(whisper_id):
+        whisper = await storage.aget_whisper(whisper_id)
+        if not whisper:
+            # Sent, but chosen_inline_result never came (inline feedback off)
+            whisper = await commit_draft(whisper_id)
+        if not whisper:
+            await query.edit_message_text("❌ This whisper has expired or doesn’t exist.")
+            return
+
+        # Already revealed?
+        if whisper.get("is_revealed", False):
+            revealed_by = whisper.get("revealed_by", "someone")
+            revealed_at = whisper.get("revealed_at", 0)
+            time_ago = int(time.time()) - revealed_at
+
+            if time_ago < 60:
+                time_str = f"{time_ago} seconds ago"
+            elif time_ago < 3600:
+                time_str = f"{time_ago // 60} minutes ago"
+            else:
+                time_str = f"{time_ago // 3600} hours ago"
 
-        await query.edit_message_text(
-            f"👀 This whisper was already revealed by {revealed_by} ({time_str}).",
-            reply_markup=None,
-        )
-        return
-
-    # Check recipient
-    recipient = whisper["recipient"]
-    recipient_type = whisper["recipient_type"]
-
-    is_recipient = False
-    if recipient_type == "username":
-        user_username = f"@{username}" if username else None
-        is_recipient = user_username and (user_username.lower() == recipient.lower())
-    else:  # by ID
-        is_recipient = str(user_id) == recipient
+            await query.edit_message_text(
+                f"👀 This whisper was already revealed by {revealed_by} ({time_str}).",
+                reply_markup=None,
+            )
+            return
 
-    if not is_recipient:
-        await query.answer("❌ This whisper is not for you!", show_alert=True)
-        return
+        # Check recipient
+        if not whisper.is_recipient(user_id, username):
+            await query.answer("❌ This whisper is not for you!", show_alert=True)
+            return
 
-    # Deliver whisper
-    message = whisper["message"]
-    sender_name = whisper["sender_name"]
-    word_count = whisper["word_count"]
+        # Deliver whisper
+        message = whisper["message"]
+        sender_name = whisper["sender_name"]
+        word_count = whisper["word_count"]
 
-    if word_count <= POPUP_WORD_LIMIT:
-        # ✅ Show popup
-        await query.answer(
-            f"🔓 Whisper from {sender_name}:\n\n{message}",
-            show_alert=True,
-        )
+        if word_count <= POPUP_WORD_LIMIT:
+            # ✅ Show popup
+            await query.answer(
+                f"🔓 Whisper from {sender_name}:\n\n{message}",
+                show_alert=True,
+            )
+            read_text = f"👤 {user_mention} read the whisper."
+        else:
+            # Long whisper → DM
+            try:
+                await context.bot.send_message(
+                    chat_id=user_id,
+                    text=f"🔓 Whisper from {sender_name}:\n\n{message}",
+                )
+            except Exception:
+                await query.answer(
+                    "❌ Could not deliver whisper. Please start a chat with me first!",
+                    show_alert=True,
+                )
+                return
+            read_text = f"👤 {user_mention} read the whisper. (Sent to DM)"
 
         # Save as revealed
         whisper.update(
@@ -193,42 +335,15 @@ async def handle_reveal_callback(update: Update, context: ContextTypes.DEFAULT_T
                 "revealed_at": int(time.time()),
             }
         )
-        storage.save_whisper(whisper_id, whisper)
-
-        # ⏳ wait 3s before editing message
-        await asyncio.sleep(1.5)
-
-        await query.edit_message_text(
-            f"👤 {user_mention} read the whisper.",
-            reply_markup=None,
-        )
+        await storage.asave_whisper(whisper_id, whisper)
 
+    # ⏳ edit the message a moment later, via the scheduler so nothing waits on
+    # it; only cosmetic, so it isn't worth persisting across a restart
+    if query.inline_message_id:
+        target = {"inline_message_id": query.inline_message_id}
     else:
-        # Long whisper → DM
-        try:
-            await context.bot.send_message(
-                chat_id=user_id,
-                text=f"🔓 Whisper from {sender_name}:\n\n{message}",
-            )
-            whisper.update(
-                {
-                    "is_revealed": True,
-                    "revealed_by": user_mention,
-                    "revealed_at": int(time.time()),
-                }
-            )
-            storage.save_whisper(whisper_id, whisper)
-
-            await asyncio.sleep(1.5)
-            await query.edit_message_text(
-                f"👤 {user_mention} read the whisper. (Sent to DM)",
-                reply_markup=None,
-            )
-        except Exception:
-            await query.answer(
-                "❌ Could not deliver whisper. Please start a chat with me first!",
-                show_alert=True,
-            )
+        target = {"chat_id": query.message.chat_id, "message_id": query.message.message_id}
+    await scheduler.schedule("edit_message_text", 1.5, persist=False, text=read_text, **target)
 
 
 # ---------------------------
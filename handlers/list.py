@@ -1,24 +1,96 @@
 from telegram import Update
 from telegram.ext import ContextTypes
 from storage import storage
-from utils.keyboards import get_whisper_action_keyboard
+from utils.keyboards import get_list_page_keyboard
+
+# Telegram rejects messages longer than this
+MESSAGE_LIMIT = 4096
+# Most whispers fetched per page; the size budget usually cuts in first
+PAGE_FETCH = 30
+
+HEADER = "📋 Your pending whispers:\n\n"
+FOOTER = "\nUse /create to make more whispers!"
+
+
+def format_whisper_line(whisper) -> str:
+    status = "✅" if whisper.get("is_revealed") else "⏳"
+    recipient = whisper.recipient_label or "Unknown"
+    media_count = len(whisper.get("media_items", []))
+    return f"• ID: {whisper['id']} | To: {recipient} | Media: {media_count} | {status}\n"
+
+
+def whisper_cursor(whisper) -> str:
+    return f"{whisper.get('created_at') or 0}:{whisper['id']}"
+
+
+async def build_list_page(user_id: int, cursor=None, direction="next"):
+    """Render one /list page, newest first, filling up to the message size limit.
+
+    Returns (text, keyboard), or (None, None) if the user has no whispers.
+    """
+    whispers, has_more = await storage.aget_whispers_page(
+        cursor=cursor, direction=direction, limit=PAGE_FETCH, sender_id=user_id
+    )
+    if not whispers:
+        return None, None
+
+    lines = [format_whisper_line(whisper) for whisper in whispers]
+    budget = MESSAGE_LIMIT - len(HEADER) - len(FOOTER)
+
+    # Keep the whispers nearest the cursor: the start of the page when
+    # moving to older ones, the end when moving back to newer ones.
+    order = range(len(lines)) if direction == "next" else range(len(lines) - 1, -1, -1)
+    kept = []
+    for i in order:
+        if len(lines[i]) > budget:
+            break
+        budget -= len(lines[i])
+        kept.append(i)
+    kept.sort()
+    truncated = len(kept) < len(lines)
+
+    first, last = whispers[kept[0]], whispers[kept[-1]]
+    if direction == "next":
+        has_prev, has_next = cursor is not None, has_more or truncated
+    else:
+        has_prev, has_next = has_more or truncated, True
+
+    text = HEADER + "".join(lines[i] for i in kept) + FOOTER
+    keyboard = get_list_page_keyboard(
+        user_id,
+        whisper_cursor(first) if has_prev else None,
+        whisper_cursor(last) if has_next else None,
+    )
+    return text, keyboard
+
 
 async def list_whispers(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """List all whispers for the user"""
+    """List the user's whispers, one page at a time"""
     user_id = update.effective_user.id
-    whispers = storage.get_user_whispers(user_id, as_sender=True)
-    
-    if not whispers:
+    text, keyboard = await build_list_page(user_id)
+
+    if text is None:
         await update.message.reply_text("📭 You don't have any pending whispers.")
         return
-    
-    message = "📋 Your pending whispers:\n\n"
-    for whisper in whispers:
-        status = "✅" if whisper.get("is_revealed") else "⏳"
-        recipient = whisper.get("recipient", "Unknown")
-        media_count = len(whisper.get("media_items", []))
-        
-        message += f"• ID: {whisper['id']} | To: {recipient} | Media: {media_count} | {status}\n"
-    
-    message += "\nUse /create to make more whispers!"
-    await update.message.reply_text(message)
+
+    await update.message.reply_text(text, reply_markup=keyboard)
+
+
+async def list_page_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle Prev/Next on a /list message; callback data is list:user:direction:cursor"""
+    query = update.callback_query
+    _, owner_id, direction, raw_cursor = query.data.split(":", 3)
+
+    if int(owner_id) != query.from_user.id:
+        await query.answer("❌ This list belongs to someone else.", show_alert=True)
+        return
+    await query.answer()
+
+    created_at, whisper_id = raw_cursor.split(":", 1)
+    direction = "next" if direction == "n" else "prev"
+    text, keyboard = await build_list_page(query.from_user.id, (int(created_at), whisper_id), direction)
+
+    if text is None:
+        await query.edit_message_text("📭 You don't have any pending whispers.")
+        return
+    await query.edit_message_text(text, reply_markup=keyboard)
@@ -1,12 +1,13 @@
 from telegram import Update
 from telegram.ext import ContextTypes
-from storage import storage
 from utils.keyboards import get_notifications_keyboard
+from utils.locks import user_locks
+from utils.registry import user_registry
 
 async def notifications(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Show notification settings"""
     user_id = update.effective_user.id
-    user_data = storage.get_user(user_id)
+    user_data = await user_registry.get(user_id)
     
     if not user_data:
         await update.message.reply_text("❌ Please start the bot first with /start")
@@ -32,17 +33,17 @@ async def notifications_callback(update: Update, context: ContextTypes.DEFAULT_T
     await query.answer()
     
     user_id = query.from_user.id
-    user_data = storage.get_user(user_id)
+    async with user_locks.lock(user_id):
+        user_data = await user_registry.get(user_id)
     
-    if user_data:
-        # Toggle notifications
-        user_data["notifications_enabled"] = not user_data.get("notifications_enabled", True)
-        storage.save_user(user_id, user_data)
+        if user_data:
+            # Toggle notifications
+            user_data = await user_registry.update(user_id, notifications_enabled=not user_data.get("notifications_enabled", True))
         
-        notifications_enabled = user_data["notifications_enabled"]
-        status = "enabled" if notifications_enabled else "disabled"
+            notifications_enabled = user_data["notifications_enabled"]
+            status = "enabled" if notifications_enabled else "disabled"
         
-        await query.edit_message_text(
-            f"✅ Notifications are now {status}.",
-            reply_markup=get_notifications_keyboard(notifications_enabled)
-        )
+            await query.edit_message_text(
+                f"✅ Notifications are now {status}.",
+                reply_markup=get_notifications_keyboard(notifications_enabled)
+            )
@@ -1,12 +1,13 @@
 from telegram import Update
 from telegram.ext import ContextTypes
-from storage import storage
 from utils.keyboards import get_privacy_keyboard
+from utils.locks import user_locks
+from utils.registry import user_registry
 
 async def privacy(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Show privacy settings"""
     user_id = update.effective_user.id
-    user_data = storage.get_user(user_id)
+    user_data = await user_registry.get(user_id)
     
     if not user_data:
         await update.message.reply_text("❌ Please start the bot first with /start")
@@ -32,17 +33,17 @@ async def privacy_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
     
     user_id = query.from_user.id
-    user_data = storage.get_user(user_id)
+    async with user_locks.lock(user_id):
+        user_data = await user_registry.get(user_id)
     
-    if user_data:
-        # Toggle privacy mode
-        user_data["privacy_mode"] = not user_data.get("privacy_mode", False)
-        storage.save_user(user_id, user_data)
+        if user_data:
+            # Toggle privacy mode
+            user_data = await user_registry.update(user_id, privacy_mode=not user_data.get("privacy_mode", False))
         
-        privacy_enabled = user_data["privacy_mode"]
-        status = "enabled" if privacy_enabled else "disabled"
+            privacy_enabled = user_data["privacy_mode"]
+            status = "enabled" if privacy_enabled else "disabled"
         
-        await query.edit_message_text(
-            f"✅ Privacy mode is now {status}.",
-            reply_markup=get_privacy_keyboard(privacy_enabled)
-        )
+            await query.edit_message_text(
+                f"✅ Privacy mode is now {status}.",
+                reply_markup=get_privacy_keyboard(privacy_enabled)
+            )
@@ -1,4 +1,4 @@
-import asyncio
+import time
 from telegram import (
     Update,
     InputMediaPhoto,
@@ -8,17 +8,11 @@ from telegram import (
 )
 from telegram.ext import CommandHandler, ContextTypes
 from storage import storage
+from utils.locks import whisper_locks
+from utils.scheduler import scheduler
 
-
-async def auto_delete(sent_messages, confirm_msg, delay: int = 30):
-    """Background task to auto-delete messages after delay."""
-    await asyncio.sleep(delay)
-    try:
-        for msg in sent_messages:
-            await msg.delete()
-        await confirm_msg.delete()
-    except Exception:
-        pass  # ignore if already deleted
+# Revealed content is deleted this long after it is shown
+AUTO_DELETE_SECONDS = 30
 
 
 async def reveal_whisper(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -42,77 +36,92 @@ async def reveal_whisper(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     whisper_id = context.args[0].strip()
-    whisper = storage.get_whisper(whisper_id)
-
-    if not whisper:
-        await update.message.reply_text("❌ Whisper not found.")
-        return
-
-    if whisper.get("is_revealed"):
-        await update.message.reply_text("⚠️ This whisper has already been revealed.")
-        return
-
-    recipient_id = str(whisper.get("recipient_id"))
-    if recipient_id != str(update.effective_user.id):
-        await update.message.reply_text("🚫 You are not the recipient of this whisper.")
-        return
-
-    media_items = whisper.get("media_items", [])
-    sent_messages = []
-
-    if len(media_items) == 1:
-        item = media_items[0]
-        if item["type"] == "photo":
-            msg = await update.message.reply_photo(item["file_id"], caption=item.get("caption"))
-        elif item["type"] == "video":
-            msg = await update.message.reply_video(item["file_id"], caption=item.get("caption"))
-        elif item["type"] == "document":
-            msg = await update.message.reply_document(item["file_id"], caption=item.get("caption"))
-        elif item["type"] == "audio":
-            msg = await update.message.reply_audio(item["file_id"], caption=item.get("caption"))
-        elif item["type"] == "voice":
-            msg = await update.message.reply_voice(item["file_id"], caption=item.get("caption"))
-        elif item["type"] == "text":
-            msg = await update.message.reply_text(item["text"])
-        sent_messages.append(msg)
-
-    else:
-        album = []
-        standalone_items = []
-
-        for i, item in enumerate(media_items):
-            caption = item.get("caption") if i == 0 else None
+    # Held until the whisper is marked revealed, so it is delivered only once
+    async with whisper_locks.lock(whisper_id):
+        whisper = await storage.aget_whisper(whisper_id)
+
+        if not whisper:
+            await update.message.reply_text("❌ Whisper not found.")
+            return
+
+        if whisper.get("is_revealed"):
+            await update.message.reply_text("⚠️ This whisper has already been revealed.")
+            return
+
+        if not whisper.is_recipient(update.effective_user.id, update.effective_user.username):
+            await update.message.reply_text("🚫 You are not the recipient of this whisper.")
+            return
+
+        # Inline text whispers have nothing to send here; their reveal
+        # button shows the message and records who read it
+        if "message" in whisper:
+            await update.message.reply_text(
+                "ℹ️ This whisper was sent inline. Tap \"🔓 Reveal Whisper\" under it to read it."
+            )
+            return
+
+        media_items = whisper.get("media_items", [])
+        sent_messages = []
+
+        if len(media_items) == 1:
+            item = media_items[0]
             if item["type"] == "photo":
-                album.append(InputMediaPhoto(item["file_id"], caption=caption))
+                msg = await update.message.reply_photo(item["file_id"], caption=item.get("caption"))
             elif item["type"] == "video":
-                album.append(InputMediaVideo(item["file_id"], caption=caption))
-            else:
-                standalone_items.append((item, caption))
-
-        if album:
-            msgs = await update.message.reply_media_group(album)
-            sent_messages.extend(msgs)
-
-        for item, caption in standalone_items:
-            if item["type"] == "document":
-                msg = await update.message.reply_document(item["file_id"], caption=caption)
+                msg = await update.message.reply_video(item["file_id"], caption=item.get("caption"))
+            elif item["type"] == "document":
+                msg = await update.message.reply_document(item["file_id"], caption=item.get("caption"))
             elif item["type"] == "audio":
-                msg = await update.message.reply_audio(item["file_id"], caption=caption)
+                msg = await update.message.reply_audio(item["file_id"], caption=item.get("caption"))
             elif item["type"] == "voice":
-                msg = await update.message.reply_voice(item["file_id"], caption=caption)
+                msg = await update.message.reply_voice(item["file_id"], caption=item.get("caption"))
             elif item["type"] == "text":
                 msg = await update.message.reply_text(item["text"])
             sent_messages.append(msg)
 
-    whisper["is_revealed"] = True
-    storage.save_whisper(whisper_id, whisper)
+        else:
+            album = []
+            standalone_items = []
+
+            for i, item in enumerate(media_items):
+                caption = item.get("caption") if i == 0 else None
+                if item["type"] == "photo":
+                    album.append(InputMediaPhoto(item["file_id"], caption=caption))
+                elif item["type"] == "video":
+                    album.append(InputMediaVideo(item["file_id"], caption=caption))
+                else:
+                    standalone_items.append((item, caption))
+
+            if album:
+                msgs = await update.message.reply_media_group(album)
+                sent_messages.extend(msgs)
+
+            for item, caption in standalone_items:
+                if item["type"] == "document":
+                    msg = await update.message.reply_document(item["file_id"], caption=caption)
+                elif item["type"] == "audio":
+                    msg = await update.message.reply_audio(item["file_id"], caption=caption)
+                elif item["type"] == "voice":
+                    msg = await update.message.reply_voice(item["file_id"], caption=caption)
+                elif item["type"] == "text":
+                    msg = await update.message.reply_text(item["text"])
+                sent_messages.append(msg)
+
+        whisper["is_revealed"] = True
+        whisper["revealed_at"] = int(time.time())
+        await storage.asave_whisper(whisper_id, whisper)
 
     confirm_msg = await update.message.reply_text(
-        "🎉 Whisper revealed successfully!\n\n⚠️ This content will be auto-deleted in 30 seconds."
+        f"🎉 Whisper revealed successfully!\n\n⚠️ This content will be auto-deleted in {AUTO_DELETE_SECONDS} seconds."
     )
 
-    # 🚀 Run auto-delete as background task (non-blocking)
-    asyncio.create_task(auto_delete(sent_messages, confirm_msg, delay=30))
+    # 🗑 Delete the revealed content later; the scheduler persists this, so a
+    # restart in between doesn't leave it visible
+    message_ids = [msg.message_id for msg in sent_messages] + [confirm_msg.message_id]
+    await scheduler.schedule(
+        "delete_messages", AUTO_DELETE_SECONDS, durable=True,
+        chat_id=update.effective_chat.id, message_ids=message_ids,
+    )
 
 
 # Add handler
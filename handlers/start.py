@@ -1,7 +1,10 @@
 from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
 from telegram.ext import ContextTypes
+from utils.registry import user_registry
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await user_registry.register(update.effective_user)
+
     # Banner image (you can replace this with your own)
     banner_url = "https://files.catbox.moe/0k53oj.jpg"
 
@@ -0,0 +1,16 @@
+from telegram import Update
+from telegram.ext import ContextTypes
+from utils.registry import user_registry
+
+
+async def record_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Remember the id, username and first name of whoever sent an update.
+
+    Registered as a TypeHandler in an early group, so it sees every update
+    before the real handlers. The registry only writes users whose profile
+    changed, in periodic batches.
+    """
+    user = update.effective_user
+    if user is None or user.is_bot:
+        return
+    await user_registry.register(user)
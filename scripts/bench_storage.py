@@ -0,0 +1,385 @@
+"""Benchmark the storage backends against synthetic datasets of growing size.
+
+For each dataset size a whispers.json is generated once (70% inline text
+whispers, 30% /create media whispers, as the handlers write them) and
+cached under the work directory. Every backend then gets its own copy,
+and one subprocess per backend and size times:
+
+  full_load            open the backend, get_all_whispers(), close
+  get_whisper          random existing whispers
+  save_whisper         marking random whispers revealed
+  get_next_whisper_id
+  get_user_whispers    random senders
+
+Each operation runs up to --ops times or until --budget seconds are used,
+whichever comes first, so the slow cases (a non-resident JSON file with a
+million records) still finish. The report gives throughput, latency
+percentiles and the peak RSS of each subprocess. Running each case in its
+own process keeps one case's memory out of the next one's peak.
+
+Results can be saved with --save and compared with a later run via
+--baseline; operations whose median latency grew by more than --tolerance
+are reported and the exit status is 1.
+
+Usage: python -m scripts.bench_storage [--sizes 1000,10000,100000,1000000]
+           [--backends json,json-resident,log,sqlite,sharded] [--ops 1000]
+           [--budget 10] [--workdir data/bench] [--save results.json]
+           [--baseline results.json] [--tolerance 0.25]
+           [--snapshot-format json|json-compact|compact|compact-zlib]
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+BACKENDS = ("json", "json-resident", "log", "sqlite", "sharded")
+SIZES = (1000, 10000, 100000, 1000000)
+OPERATIONS = ("full_load", "get_whisper", "save_whisper", "get_next_whisper_id", "get_user_whispers")
+# Share of /create media whispers in generated datasets
+MEDIA_SHARE = 0.3
+# Whisper IDs and user IDs kept for the benchmarks to pick from
+SAMPLE_SIZE = 1000
+SEED = 1234
+MEDIA_TYPES = ("photo", "video", "document", "audio", "voice", "text")
+WORDS = "hey see you at the party tonight dont tell anyone about the surprise ok".split()
+
+
+def generate_dataset(size: int, path: str) -> Dict:
+    """Write a whispers.json of `size` whispers; returns ID samples for the benchmarks"""
+    rng = random.Random(SEED)
+    user_count = max(100, size // 10)
+    users = {
+        str(100000 + i): {"id": 100000 + i, "username": f"user{i}", "first_name": f"User {i}"}
+        for i in range(user_count)
+    }
+    user_ids = list(users)
+    now = int(time.time())
+
+    whispers = {}
+    next_id = 1
+    for _ in range(size):
+        sender, recipient = rng.sample(user_ids, 2)
+        created_at = now - rng.randrange(90 * 86400)
+        revealed = rng.random() < 0.5
+        if rng.random() < MEDIA_SHARE:
+            whisper_id = str(next_id)
+            next_id += 1
+            items = []
+            for _ in range(rng.randint(1, 4)):
+                media_type = rng.choice(MEDIA_TYPES)
+                items.append({
+                    "type": media_type,
+                    "file_id": None if media_type == "text" else "AgAC" + "%028x" % rng.getrandbits(112),
+                    "caption": None,
+                    "text": " ".join(rng.choices(WORDS, k=8)) if media_type == "text" else None,
+                })
+            whisper = {
+                "id": int(whisper_id),
+                "sender_id": int(sender),
+                "recipient_id": int(recipient),
+                "recipient_display": f"@{users[recipient]['username']}",
+                "media_items": items,
+                "created_at": created_at,
+                "is_revealed": revealed,
+            }
+        else:
+            whisper_id = "%016x" % rng.getrandbits(64)
+            message = " ".join(rng.choices(WORDS, k=rng.randint(3, 30)))
+            whisper = {
+                "id": whisper_id,
+                "sender_id": int(sender),
+                "sender_name": users[sender]["first_name"],
+                "recipient": f"@{users[recipient]['username']}",
+                "recipient_type": "username",
+                "recipient_id": int(recipient),
+                "message": message,
+                "created_at": created_at,
+                "is_revealed": revealed,
+                "revealed_by": f"@{users[recipient]['username']}" if revealed else None,
+                "revealed_at": created_at + 60 if revealed else None,
+                "word_count": len(message.split()),
+            }
+        whispers[whisper_id] = whisper
+
+    # Same layout JSONStorage writes
+    with open(path, 'w') as f:
+        json.dump({"users": users, "whispers": whispers, "next_whisper_id": next_id}, f, indent=4)
+
+    return {
+        "whisper_ids": rng.sample(list(whispers), min(SAMPLE_SIZE, size)),
+        "user_ids": rng.sample(user_ids, min(SAMPLE_SIZE, user_count)),
+    }
+
+
+def open_backend(backend: str, case_dir: str):
+    from storage import JSONStorage, LogStorage, ShardedStorage, SQLiteStorage
+
+    if backend == "json":
+        return JSONStorage(os.path.join(case_dir, "whispers.json"), resident=False)
+    if backend == "json-resident":
+        return JSONStorage(os.path.join(case_dir, "whispers.json"), resident=True, reload_interval=0)
+    if backend == "log":
+        return LogStorage(os.path.join(case_dir, "whispers.json"))
+    if backend == "sqlite":
+        return SQLiteStorage(os.path.join(case_dir, "whispers.db"))
+    if backend == "sharded":
+        return ShardedStorage(os.path.join(case_dir, "shards"))
+    raise ValueError(f"Unknown backend: {backend!r}")
+
+
+def prepare_case(backend: str, dataset_path: str, case_dir: str):
+    """Load a generated dataset into a fresh copy of one backend's files"""
+    if os.path.exists(case_dir):
+        shutil.rmtree(case_dir)
+    os.makedirs(case_dir)
+
+    if backend in ("json", "json-resident", "log"):
+        from config import Config
+        from utils import snapshot
+
+        path = os.path.join(case_dir, "whispers.json")
+        if Config.SNAPSHOT_FORMAT == "json":
+            shutil.copyfile(dataset_path, path)
+        else:
+            snapshot.dump(path, snapshot.load(dataset_path), Config.SNAPSHOT_FORMAT)
+        return
+
+    db = open_backend(backend, case_dir)
+    try:
+        if backend == "sqlite":
+            db.import_json(dataset_path)
+        else:
+            with open(dataset_path, 'r') as f:
+                data = json.load(f)
+            by_shard: Dict[int, Dict] = {}
+            for whisper_id, whisper in data["whispers"].items():
+                by_shard.setdefault(db._shard_index(whisper_id), {})[whisper_id] = whisper
+            for index, shard in enumerate(db.shards):
+                shard._write_file({"users": {}, "whispers": by_shard.get(index, {}), "next_whisper_id": 1})
+            db.users._write_file({"users": data["users"], "whispers": {}, "next_whisper_id": data["next_whisper_id"]})
+    finally:
+        db.close()
+
+
+def measure(operation: Callable[[int], Optional[float]], ops: int, budget: float) -> Dict:
+    """Run operation(i) up to `ops` times within `budget` seconds; latencies in ms.
+
+    An operation that returns a number reports its own latency in seconds,
+    so setup work inside it is left out of the timing.
+    """
+    latencies: List[float] = []
+    started = time.perf_counter()
+    while len(latencies) < ops and time.perf_counter() - started < budget:
+        start = time.perf_counter()
+        elapsed = operation(len(latencies))
+        latencies.append(time.perf_counter() - start if elapsed is None else elapsed)
+
+    latencies.sort()
+    total = sum(latencies)
+
+    def percentile(q: float) -> float:
+        return latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000
+
+    return {
+        "n": len(latencies),
+        "ops_per_s": len(latencies) / total if total else 0.0,
+        "p50_ms": percentile(0.5),
+        "p95_ms": percentile(0.95),
+        "p99_ms": percentile(0.99),
+    }
+
+
+def run_case(backend: str, case_dir: str, samples: Dict, ops: int, budget: float) -> Dict:
+    whisper_ids = samples["whisper_ids"]
+    user_ids = samples["user_ids"]
+    rng = random.Random(SEED)
+    results = {}
+    # Import the storage module before anything is timed
+    import storage  # noqa: F401
+
+    def full_load(i):
+        db = open_backend(backend, case_dir)
+        db.get_all_whispers()
+        db.close()
+
+    # Loading everything is by far the slowest operation
+    results["full_load"] = measure(full_load, min(ops, 10), budget)
+
+    db = open_backend(backend, case_dir)
+    try:
+        def get_whisper(i):
+            db.get_whisper(rng.choice(whisper_ids))
+
+        def save_whisper(i):
+            whisper_id = whisper_ids[i % len(whisper_ids)]
+            whisper = db.get_whisper(whisper_id)
+            whisper.update(is_revealed=True, revealed_at=int(time.time()))
+            start = time.perf_counter()
+            db.save_whisper(whisper_id, whisper)
+            return time.perf_counter() - start
+
+        def get_next_whisper_id(i):
+            db.get_next_whisper_id()
+
+        def get_user_whispers(i):
+            db.get_user_whispers(int(rng.choice(user_ids)))
+
+        results["get_whisper"] = measure(get_whisper, ops, budget)
+        results["save_whisper"] = measure(save_whisper, ops, budget)
+        results["get_next_whisper_id"] = measure(get_next_whisper_id, ops, budget)
+        results["get_user_whispers"] = measure(get_user_whispers, ops, budget)
+    finally:
+        db.close()
+
+    return {
+        "operations": results,
+        # ru_maxrss is in KiB on Linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def child_env(workdir: str, snapshot_format: str) -> Dict[str, str]:
+    """Keep the module-level storage instance away from the real data files"""
+    env = dict(os.environ)
+    env.update(
+        DATA_FILE=os.path.join(workdir, "unused", "whispers.json"),
+        STORAGE_BACKEND="json",
+        WRITE_BEHIND="0",
+        SNAPSHOT_FORMAT=snapshot_format,
+    )
+    return env
+
+
+def run_child(workdir: str, snapshot_format: str, *args: str) -> str:
+    result = subprocess.run(
+        [sys.executable, "-m", "scripts.bench_storage", *args],
+        env=child_env(workdir, snapshot_format),
+        stdout=subprocess.PIPE,
+        check=True,
+        text=True,
+    )
+    return result.stdout
+
+
+def dataset(workdir: str, size: int) -> Tuple[str, Dict]:
+    """Generated dataset for a size, reused from earlier runs when present"""
+    directory = os.path.join(workdir, f"dataset-{size}")
+    path = os.path.join(directory, "whispers.json")
+    samples_path = os.path.join(directory, "samples.json")
+    if not os.path.exists(samples_path):
+        os.makedirs(directory, exist_ok=True)
+        print(f"Generating {size} whispers...", file=sys.stderr)
+        samples = generate_dataset(size, path)
+        with open(samples_path, 'w') as f:
+            json.dump(samples, f)
+    with open(samples_path, 'r') as f:
+        return path, json.load(f)
+
+
+def format_results(results: List[Dict]) -> str:
+    lines = [
+        f"{'backend':<22} {'size':>8} {'operation':<20} {'n':>5} {'ops/s':>10} "
+        f"{'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'peak RSS':>9}"
+    ]
+    for case in results:
+        for name in OPERATIONS:
+            op = case["operations"][name]
+            lines.append(
+                f"{case['backend']:<22} {case['size']:>8} {name:<20} {op['n']:>5} {op['ops_per_s']:>10.1f} "
+                f"{op['p50_ms']:>9.3f} {op['p95_ms']:>9.3f} {op['p99_ms']:>9.3f} {case['peak_rss_mb']:>7.0f}MB"
+            )
+    return "\n".join(lines)
+
+
+def find_regressions(results: List[Dict], baseline: List[Dict], tolerance: float) -> List[str]:
+    """Operations whose median latency grew by more than `tolerance` over the baseline"""
+    previous = {(case["backend"], case["size"]): case for case in baseline}
+    regressions = []
+    for case in results:
+        before = previous.get((case["backend"], case["size"]))
+        if before is None:
+            continue
+        for name, op in case["operations"].items():
+            old = before["operations"].get(name)
+            if old and old["p50_ms"] and op["p50_ms"] > old["p50_ms"] * (1 + tolerance):
+                regressions.append(
+                    f"{case['backend']} {case['size']} {name}: "
+                    f"p50 {old['p50_ms']:.3f}ms -> {op['p50_ms']:.3f}ms"
+                )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the storage backends")
+    parser.add_argument("--sizes", default=",".join(map(str, SIZES)))
+    parser.add_argument("--backends", default=",".join(BACKENDS))
+    parser.add_argument("--ops", type=int, default=1000, help="maximum runs per operation")
+    parser.add_argument("--budget", type=float, default=10, help="maximum seconds per operation")
+    parser.add_argument("--workdir", default=os.path.join("data", "bench"))
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="compare with results saved by an earlier run")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--snapshot-format", default="json", help="SNAPSHOT_FORMAT for the file-based backends")
+    # Internal: the per-case subprocesses
+    parser.add_argument("--prepare", nargs=3, metavar=("BACKEND", "DATASET", "CASE_DIR"), help=argparse.SUPPRESS)
+    parser.add_argument("--case", nargs=3, metavar=("BACKEND", "CASE_DIR", "SAMPLES"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.prepare:
+        prepare_case(*args.prepare)
+        return
+    if args.case:
+        backend, case_dir, samples_path = args.case
+        with open(samples_path, 'r') as f:
+            samples = json.load(f)
+        print(json.dumps(run_case(backend, case_dir, samples, args.ops, args.budget)))
+        return
+
+    backends = args.backends.split(",")
+    for backend in backends:
+        if backend not in BACKENDS:
+            parser.error(f"unknown backend {backend!r}, choose from {', '.join(BACKENDS)}")
+
+    results = []
+    for size in map(int, args.sizes.split(",")):
+        dataset_path, _ = dataset(args.workdir, size)
+        samples_path = os.path.join(os.path.dirname(dataset_path), "samples.json")
+        for backend in backends:
+            case_dir = os.path.join(args.workdir, f"{backend}-{size}")
+            print(f"Benchmarking {backend} with {size} whispers...", file=sys.stderr)
+            run_child(args.workdir, args.snapshot_format, "--prepare", backend, dataset_path, case_dir)
+            output = run_child(
+                args.workdir, args.snapshot_format, "--case", backend, case_dir, samples_path,
+                "--ops", str(args.ops), "--budget", str(args.budget),
+            )
+            case = json.loads(output.strip().splitlines()[-1])
+            label = backend
+            if args.snapshot_format != "json" and backend != "sqlite":
+                label = f"{backend}+{args.snapshot_format}"
+            case.update(backend=label, size=size)
+            results.append(case)
+            shutil.rmtree(case_dir)
+
+    print(format_results(results))
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=4)
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            regressions = find_regressions(results, json.load(f), args.tolerance)
+        if regressions:
+            print("\nRegressions:\n" + "\n".join(regressions))
+            sys.exit(1)
+        print("\nNo regressions against the baseline.")
+
+
+if __name__ == "__main__":
+    main()
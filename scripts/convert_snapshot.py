@@ -0,0 +1,49 @@
+"""Convert a data file between the JSON and compact snapshot formats.
+
+The input format is detected from the file itself. Without --format,
+JSON is converted to "compact" and compact snapshots back to indented
+"json". Stop the bot first: it may rewrite the file while this runs.
+
+Usage: python -m scripts.convert_snapshot SOURCE DESTINATION
+           [--format json|json-compact|compact|compact-zlib]
+"""
+import argparse
+import os
+import time
+
+from utils import snapshot
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert a whispers data file between snapshot formats")
+    parser.add_argument("source")
+    parser.add_argument("destination")
+    parser.add_argument("--format", choices=snapshot.FORMATS)
+    args = parser.parse_args()
+
+    with open(args.source, 'rb') as f:
+        raw = f.read()
+    source_format = snapshot.detect_format(raw)
+    target_format = args.format or ("compact" if source_format == "json" else "json")
+
+    start = time.perf_counter()
+    data = snapshot.loads(raw)
+    load_time = time.perf_counter() - start
+
+    snapshot.dump(args.destination, data, target_format, durable=True)
+
+    # Time a load of the result, for comparison
+    start = time.perf_counter()
+    snapshot.load(args.destination)
+    converted_load_time = time.perf_counter() - start
+
+    print(
+        f"{len(data.get('whispers', {}))} whispers, {len(data.get('users', {}))} users\n"
+        f"{args.source} ({source_format}): {len(raw) / 1024:.0f} KiB, loaded in {load_time:.3f}s\n"
+        f"{args.destination} ({target_format}): {os.path.getsize(args.destination) / 1024:.0f} KiB, "
+        f"loads in {converted_load_time:.3f}s"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,24 @@
+"""One-shot import of a whispers.json file into the SQLite backend.
+
+Usage: python -m scripts.import_json [data/whispers.json] [data/whispers.db]
+"""
+import sys
+from config import Config
+from storage import SQLiteStorage
+
+
+def main():
+    json_path = sys.argv[1] if len(sys.argv) > 1 else Config.DATA_FILE
+    db_path = sys.argv[2] if len(sys.argv) > 2 else Config.SQLITE_FILE
+
+    db = SQLiteStorage(db_path)
+    try:
+        counts = db.import_json(json_path)
+    finally:
+        db.close()
+
+    print(f"Imported {counts['users']} users and {counts['whispers']} whispers into {db_path}")
+
+
+if __name__ == "__main__":
+    main()
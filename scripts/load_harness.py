@@ -0,0 +1,456 @@
+"""Drive the real bot application with synthetic traffic against a fake Bot API.
+
+The application is built by bot.build_application(), with every handler
+and background task of a normal run, but its Bot API calls go to a local
+stand-in server. The stand-in answers like Telegram, after a configurable
+latency. It replies 429 with retry_after once --api-rate requests per
+second are exceeded, and also for a random --flood-share of calls.
+
+Virtual clients play scenarios as a mix of simulated users:
+
+  inline   an inline query per keystroke (a burst, --keystroke-ms apart),
+           then the chosen result that commits the whisper
+  reveal   the recipient (sometimes preceded by a stranger) taps the
+           reveal button of a whisper sent earlier
+  create   /create, a recipient, one to three media messages, /done
+  list     /list
+
+Apart from keystroke bursts, each client waits for an update to be handled
+before sending its next one, the way a person waits for the reply.
+Updates go straight onto the application's update queue, as in webhook
+mode. The report gives end-to-end updates per second and the latency of
+each update, from enqueue to its handlers finishing. It also lists the
+per-handler and Bot API timings from utils.metrics, and the 429s the
+fake API handed out.
+
+The run uses a scratch data directory, so real data is never touched.
+
+Usage: python -m scripts.load_harness [--duration 30] [--clients 50] [--users 500]
+           [--concurrency 64] [--backend json] [--mix inline=5,reveal=3,create=1,list=1]
+           [--api-latency-ms 30] [--api-jitter-ms 20] [--api-rate 0]
+           [--flood-share 0] [--retry-after 1] [--keystroke-ms 80]
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+from urllib.parse import parse_qsl
+
+BOT_USER = {"id": 8369183040, "is_bot": True, "first_name": "Whispey", "username": "WhispeyBot"}
+FIRST_USER_ID = 7000000000
+WORDS = "hey see you at the party tonight dont tell anyone about the surprise ok".split()
+# Methods whose result is the sent or edited message
+MESSAGE_METHODS = {
+    "sendMessage", "sendPhoto", "sendVideo", "sendDocument", "sendAudio", "sendVoice",
+    "editMessageText", "editMessageReplyMarkup", "editMessageCaption", "editMessageMedia",
+}
+
+
+class FakeBotAPI:
+    """Local HTTP server that answers Bot API calls like Telegram would"""
+
+    def __init__(self, latency: float, jitter: float, rate: float, flood_share: float, retry_after: int):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate = rate
+        self.flood_share = flood_share
+        self.retry_after = retry_after
+        self.calls: Dict[str, int] = {}
+        self.floods: Dict[str, int] = {}
+        # Results of every answerInlineQuery, by inline query ID
+        self.inline_answers: Dict[str, List[Dict]] = {}
+        self.port = 0
+        self._message_ids = itertools.count(1)
+        self._tokens = rate
+        self._updated = time.monotonic()
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle_connection, "127.0.0.1", 0)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    def _flooded(self) -> bool:
+        """Whether this call exceeds the rate limit or draws a random 429"""
+        if self.flood_share and random.random() < self.flood_share:
+            return True
+        if not self.rate:
+            return False
+        now = time.monotonic()
+        self._tokens = min(self.rate, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        if self._tokens < 1:
+            return True
+        self._tokens -= 1
+        return False
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                _, target, _ = request_line.decode("latin-1").split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+                method = target.rsplit("/", 1)[-1]
+                payload = await self.call(method, self._params(headers.get("content-type", ""), body))
+                data = json.dumps(payload).encode()
+                status = "200 OK" if payload["ok"] else "429 Too Many Requests"
+                writer.write(
+                    f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\n"
+                    f"Content-Length: {len(data)}\r\n\r\n".encode("latin-1") + data
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    def _params(content_type: str, body: bytes) -> Dict:
+        if content_type.startswith("application/json"):
+            return json.loads(body or b"{}")
+        if content_type.startswith("application/x-www-form-urlencoded"):
+            params = {}
+            for key, value in parse_qsl(body.decode()):
+                try:
+                    params[key] = json.loads(value)
+                except ValueError:
+                    params[key] = value
+            return params
+        # Multipart uploads: the harness doesn't look at their fields
+        return {}
+
+    async def call(self, method: str, params: Dict) -> Dict:
+        """The Bot API response to one call, after the simulated latency"""
+        await asyncio.sleep(self.latency + random.uniform(0, self.jitter))
+        self.calls[method] = self.calls.get(method, 0) + 1
+        if method != "getMe" and self._flooded():
+            self.floods[method] = self.floods.get(method, 0) + 1
+            return {
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after},
+            }
+
+        if method == "getMe":
+            result = dict(BOT_USER, can_join_groups=True, can_read_all_group_messages=False,
+                          supports_inline_queries=True)
+        elif method == "answerInlineQuery":
+            results = params.get("results", [])
+            self.inline_answers[str(params.get("inline_query_id"))] = results
+            result = True
+        elif method in MESSAGE_METHODS and not params.get("inline_message_id"):
+            chat_id = params.get("chat_id", 0)
+            result = {
+                "message_id": params.get("message_id") or next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": int(chat_id), "type": "private"},
+                "from": BOT_USER,
+                "text": params.get("text") or "",
+            }
+        else:
+            result = True
+        return {"ok": True, "result": result}
+
+
+class Harness:
+    """Feeds synthetic updates to the application and times their processing"""
+
+    def __init__(self, application, api: FakeBotAPI, users: int, keystroke: float):
+        self.application = application
+        self.api = api
+        self.users = [
+            {"id": FIRST_USER_ID + i, "is_bot": False, "first_name": f"Load {i}", "username": f"loaduser{i}"}
+            for i in range(users)
+        ]
+        self.keystroke = keystroke
+        # Sent inline whispers waiting for a reveal tap
+        self.pending_reveals: List[Dict] = []
+        self.latencies: List[float] = []
+        self.processed = 0
+        self._update_ids = itertools.count(1)
+        self._waiting: Dict[int, asyncio.Future] = {}
+        self._enqueued: Dict[int, float] = {}
+
+    def finished(self, update, started: float):
+        """Called by the update processor once all handlers are done with an update"""
+        update_id = getattr(update, "update_id", None)
+        enqueued = self._enqueued.pop(update_id, started)
+        self.latencies.append(time.perf_counter() - enqueued)
+        self.processed += 1
+        future = self._waiting.pop(update_id, None)
+        if future is not None and not future.done():
+            future.set_result(None)
+
+    async def send(self, kind: str, payload: Dict, wait: bool = True):
+        """Put one update on the application's queue, optionally awaiting its processing"""
+        from telegram import Update
+
+        update_id = next(self._update_ids)
+        update = Update.de_json({"update_id": update_id, kind: payload}, self.application.bot)
+        future = asyncio.get_running_loop().create_future()
+        self._waiting[update_id] = future
+        self._enqueued[update_id] = time.perf_counter()
+        await self.application.update_queue.put(update)
+        if wait:
+            await future
+        return future
+
+    @staticmethod
+    def message(user: Dict, text: Optional[str] = None, **fields) -> Dict:
+        message = {
+            "message_id": random.randrange(1, 2 ** 31),
+            "date": int(time.time()),
+            "chat": {"id": user["id"], "type": "private", "first_name": user["first_name"]},
+            "from": user,
+        }
+        if text is not None:
+            message["text"] = text
+            if text.startswith("/"):
+                command = text.split()[0]
+                message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+        message.update(fields)
+        return message
+
+    async def warm_up(self):
+        """Every simulated user sends /start, so usernames resolve to IDs"""
+        from utils.registry import user_registry
+
+        await asyncio.gather(*(self.send("message", self.message(user, "/start")) for user in self.users))
+        await user_registry.flush()
+
+    async def inline(self, user: Dict):
+        recipient = random.choice(self.users)
+        text = " ".join(random.choices(WORDS, k=random.randint(2, 8))) + f" @{recipient['username']}"
+        # Telegram sends the query after most keystrokes, and not every one
+        # of them gets processed before the next arrives
+        cut = 0
+        futures = []
+        query_id = None
+        while cut < len(text):
+            cut = min(len(text), cut + random.randint(1, 3))
+            query_id = str(random.getrandbits(63))
+            inline_query = {"id": query_id, "from": user, "query": text[:cut], "offset": ""}
+            futures.append(await self.send("inline_query", inline_query, wait=False))
+            await asyncio.sleep(self.keystroke)
+        await asyncio.gather(*futures)
+
+        results = self.api.inline_answers.pop(query_id, None)
+        if not results:
+            return  # flood-controlled, or answered from a superseded keystroke
+        inline_message_id = f"im{random.getrandbits(63)}"
+        await self.send("chosen_inline_result", {
+            "result_id": results[0]["id"],
+            "from": user,
+            "query": text,
+            "inline_message_id": inline_message_id,
+        })
+        self.pending_reveals.append(
+            {"whisper_id": results[0]["id"], "recipient": recipient, "inline_message_id": inline_message_id}
+        )
+
+    async def reveal(self, user: Dict):
+        if not self.pending_reveals:
+            return await self.inline(user)
+        whisper = self.pending_reveals.pop(random.randrange(len(self.pending_reveals)))
+        tappers = [whisper["recipient"]]
+        if random.random() < 0.3:
+            tappers.insert(0, random.choice(self.users))
+        for tapper in tappers:
+            await self.send("callback_query", {
+                "id": str(random.getrandbits(63)),
+                "from": tapper,
+                "chat_instance": "load",
+                "inline_message_id": whisper["inline_message_id"],
+                "data": f"reveal_{whisper['whisper_id']}",
+            })
+
+    async def create(self, user: Dict):
+        recipient = random.choice(self.users)
+        await self.send("message", self.message(user, "/create"))
+        await self.send("message", self.message(user, f"@{recipient['username']}"))
+        for _ in range(random.randint(1, 3)):
+            if random.random() < 0.5:
+                file_id = f"AgAC{random.getrandbits(96):024x}"
+                photo = [{"file_id": file_id, "file_unique_id": file_id[-12:], "width": 320, "height": 240}]
+                await self.send("message", self.message(user, photo=photo, caption="load test"))
+            else:
+                await self.send("message", self.message(user, " ".join(random.choices(WORDS, k=6))))
+        await self.send("message", self.message(user, "/done"))
+
+    async def list(self, user: Dict):
+        await self.send("message", self.message(user, "/list"))
+
+    async def client(self, users: List[Dict], mix: Dict[str, float], deadline: float):
+        """One virtual client playing random scenarios with its share of the users"""
+        scenarios = list(mix)
+        weights = [mix[name] for name in scenarios]
+        while time.monotonic() < deadline:
+            scenario = random.choices(scenarios, weights)[0]
+            await getattr(self, scenario)(random.choice(users))
+
+
+def timed_processor(harness_ref: List, max_concurrent_updates: int):
+    """SimpleUpdateProcessor that reports every finished update to the harness"""
+    from telegram.ext import SimpleUpdateProcessor
+
+    class TimedUpdateProcessor(SimpleUpdateProcessor):
+        async def do_process_update(self, update, coroutine):
+            started = time.perf_counter()
+            try:
+                await coroutine
+            finally:
+                if harness_ref:
+                    harness_ref[0].finished(update, started)
+
+    return TimedUpdateProcessor(max_concurrent_updates)
+
+
+def parse_mix(value: str) -> Dict[str, float]:
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        if name not in ("inline", "reveal", "create", "list"):
+            raise argparse.ArgumentTypeError(f"unknown scenario {name!r}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def percentile(values: List[float], q: float) -> float:
+    return values[min(len(values) - 1, int(q * len(values)))] * 1000 if values else 0.0
+
+
+def format_report(harness: Harness, api: FakeBotAPI, elapsed: float) -> str:
+    from utils.metrics import metrics
+
+    latencies = sorted(harness.latencies)
+    lines = [
+        f"Updates: {harness.processed} in {elapsed:.1f}s = {harness.processed / elapsed:.1f} updates/s",
+        f"End-to-end latency: p50 {percentile(latencies, 0.5):.1f}ms, "
+        f"p95 {percentile(latencies, 0.95):.1f}ms, p99 {percentile(latencies, 0.99):.1f}ms, "
+        f"max {percentile(latencies, 1):.1f}ms",
+    ]
+    for title, family in (("Handlers", "handler"), ("Storage", "storage"), ("Bot API", "bot_api")):
+        lines += ["", f"{title}:"] + [f"  {line}" for line in metrics.summary(family, top=10)]
+    lines += [
+        "",
+        "Fake Bot API calls: " + ", ".join(f"{m}={n}" for m, n in sorted(api.calls.items())),
+        "429 responses: " + (", ".join(f"{m}={n}" for m, n in sorted(api.floods.items())) or "none"),
+        f"RetryAfter raised in the bot: {sum(metrics.retry_after.values())}",
+    ]
+    return "\n".join(lines)
+
+
+async def run(args):
+    # Imported here, after main() pointed the configuration at scratch files
+    from bot import build_application
+
+    api = FakeBotAPI(
+        args.api_latency_ms / 1000, args.api_jitter_ms / 1000, args.api_rate, args.flood_share, args.retry_after
+    )
+    await api.start()
+
+    harness_ref: List[Harness] = []
+    application = build_application(
+        base_url=f"http://127.0.0.1:{api.port}/bot",
+        update_processor=timed_processor(harness_ref, max(1, args.concurrency)),
+    )
+    harness = Harness(application, api, args.users, args.keystroke_ms / 1000)
+    harness_ref.append(harness)
+
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()
+    try:
+        await harness.warm_up()
+        print(f"Warmed up {args.users} users, running for {args.duration}s...", file=sys.stderr)
+        # Only count the measured phase
+        from utils.metrics import metrics
+        metrics.histograms.clear()
+        metrics.retry_after.clear()
+        api.calls.clear()
+        api.floods.clear()
+        harness.latencies.clear()
+        harness.processed = 0
+
+        started = time.monotonic()
+        deadline = started + args.duration
+        clients = [
+            harness.client(harness.users[i::args.clients], args.mix, deadline)
+            for i in range(min(args.clients, args.users))
+        ]
+        await asyncio.gather(*clients)
+        elapsed = time.monotonic() - started
+    finally:
+        await application.stop()
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+        await api.stop()
+
+    print(format_report(harness, api, elapsed))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the bot against a fake Bot API")
+    parser.add_argument("--duration", type=float, default=30, help="seconds of measured traffic")
+    parser.add_argument("--clients", type=int, default=50, help="virtual clients sending at once")
+    parser.add_argument("--users", type=int, default=500, help="simulated Telegram users")
+    parser.add_argument("--concurrency", type=int, default=64, help="CONCURRENT_UPDATES for the run (0 = sequential)")
+    parser.add_argument("--backend", default="json", help="STORAGE_BACKEND for the run")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("inline=5,reveal=3,create=1,list=1"))
+    parser.add_argument("--api-latency-ms", type=float, default=30)
+    parser.add_argument("--api-jitter-ms", type=float, default=20)
+    parser.add_argument("--api-rate", type=float, default=0, help="Bot API calls per second before 429s (0 = unlimited)")
+    parser.add_argument("--flood-share", type=float, default=0, help="share of calls answered 429 at random")
+    parser.add_argument("--retry-after", type=int, default=1, help="retry_after seconds in 429 responses")
+    parser.add_argument("--keystroke-ms", type=float, default=80, help="delay between inline keystrokes")
+    parser.add_argument("--verbose", action="store_true", help="keep the bot's own logging")
+    args = parser.parse_args()
+
+    scratch = tempfile.mkdtemp(prefix="whispey-load-")
+    os.environ.update(
+        DATA_FILE=os.path.join(scratch, "whispers.json"),
+        SQLITE_FILE=os.path.join(scratch, "whispers.db"),
+        SHARD_DIR=os.path.join(scratch, "shards"),
+        BROADCAST_STATE_FILE=os.path.join(scratch, "broadcast.json"),
+        STORAGE_BACKEND=args.backend,
+        CONCURRENT_UPDATES=str(args.concurrency),
+        BOT_MODE="polling",
+        METRICS_PORT="0",
+        WORKER_INDEX="0",
+        WORKER_COUNT="1",
+    )
+    if not args.verbose:
+        # bot.py configures INFO logging on import. Handler failures (e.g. a
+        # RetryAfter) are counted in the report instead of logged one by one
+        logging.basicConfig(level=logging.ERROR)
+        logging.getLogger("telegram.ext.Application").setLevel(logging.CRITICAL)
+    print(f"Scratch data in {scratch}", file=sys.stderr)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
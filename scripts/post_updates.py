@@ -0,0 +1,47 @@
+"""POST recorded Telegram updates to a locally running webhook listener.
+
+Each file holds one update object, or a list of them, as JSON (e.g. from
+getUpdates). Run the bot with BOT_MODE=webhook and no WEBHOOK_URL first.
+
+Usage: python -m scripts.post_updates update.json [more.json ...]
+"""
+import json
+import sys
+import urllib.error
+import urllib.request
+from config import Config
+
+
+def post_update(url: str, update: dict) -> int:
+    request = urllib.request.Request(
+        url,
+        data=json.dumps(update).encode(),
+        headers={
+            "Content-Type": "application/json",
+            "X-Telegram-Bot-Api-Secret-Token": Config.WEBHOOK_SECRET,
+        },
+        method="POST",
+    )
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def main():
+    host = "127.0.0.1" if Config.WEBHOOK_LISTEN == "0.0.0.0" else Config.WEBHOOK_LISTEN
+    url = f"http://{host}:{Config.WEBHOOK_PORT}{Config.WEBHOOK_PATH}"
+
+    for path in sys.argv[1:]:
+        with open(path, 'r') as f:
+            updates = json.load(f)
+        if isinstance(updates, dict):
+            updates = [updates]
+        for update in updates:
+            status = post_update(url, update)
+            print(f"{path}: update {update.get('update_id')} -> {status}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,569 @@
+import asyncio
+import bisect
+import heapq
 import json
+import logging
+import os
+import sqlite3
+import threading
 import time
-from typing import Dict, List, Any, Optional
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+from typing import Dict, List, Any, Optional, Tuple
 from config import Config
+from utils import snapshot
+from utils.metrics import metrics
+from utils.records import Record, compact_whispers, json_object_hook, shared, to_plain, to_record
 
-class JSONStorage:
-    def __init__(self, file_path: str = Config.DATA_FILE):
-        self.file_path = file_path
-        self._ensure_file_exists()
+try:
+    import fcntl
+except ImportError:  # Windows: no sharded storage
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+class AsyncStorageMixin:
+    """Awaitable counterparts of the storage methods.
+    
+    Every call runs on a dedicated single-thread executor, so file and
+    database work never blocks the event loop and storage operations are
+    serialised with respect to each other. Records are copied on the way in
+    and out so handlers never mutate data the storage thread may be writing.
+    """
+    
+    _executor: Optional[ThreadPoolExecutor] = None
+    # Set by enable_write_behind(): mutations are applied immediately but
+    # only persisted when the coalescer calls flush()
+    write_behind = False
+    _coalescer: Optional["WriteCoalescer"] = None
+    # Retention policy in seconds (0 keeps whispers forever)
+    revealed_ttl = Config.RETAIN_REVEALED_HOURS * 3600
+    unrevealed_ttl = Config.RETAIN_UNREVEALED_DAYS * 86400
+    # Whether purge_expired() can find expired whispers without a full scan
+    has_expiry_index = True
+    
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="storage")
+        return self._executor
+    
+    async def _run(self, func, *args, **kwargs):
+        return await self._run_named(func.__name__, func, *args, **kwargs)
+    
+    async def _run_named(self, name: str, func, *args, **kwargs):
+        """Run func on the storage thread, timed under `name` in the metrics"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._get_executor(), partial(self._timed, name, func, *args, **kwargs))
+    
+    @staticmethod
+    def _timed(name: str, func, *args, **kwargs):
+        start = time.perf_counter()
+        error = False
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            error = True
+            raise
+        finally:
+            metrics.observe("storage", name, time.perf_counter() - start, error)
+    
+    async def _written(self, durable: bool):
+        """Register a mutation with the coalescer, optionally awaiting its flush"""
+        if self._coalescer is None:
+            return
+        batch = self._coalescer.note_write()
+        if durable:
+            await batch
+    
+    def enable_write_behind(self, window: float, max_pending: int):
+        """Coalesce writes into one flush per window or per max_pending mutations"""
+        self.write_behind = True
+        self._coalescer = WriteCoalescer(self, window, max_pending)
+    
+    async def aget_user(self, user_id: int) -> Optional[Dict]:
+        user = await self._run(self.get_user, user_id)
+        return dict(user) if user is not None else None
+    
+    async def aget_users(self, user_ids: List[str]) -> Dict[str, Optional[Dict]]:
+        """Several users by ID (None for unknown ones) in one storage call"""
+        users = await self._run_named("get_users", lambda: {user_id: self.get_user(user_id) for user_id in user_ids})
+        return {user_id: dict(user) if user is not None else None for user_id, user in users.items()}
+    
+    async def asave_user(self, user_id: int, user_data: Dict, durable: bool = False):
+        await self._run(self.save_user, user_id, dict(user_data))
+        await self._written(durable)
+    
+    async def asave_users(self, users: Dict, durable: bool = False):
+        await self._run(self.save_users, {user_id: dict(user) for user_id, user in users.items()})
+        await self._written(durable)
+    
+    async def aresolve_username(self, username: str) -> Optional[str]:
+        return await self._run(self.resolve_username, username)
+    
+    async def aget_whisper(self, whisper_id: int) -> Optional[Record]:
+        whisper = await self._run(self.get_whisper, whisper_id)
+        return to_record(whisper) if whisper is not None else None
+    
+    async def asave_whisper(self, whisper_id: int, whisper_data: Dict, durable: bool = False):
+        await self._run(self.save_whisper, whisper_id, to_plain(whisper_data))
+        await self._written(durable)
+    
+    async def adelete_whisper(self, whisper_id: int, durable: bool = False):
+        await self._run(self.delete_whisper, whisper_id)
+        await self._written(durable)
+    
+    async def aget_user_whispers(self, user_id: int, as_sender: bool = True) -> List[Record]:
+        whispers = await self._run(self.get_user_whispers, user_id, as_sender)
+        return [to_record(whisper) for whisper in whispers]
+    
+    async def aget_next_whisper_id(self) -> int:
+        next_id = await self._run(self.get_next_whisper_id)
+        await self._written(False)
+        return next_id
+    
+    async def apurge_expired(self) -> List[str]:
+        removed = await self._run(self.purge_expired)
+        if removed:
+            await self._written(False)
+        return removed
+    
+    async def run_expiry_sweeper(self, interval: float):
+        """Purge expired whispers every `interval` seconds until cancelled"""
+        if not self.has_expiry_index:
+            logger.error(
+                "Retention is not enforced: %s keeps no expiry index in this mode "
+                "(the json backend needs STORAGE_RESIDENT=1)", type(self).__name__,
+            )
+            return
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                removed = await self.apurge_expired()
+            except Exception:
+                logger.exception("Expiry sweep failed")
+                continue
+            if removed:
+                logger.info("Purged %d expired whispers", len(removed))
+    
+    async def aget_stats(self) -> Dict:
+        return await self._run(self.get_stats)
+    
+    async def arebuild_stats(self) -> Dict:
+        return await self._run(self.rebuild_stats)
+    
+    async def aget_whispers_page(self, **kwargs) -> Tuple[List[Record], bool]:
+        whispers, has_more = await self._run(self.get_whispers_page, **kwargs)
+        return [to_record(whisper) for whisper in whispers], has_more
+    
+    async def aget_users_page(self, **kwargs) -> Tuple[List[Dict], bool]:
+        return await self._run(self.get_users_page, **kwargs)
+    
+    async def aget_scheduled_actions(self) -> Dict:
+        return await self._run_named("get_scheduled_actions", lambda: dict(self.get_scheduled_actions()))
+    
+    async def asave_scheduled_actions(self, actions: Dict, durable: bool = False):
+        await self._run(self.save_scheduled_actions, {key: dict(action) for key, action in actions.items()})
+        await self._written(durable)
+    
+    async def adelete_scheduled_actions(self, action_ids: List[str]):
+        await self._run(self.delete_scheduled_actions, action_ids)
+        await self._written(False)
+    
+    async def aget_all_whispers(self) -> Dict:
+        return await self._run_named("get_all_whispers", lambda: dict(self.get_all_whispers()))
+    
+    async def aget_all_users(self) -> Dict:
+        return await self._run_named("get_all_users", lambda: dict(self.get_all_users()))
+    
+    async def aflush(self):
+        """Persist all pending write-behind mutations"""
+        if self._coalescer is not None:
+            await self._coalescer.flush()
+        else:
+            await self._run(self.flush)
+    
+    async def aclose(self):
+        """Close the backend on the storage thread, then stop the executor"""
+        if self._coalescer is not None:
+            await self._coalescer.flush()
+        await self._run(self.close)
+        self._executor.shutdown()
+        self._executor = None
+
+class WriteCoalescer:
+    """Group commit for write-behind storage.
+    
+    Mutations are applied to the backend straight away and only marked
+    dirty; the coalescer then persists everything in a single flush once
+    the window elapses or max_pending mutations have accumulated. Each
+    mutation gets the future of the flush that will contain it, so callers
+    that need durability can await it.
+    """
+    
+    def __init__(self, storage: AsyncStorageMixin, window: float, max_pending: int):
+        self.storage = storage
+        self.window = window
+        self.max_pending = max_pending
+        self._batch: Optional[asyncio.Future] = None
+        self._pending = 0
+        self._full = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+    
+    def note_write(self) -> asyncio.Future:
+        """Record a mutation and return the future of the flush containing it"""
+        loop = asyncio.get_running_loop()
+        if self._batch is None:
+            self._batch = loop.create_future()
+            # Nobody awaits non-durable writes; don't warn about their errors
+            self._batch.add_done_callback(lambda f: f.cancelled() or f.exception())
+        batch = self._batch
+        
+        self._pending += 1
+        if self._pending >= self.max_pending:
+            self._full.set()
+        if self._task is None or self._task.done():
+            self._task = loop.create_task(self._run_flusher())
+        return batch
+    
+    async def _run_flusher(self):
+        while self._batch is not None:
+            try:
+                await asyncio.wait_for(self._full.wait(), self.window)
+            except asyncio.TimeoutError:
+                pass
+            await self.flush()
+    
+    async def flush(self):
+        """Persist the current batch now"""
+        batch, self._batch = self._batch, None
+        self._pending = 0
+        self._full.clear()
+        
+        try:
+            await self.storage._run(self.storage.flush)
+        except Exception as e:
+            logger.exception("Write-behind flush failed")
+            if batch is not None:
+                batch.set_exception(e)
+        else:
+            if batch is not None:
+                batch.set_result(None)
+
+def normalize_username(username: Optional[str]) -> Optional[str]:
+    """Lowercased username without the leading @, for case-insensitive lookups"""
+    if not username:
+        return None
+    return username.lstrip("@").lower() or None
+
+def recipient_key(whisper: Dict) -> Optional[str]:
+    """Normalised recipient of either whisper schema.
+    
+    /create whispers carry recipient_id; inline whispers carry recipient
+    plus recipient_type, where usernames are matched case-insensitively.
+    """
+    if whisper.get("recipient_id") is not None:
+        return str(whisper["recipient_id"])
+    recipient = whisper.get("recipient")
+    if recipient is None:
+        return None
+    if whisper.get("recipient_type") == "username":
+        return str(recipient).lower()
+    return str(recipient)
+
+class WhisperIndex:
+    """Sender and recipient indexes over resident whispers.
+    
+    Maps a user key to the IDs of their whispers in insertion order, so a
+    per-user lookup costs O(k) in that user's whisper count. The keys each
+    whisper was indexed under are remembered, so removal stays correct even
+    if the record was mutated in place before being saved again.
+    """
+    
+    def __init__(self):
+        self.by_sender: Dict[str, Dict[str, None]] = {}
+        self.by_recipient: Dict[str, Dict[str, None]] = {}
+        self._keys: Dict[str, tuple] = {}
+    
+    def rebuild(self, whispers: Dict):
+        self.__init__()
+        for whisper_id, whisper in whispers.items():
+            self.add(whisper_id, whisper)
+    
+    def add(self, whisper_id: str, whisper: Dict):
+        sender = whisper.get("sender_id")
+        recipient = recipient_key(whisper)
+        # Interned, so each user's key string is stored once however many whispers they have
+        keys = (None if sender is None else shared(str(sender)), None if recipient is None else shared(recipient))
+        self._keys[whisper_id] = keys
+        for index, key in zip((self.by_sender, self.by_recipient), keys):
+            if key is not None:
+                index.setdefault(key, {})[whisper_id] = None
+    
+    def remove(self, whisper_id: str):
+        keys = self._keys.pop(whisper_id, None)
+        if keys is None:
+            return
+        for index, key in zip((self.by_sender, self.by_recipient), keys):
+            bucket = index.get(key)
+            if bucket is not None:
+                bucket.pop(whisper_id, None)
+                if not bucket:
+                    del index[key]
+    
+    def lookup(self, user_key: str, as_sender: bool = True) -> List[str]:
+        index = self.by_sender if as_sender else self.by_recipient
+        return list(index.get(user_key, ()))
+
+def whisper_expires_at(whisper: Dict, revealed_ttl: float, unrevealed_ttl: float) -> Optional[float]:
+    """When a whisper falls out of the retention policy (None = never).
+    
+    Revealed whispers are kept for revealed_ttl seconds after the reveal
+    (falling back to creation time for records without revealed_at), the
+    rest for unrevealed_ttl seconds after creation. A TTL of 0 keeps them.
+    """
+    if whisper.get("is_revealed"):
+        start = whisper.get("revealed_at") or whisper.get("created_at")
+        ttl = revealed_ttl
+    else:
+        start = whisper.get("created_at")
+        ttl = unrevealed_ttl
+    if not ttl or start is None:
+        return None
+    return start + ttl
+
+class ExpiryIndex:
+    """Time-bucketed index of when resident whispers expire.
+    
+    Whispers are grouped into buckets of bucket_seconds by expiry time and
+    a heap orders the buckets, so a sweep only visits buckets that are at
+    least partly due instead of scanning every whisper.
+    """
+    
+    def __init__(self, revealed_ttl: float, unrevealed_ttl: float, bucket_seconds: int):
+        self.revealed_ttl = revealed_ttl
+        self.unrevealed_ttl = unrevealed_ttl
+        self.bucket_seconds = bucket_seconds
+        self._buckets: Dict[int, Dict[str, float]] = {}
+        self._bucket_of: Dict[str, int] = {}
+        # May hold stale bucket numbers; they are skipped when popped
+        self._heap: List[int] = []
+    
+    def rebuild(self, whispers: Dict):
+        self.__init__(self.revealed_ttl, self.unrevealed_ttl, self.bucket_seconds)
+        for whisper_id, whisper in whispers.items():
+            self.add(whisper_id, whisper)
+    
+    def add(self, whisper_id: str, whisper: Dict):
+        expires_at = whisper_expires_at(whisper, self.revealed_ttl, self.unrevealed_ttl)
+        if expires_at is None:
+            return
+        bucket = int(expires_at // self.bucket_seconds)
+        if bucket not in self._buckets:
+            self._buckets[bucket] = {}
+            heapq.heappush(self._heap, bucket)
+        self._buckets[bucket][whisper_id] = expires_at
+        self._bucket_of[whisper_id] = bucket
+    
+    def remove(self, whisper_id: str):
+        bucket = self._bucket_of.pop(whisper_id, None)
+        if bucket is None:
+            return
+        entries = self._buckets[bucket]
+        del entries[whisper_id]
+        if not entries:
+            del self._buckets[bucket]
+    
+    def pop_expired(self, now: float) -> List[str]:
+        """Remove and return the IDs of every whisper expired at `now`"""
+        expired = []
+        while self._heap and self._heap[0] * self.bucket_seconds <= now:
+            bucket = self._heap[0]
+            entries = self._buckets.get(bucket)
+            if entries is None:
+                heapq.heappop(self._heap)
+                continue
+            
+            for whisper_id in [i for i, t in entries.items() if t <= now]:
+                self.remove(whisper_id)
+                expired.append(whisper_id)
+            if bucket in self._buckets:
+                # Only partly due; everything after it is later still
+                break
+        return expired
+
+STAT_FIELDS = ("whispers", "revealed", "media", "media_items")
+
+def whisper_stat_counts(whisper: Dict) -> tuple:
+    """Contribution of one whisper to each of STAT_FIELDS"""
+    media_items = whisper.get("media_items")
+    is_media = isinstance(media_items, (list, tuple))
+    return (
+        1,
+        1 if whisper.get("is_revealed") else 0,
+        1 if is_media else 0,
+        len(media_items) if is_media else 0,
+    )
+
+def format_stats(counts: Dict, users: int) -> Dict:
+    """Shape raw counters into the stats shown in the admin panel"""
+    return {
+        "users": users,
+        "total": counts["whispers"],
+        "read": counts["revealed"],
+        "unread": counts["whispers"] - counts["revealed"],
+        "inline": counts["whispers"] - counts["media"],
+        "media": counts["media"],
+        "media_items": counts["media_items"],
+    }
+
+class WhisperStats:
+    """Running whisper counters for resident data, updated per mutation.
+    
+    Each whisper's contribution is remembered so that removal subtracts
+    exactly what was added. Contributions are shared tuples, so the
+    per-whisper cost is a single dict slot.
+    """
+    
+    def __init__(self):
+        self.counts = dict.fromkeys(STAT_FIELDS, 0)
+        self._contrib: Dict[str, tuple] = {}
+        self._shared: Dict[tuple, tuple] = {}
+    
+    def rebuild(self, whispers: Dict):
+        self.__init__()
+        for whisper_id, whisper in whispers.items():
+            self.add(whisper_id, whisper)
+    
+    def add(self, whisper_id: str, whisper: Dict):
+        contrib = whisper_stat_counts(whisper)
+        contrib = self._shared.setdefault(contrib, contrib)
+        self._contrib[whisper_id] = contrib
+        for field, value in zip(STAT_FIELDS, contrib):
+            self.counts[field] += value
+    
+    def remove(self, whisper_id: str):
+        contrib = self._contrib.pop(whisper_id, None)
+        if contrib is None:
+            return
+        for field, value in zip(STAT_FIELDS, contrib):
+            self.counts[field] -= value
+
+def keyset_page(keys: List, cursor, forward: bool, limit: int, accept=None, lo: int = 0, hi: Optional[int] = None):
+    """One page from a sorted key list, seeking past `cursor`.
+    
+    Walks forward (ascending) or backward from the cursor within keys[lo:hi],
+    so the cost depends on the page size, not on how deep the page is.
+    Returns the accepted keys in walk order and whether more remain.
+    """
+    hi = len(keys) if hi is None else hi
+    if forward:
+        start = lo if cursor is None else bisect.bisect_right(keys, cursor, lo, hi)
+        indices = range(start, hi)
+    else:
+        end = hi if cursor is None else bisect.bisect_left(keys, cursor, lo, hi)
+        indices = range(end - 1, lo - 1, -1)
+    
+    page = []
+    for i in indices:
+        key = keys[i]
+        if accept is None or accept(key):
+            if len(page) == limit:
+                return page, True
+            page.append(key)
+    return page, False
+
+class TimelineIndex:
+    """Resident whispers ordered by (created_at, id) for keyset pagination.
+    
+    Removal from the global list is lazy: it keeps stale entries, which
+    readers skip by checking key_of, until they make up a quarter of the
+    list and it is compacted. This keeps bulk deletes (expiry sweeps) cheap.
+    Each sender also gets their own sorted list, maintained eagerly since
+    it only holds that user's whispers.
+    """
+    
+    def __init__(self):
+        self.keys: List[tuple] = []
+        self.key_of: Dict[str, tuple] = {}
+        self.by_sender: Dict[str, List[tuple]] = {}
+        self._sender_of: Dict[str, str] = {}
+        self._stale = 0
+    
+    @staticmethod
+    def key(whisper_id: str, whisper: Dict) -> tuple:
+        return (whisper.get("created_at") or 0, whisper_id)
+    
+    def rebuild(self, whispers: Dict):
+        self.__init__()
+        for whisper_id, whisper in whispers.items():
+            key = self.key(whisper_id, whisper)
+            self.key_of[whisper_id] = key
+            sender = whisper.get("sender_id")
+            if sender is not None:
+                sender = shared(str(sender))
+                self._sender_of[whisper_id] = sender
+                self.by_sender.setdefault(sender, []).append(key)
+        self.keys = sorted(self.key_of.values())
+        for keys in self.by_sender.values():
+            keys.sort()
+    
+    def add(self, whisper_id: str, whisper: Dict):
+        key = self.key(whisper_id, whisper)
+        self.key_of[whisper_id] = key
+        i = bisect.bisect_left(self.keys, key)
+        if i < len(self.keys) and self.keys[i] == key:
+            self._stale -= 1  # revives a lazily removed entry
+        else:
+            self.keys.insert(i, key)
+        
+        sender = whisper.get("sender_id")
+        if sender is not None:
+            sender = shared(str(sender))
+            self._sender_of[whisper_id] = sender
+            bisect.insort(self.by_sender.setdefault(sender, []), key)
+    
+    def remove(self, whisper_id: str):
+        key = self.key_of.pop(whisper_id, None)
+        if key is None:
+            return
+        
+        sender = self._sender_of.pop(whisper_id, None)
+        if sender is not None:
+            keys = self.by_sender[sender]
+            del keys[bisect.bisect_left(keys, key)]
+            if not keys:
+                del self.by_sender[sender]
+        
+        self._stale += 1
+        if self._stale > 1024 and self._stale * 4 > len(self.keys):
+            self.keys = [key for key in self.keys if self.key_of.get(key[1]) == key]
+            self._stale = 0
+    
+    def is_live(self, key: tuple) -> bool:
+        return self.key_of.get(key[1]) == key
+
+class DatasetStorage(AsyncStorageMixin):
+    """Shared base of the backends whose state is one dataset dict.
+    
+    The dataset holds users, whispers, the whisper ID counter and scheduled
+    actions, in the layout of a snapshot file. This class owns the indexes
+    built over a loaded dataset and every read path; subclasses provide
+    _read_data() and decide how each mutation is persisted.
+    """
+    
+    file_path: str
+    snapshot_format: str
+    _data: Optional[Dict] = None
+    # Only maintained while the dataset is held in memory; otherwise
+    # lookups scan a freshly read copy
+    _index: Optional[WhisperIndex] = None
+    _expiry: Optional[ExpiryIndex] = None
+    _stats: Optional[WhisperStats] = None
+    _timeline: Optional[TimelineIndex] = None
+    _user_ids: Optional[List[str]] = None
+    _usernames: Optional[Dict[str, str]] = None
     
     def _ensure_file_exists(self):
         """Create the JSON file if it doesn't exist"""
@@ -14,46 +571,362 @@ class JSONStorage:
             with open(self.file_path, 'r') as f:
                 pass
         except FileNotFoundError:
-            with open(self.file_path, 'w') as f:
-                json.dump({
-                    "users": {},
-                    "whispers": {},
-                    "next_whisper_id": 1
-                }, f, indent=4)
+            snapshot.dump(self.file_path, {
+                "users": {},
+                "whispers": {},
+                "next_whisper_id": 1
+            }, self.snapshot_format)
     
-    def _read_data(self) -> Dict:
-        """Read data from JSON file"""
+    def _load_file(self, object_hook=None) -> Dict:
+        """Parse the data file, falling back to an empty dataset"""
         try:
-            with open(self.file_path, 'r') as f:
-                return json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
+            return snapshot.load(self.file_path, object_hook)
+        except (FileNotFoundError, snapshot.SnapshotError):
             return {"users": {}, "whispers": {}, "next_whisper_id": 1}
     
-    def _write_data(self, data: Dict):
-        """Write data to JSON file"""
-        with open(self.file_path, 'w') as f:
-            json.dump(data, f, indent=4)
+    def _set_data(self, data: Dict):
+        """Install a freshly loaded resident dataset and rebuild its indexes"""
+        # Indexing creates a few containers per whisper; see snapshot.paused_gc
+        with snapshot.paused_gc():
+            # Resident whispers are held as compact records (utils.records)
+            compact_whispers(data["whispers"])
+            self._data = data
+            self._index = WhisperIndex()
+            self._index.rebuild(data["whispers"])
+            self._stats = WhisperStats()
+            self._stats.rebuild(data["whispers"])
+            self._timeline = TimelineIndex()
+            self._timeline.rebuild(data["whispers"])
+            self._user_ids = sorted(data["users"])
+            self._usernames = {}
+            for user_id, user in data["users"].items():
+                username = normalize_username(user.get("username"))
+                if username:
+                    self._usernames[username] = user_id
+            self._expiry = None
+            if self.revealed_ttl or self.unrevealed_ttl:
+                self._expiry = ExpiryIndex(self.revealed_ttl, self.unrevealed_ttl, Config.EXPIRY_BUCKET_SECONDS)
+                self._expiry.rebuild(data["whispers"])
+    
+    def _index_whisper(self, whisper_id: str, whisper: Optional[Dict]):
+        """Update the indexes for a saved (or, with None, deleted) whisper"""
+        for index in (self._index, self._expiry, self._stats, self._timeline):
+            if index is None:
+                continue
+            index.remove(whisper_id)
+            if whisper is not None:
+                index.add(whisper_id, whisper)
+    
+    def _index_user(self, user_id: str, data: Dict, user_data: Dict):
+        """Keep the ordered user list and username index in step with a user about to be saved"""
+        if self._user_ids is None:
+            return
+        old = data["users"].get(user_id)
+        if old is None:
+            bisect.insort(self._user_ids, user_id)
+        else:
+            old_username = normalize_username(old.get("username"))
+            if old_username and self._usernames.get(old_username) == user_id:
+                del self._usernames[old_username]
+        username = normalize_username(user_data.get("username"))
+        if username:
+            # Usernames can change hands; the most recently saved owner wins
+            self._usernames[username] = user_id
     
     def get_user(self, user_id: int) -> Optional[Dict]:
         """Get user by ID"""
         data = self._read_data()
         return data["users"].get(str(user_id))
     
+    def resolve_username(self, username: str) -> Optional[str]:
+        """Get the ID of the user with this username (case-insensitive, @ optional)"""
+        username = normalize_username(username)
+        if not username:
+            return None
+        data = self._read_data()
+        if self._usernames is not None:
+            return self._usernames.get(username)
+        
+        for user_id, user in data["users"].items():
+            if normalize_username(user.get("username")) == username:
+                return user_id
+        return None
+    
+    def get_whisper(self, whisper_id: int) -> Optional[Dict]:
+        """Get whisper by ID"""
+        data = self._read_data()
+        return data["whispers"].get(str(whisper_id))
+    
+    def purge_expired(self, now: Optional[float] = None) -> List[str]:
+        """Delete whispers past the retention policy, returning their IDs"""
+        if not (self.revealed_ttl or self.unrevealed_ttl):
+            return []
+        if not self.has_expiry_index:
+            raise ValueError("Retention requires resident mode (STORAGE_RESIDENT=1)")
+        now = time.time() if now is None else now
+        self._read_data()
+        expired = self._expiry.pop_expired(now)
+        self.delete_whispers(expired)
+        return expired
+    
+    def get_user_whispers(self, user_id: int, as_sender: bool = True) -> List[Dict]:
+        """Get all whispers for a user (as sender or recipient)"""
+        data = self._read_data()
+        whispers = data["whispers"]
+        
+        if self._index is not None:
+            whisper_ids = self._index.lookup(str(user_id), as_sender)
+            return [{"id": whisper_id, **whispers[whisper_id]} for whisper_id in whisper_ids]
+        
+        result = []
+        for whisper_id, whisper in whispers.items():
+            key = whisper.get("sender_id") if as_sender else recipient_key(whisper)
+            if str(key) == str(user_id):
+                result.append({"id": whisper_id, **whisper})
+        
+        return result
+    
+    def get_all_whispers(self) -> Dict:
+        """Get all whispers"""
+        data = self._read_data()
+        return data["whispers"]
+    
+    def get_all_users(self) -> Dict:
+        """Get all users"""
+        data = self._read_data()
+        return data["users"]
+    
+    def get_whispers_page(
+        self,
+        cursor: Optional[tuple] = None,
+        direction: str = "next",
+        limit: int = 10,
+        revealed: Optional[bool] = None,
+        sender_id: Optional[int] = None,
+        since: Optional[int] = None,
+        until: Optional[int] = None,
+    ) -> Tuple[List[Dict], bool]:
+        """One page of whispers, newest first.
+        
+        `cursor` is the (created_at, id) key of the last whisper shown when
+        paging "next" (older), or of the first one when paging "prev".
+        Returns the page and whether more whispers lie in that direction.
+        """
+        data = self._read_data()
+        whispers = data["whispers"]
+        timeline = self._timeline
+        if timeline is None:
+            timeline = TimelineIndex()
+            timeline.rebuild(whispers)
+        
+        keys = timeline.keys
+        if sender_id is not None:
+            keys = timeline.by_sender.get(str(sender_id), [])
+        lo = 0 if since is None else bisect.bisect_left(keys, (since,))
+        hi = len(keys) if until is None else bisect.bisect_left(keys, (until + 1,))
+        
+        def accept(key):
+            if not timeline.is_live(key):
+                return False
+            whisper = whispers[key[1]]
+            if revealed is not None and bool(whisper.get("is_revealed")) != revealed:
+                return False
+            if sender_id is not None and str(whisper.get("sender_id")) != str(sender_id):
+                return False
+            return True
+        
+        forward = direction == "prev"
+        page, has_more = keyset_page(keys, cursor, forward, limit, accept, lo, hi)
+        if forward:
+            page.reverse()
+        return [{"id": whisper_id, **whispers[whisper_id]} for _, whisper_id in page], has_more
+    
+    def get_users_page(
+        self, cursor: Optional[str] = None, direction: str = "next", limit: int = 10
+    ) -> Tuple[List[Dict], bool]:
+        """One page of users ordered by ID, seeking from the ID at `cursor`"""
+        data = self._read_data()
+        user_ids = self._user_ids if self._user_ids is not None else sorted(data["users"])
+        
+        forward = direction == "next"
+        page, has_more = keyset_page(user_ids, cursor, forward, limit)
+        if not forward:
+            page.reverse()
+        return [{"id": user_id, **data["users"][user_id]} for user_id in page], has_more
+    
+    def get_stats(self) -> Dict:
+        """Get bot statistics from the running counters.
+        
+        Only resident datasets keep counters; without them (non-resident
+        JSONStorage) every call parses the file and recounts.
+        """
+        data = self._read_data()
+        if self._stats is None:
+            return self.rebuild_stats()
+        return format_stats(self._stats.counts, len(data["users"]))
+    
+    def get_stat_counts(self) -> Dict:
+        """The raw whisper counters behind get_stats()"""
+        data = self._read_data()
+        if self._stats is None:
+            stats = WhisperStats()
+            stats.rebuild(data["whispers"])
+            return stats.counts
+        return self._stats.counts
+    
+    def rebuild_stats(self) -> Dict:
+        """Recount statistics from scratch, replacing the running counters"""
+        data = self._read_data()
+        fresh = WhisperStats()
+        fresh.rebuild(data["whispers"])
+        if self._stats is not None:
+            if self._stats.counts != fresh.counts:
+                logger.warning("Stats counters drifted: %s, recounted %s", self._stats.counts, fresh.counts)
+            self._stats = fresh
+        return format_stats(fresh.counts, len(data["users"]))
+    
+    def get_scheduled_actions(self) -> Dict:
+        """Get all pending deferred actions, keyed by action ID"""
+        data = self._read_data()
+        return data.get("actions", {})
+
+class JSONStorage(DatasetStorage):
+    def __init__(
+        self,
+        file_path: str = Config.DATA_FILE,
+        resident: bool = Config.STORAGE_RESIDENT,
+        reload_interval: float = Config.STORAGE_RELOAD_INTERVAL,
+        snapshot_format: str = Config.SNAPSHOT_FORMAT,
+    ):
+        self.file_path = file_path
+        # Encoding of rewrites (utils.snapshot); files in any format are read
+        self.snapshot_format = snapshot_format
+        # Resident mode keeps the dataset in memory: reads never touch the
+        # file, writes go through to disk and replace the in-memory copy.
+        self.resident = resident
+        self.reload_interval = reload_interval
+        self._file_stamp = None
+        self._last_check = 0.0
+        self._dirty = False
+        self._ensure_file_exists()
+        if self.resident:
+            self.reload()
+    
+    @property
+    def has_expiry_index(self) -> bool:
+        return self.resident
+    
+    def _stat_file(self):
+        """Return a (mtime, size) stamp of the JSON file, or None if missing"""
+        try:
+            st = os.stat(self.file_path)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+    
+    def reload(self):
+        """Load the JSON file into memory, replacing the resident dataset"""
+        self._file_stamp = self._stat_file()
+        self._set_data(self._load_file(json_object_hook))
+        self._last_check = time.monotonic()
+    
+    def reload_if_changed(self) -> bool:
+        """Reload the resident dataset if the file was modified externally.
+        
+        Returns True if the dataset was reloaded.
+        """
+        self._last_check = time.monotonic()
+        stamp = self._stat_file()
+        if stamp == self._file_stamp or self._dirty:
+            return False
+        
+        try:
+            data = snapshot.load(self.file_path, json_object_hook)
+        except (FileNotFoundError, snapshot.SnapshotError):
+            # Probably caught an external writer mid-write; keep what we have
+            # and retry on the next check.
+            logger.warning("Could not reload %s, keeping resident data", self.file_path)
+            return False
+        
+        self._set_data(data)
+        self._file_stamp = stamp
+        return True
+    
+    def _read_data(self) -> Dict:
+        """Read data from memory (resident mode) or from the JSON file"""
+        if not self.resident:
+            return self._load_file()
+        
+        if self.reload_interval and time.monotonic() - self._last_check >= self.reload_interval:
+            self.reload_if_changed()
+        return self._data
+    
+    def _write_data(self, data: Dict):
+        """Write data to JSON file, or just mark it dirty in write-behind mode"""
+        if self.write_behind:
+            self._data = data
+            self._dirty = True
+            return
+        
+        self._write_file(data)
+    
+    def _write_file(self, data: Dict):
+        if self.resident:
+            # Records go to disk as plain dicts, built only for this write
+            with snapshot.paused_gc():
+                data_on_disk = dict(data)
+                data_on_disk["whispers"] = {
+                    whisper_id: whisper if isinstance(whisper, dict) else whisper.to_dict()
+                    for whisper_id, whisper in data["whispers"].items()
+                }
+        else:
+            data_on_disk = data
+        snapshot.dump(self.file_path, data_on_disk, self.snapshot_format)
+        
+        if self.resident:
+            self._data = data
+            self._file_stamp = self._stat_file()
+    
+    def enable_write_behind(self, window: float, max_pending: int):
+        if not self.resident:
+            raise ValueError("Write-behind requires resident mode (STORAGE_RESIDENT=1)")
+        super().enable_write_behind(window, max_pending)
+    
+    def flush(self):
+        """Persist mutations held back by write-behind mode"""
+        if self._dirty:
+            self._dirty = False
+            self._write_file(self._data)
+    
+    def close(self):
+        """Release resources held by the backend"""
+        self.flush()
+    
     def save_user(self, user_id: int, user_data: Dict):
         """Save user data"""
         data = self._read_data()
+        self._index_user(str(user_id), data, user_data)
         data["users"][str(user_id)] = user_data
         self._write_data(data)
     
-    def get_whisper(self, whisper_id: int) -> Optional[Dict]:
-        """Get whisper by ID"""
+    def save_users(self, users: Dict):
+        """Save several users with a single write"""
         data = self._read_data()
-        return data["whispers"].get(str(whisper_id))
+        for user_id, user_data in users.items():
+            self._index_user(str(user_id), data, user_data)
+            data["users"][str(user_id)] = user_data
+        self._write_data(data)
     
     def save_whisper(self, whisper_id: int, whisper_data: Dict):
         """Save whisper data"""
         data = self._read_data()
-        data["whispers"][str(whisper_id)] = whisper_data
+        whisper_id = str(whisper_id)
+        if self.resident:
+            whisper_data = to_record(whisper_data, whisper_id)
+        else:
+            whisper_data = to_plain(whisper_data)
+        data["whispers"][whisper_id] = whisper_data
+        self._index_whisper(whisper_id, whisper_data)
         self._write_data(data)
     
     def delete_whisper(self, whisper_id: int):
@@ -61,19 +934,19 @@ class JSONStorage:
         data = self._read_data()
         if str(whisper_id) in data["whispers"]:
             del data["whispers"][str(whisper_id)]
+            self._index_whisper(str(whisper_id), None)
             self._write_data(data)
     
-    def get_user_whispers(self, user_id: int, as_sender: bool = True) -> List[Dict]:
-        """Get all whispers for a user (as sender or recipient)"""
+    def delete_whispers(self, whisper_ids: List[str]):
+        """Delete several whispers with a single write"""
         data = self._read_data()
-        whispers = []
-        
-        for whisper_id, whisper in data["whispers"].items():
-            key = "sender_id" if as_sender else "recipient_id"
-            if str(whisper.get(key)) == str(user_id):
-                whispers.append({"id": whisper_id, **whisper})
-        
-        return whispers
+        deleted = False
+        for whisper_id in whisper_ids:
+            if data["whispers"].pop(str(whisper_id), None) is not None:
+                self._index_whisper(str(whisper_id), None)
+                deleted = True
+        if deleted:
+            self._write_data(data)
     
     def get_next_whisper_id(self) -> int:
         """Get the next available whisper ID"""
@@ -86,15 +959,933 @@ class JSONStorage:
         
         return next_id
     
+    def save_scheduled_actions(self, actions: Dict):
+        """Add or replace deferred actions with a single write"""
+        data = self._read_data()
+        data.setdefault("actions", {}).update(actions)
+        self._write_data(data)
+    
+    def delete_scheduled_actions(self, action_ids: List[str]):
+        """Remove finished deferred actions with a single write"""
+        data = self._read_data()
+        pending = data.get("actions", {})
+        deleted = [pending.pop(action_id) for action_id in action_ids if action_id in pending]
+        if deleted:
+            self._write_data(data)
+
+class LogStorage(DatasetStorage):
+    """Append-only journal backend with the same interface as JSONStorage.
+    
+    The dataset lives in memory. Every mutation appends one compact record to
+    the journal instead of rewriting the whole file. On startup the state is
+    rebuilt from the last snapshot plus the journal tail, and a background
+    thread periodically folds the journal into a new snapshot.
+    """
+    
+    FSYNC_MODES = ("always", "batch", "never")
+    
+    def __init__(
+        self,
+        snapshot_path: str = Config.DATA_FILE,
+        log_path: Optional[str] = None,
+        fsync: str = Config.LOG_FSYNC,
+        fsync_batch: int = Config.LOG_FSYNC_BATCH,
+        fsync_interval: float = Config.LOG_FSYNC_INTERVAL,
+        compact_bytes: int = Config.LOG_COMPACT_BYTES,
+        compact_interval: float = Config.LOG_COMPACT_INTERVAL,
+        snapshot_format: str = Config.SNAPSHOT_FORMAT,
+    ):
+        if fsync not in self.FSYNC_MODES:
+            raise ValueError(f"Unknown fsync mode: {fsync!r}")
+        
+        self.file_path = snapshot_path
+        # Journal snapshots were never meant to be read by people, so the
+        # indented JSON default is written without the whitespace
+        self.snapshot_format = "json-compact" if snapshot_format == "json" else snapshot_format
+        self.log_path = log_path or snapshot_path + ".log"
+        # A journal segment that is being folded into the snapshot
+        self.compacting_path = self.log_path + ".1"
+        self.fsync = fsync
+        self.fsync_batch = fsync_batch
+        self.fsync_interval = fsync_interval
+        self.compact_bytes = compact_bytes
+        self.compact_interval = compact_interval
+        
+        self._lock = threading.Lock()
+        self._pending: List[str] = []
+        self._unsynced = 0
+        self._last_compact = time.monotonic()
+        self._ensure_file_exists()
+        
+        data = self._load_snapshot(json_object_hook)
+        self._replay(self.compacting_path, data)
+        offset = self._replay(self.log_path, data)
+        self._set_data(data)
+        
+        self._log = open(self.log_path, 'a')
+        # Drop a torn tail so new records don't get glued onto it
+        self._log.truncate(offset)
+        self._stop = threading.Event()
+        self._worker = threading.Thread(target=self._background, name="log-compactor", daemon=True)
+        self._worker.start()
+    
+    def _load_snapshot(self, object_hook=None) -> Dict:
+        """Parse the snapshot; unlike _load_file(), a corrupt one raises SnapshotError.
+        
+        An empty base in its place would make the next compaction write a
+        snapshot of only the journal, losing everything the old one held.
+        """
+        try:
+            return snapshot.load(self.file_path, object_hook)
+        except FileNotFoundError:
+            return {"users": {}, "whispers": {}, "next_whisper_id": 1}
+    
+    @staticmethod
+    def _apply(data: Dict, record: Dict):
+        """Apply a single journal record to a dataset"""
+        op = record["op"]
+        if op == "user":
+            data["users"][record["id"]] = record["data"]
+        elif op == "users":
+            data["users"].update(record["data"])
+        elif op == "whisper":
+            data["whispers"][record["id"]] = record["data"]
+        elif op == "delete":
+            data["whispers"].pop(record["id"], None)
+        elif op == "next_id":
+            data["next_whisper_id"] = record["value"]
+        elif op == "actions":
+            data.setdefault("actions", {}).update(record["data"])
+        elif op == "actions_done":
+            pending = data.get("actions", {})
+            for action_id in record["ids"]:
+                pending.pop(action_id, None)
+    
+    @classmethod
+    def _replay(cls, path: str, data: Dict) -> int:
+        """Replay a journal file onto a dataset.
+        
+        Returns the byte offset just past the last complete record.
+        """
+        offset = 0
+        try:
+            with open(path, 'rb') as f:
+                for line in f:
+                    try:
+                        if not line.endswith(b"\n"):
+                            raise ValueError
+                        record = json.loads(line)
+                    except ValueError:
+                        # A torn final record from a crash mid-append
+                        logger.warning("Ignoring truncated record in %s", path)
+                        break
+                    cls._apply(data, record)
+                    offset += len(line)
+        except FileNotFoundError:
+            pass
+        return offset
+    
+    def _append(self, record: Dict):
+        """Append a record to the journal (or the write-behind buffer)"""
+        line = json.dumps(record, separators=(',', ':')) + "\n"
+        with self._lock:
+            if self.write_behind:
+                self._pending.append(line)
+            else:
+                self._write_lines([line])
+    
+    def _write_lines(self, lines: List[str]):
+        """Write records to the journal, honouring the fsync policy"""
+        self._log.write("".join(lines))
+        self._log.flush()
+        if self.fsync == "always":
+            os.fsync(self._log.fileno())
+        elif self.fsync == "batch":
+            self._unsynced += len(lines)
+            if self._unsynced >= self.fsync_batch:
+                os.fsync(self._log.fileno())
+                self._unsynced = 0
+    
+    def flush(self):
+        """Write buffered write-behind records as a single append"""
+        with self._lock:
+            if self._pending:
+                self._write_lines(self._pending)
+                self._pending = []
+    
+    def _read_data(self) -> Dict:
+        """Read data from memory"""
+        return self._data
+    
+    def save_user(self, user_id: int, user_data: Dict):
+        """Save user data"""
+        self._index_user(str(user_id), self._data, user_data)
+        self._data["users"][str(user_id)] = user_data
+        self._append({"op": "user", "id": str(user_id), "data": user_data})
+    
+    def save_users(self, users: Dict):
+        """Save several users as one record"""
+        users = {str(user_id): user_data for user_id, user_data in users.items()}
+        for user_id, user_data in users.items():
+            self._index_user(user_id, self._data, user_data)
+            self._data["users"][user_id] = user_data
+        self._append({"op": "users", "data": users})
+    
+    def save_whisper(self, whisper_id: int, whisper_data: Dict):
+        """Save whisper data"""
+        whisper_id = str(whisper_id)
+        record = to_record(whisper_data, whisper_id)
+        self._data["whispers"][whisper_id] = record
+        self._index_whisper(whisper_id, record)
+        self._append({"op": "whisper", "id": whisper_id, "data": record.to_dict()})
+    
+    def delete_whisper(self, whisper_id: int):
+        """Delete whisper by ID"""
+        if self._data["whispers"].pop(str(whisper_id), None) is not None:
+            self._index_whisper(str(whisper_id), None)
+            self._append({"op": "delete", "id": str(whisper_id)})
+    
+    def delete_whispers(self, whisper_ids: List[str]):
+        """Delete several whispers"""
+        for whisper_id in whisper_ids:
+            self.delete_whisper(whisper_id)
+    
+    def get_next_whisper_id(self) -> int:
+        """Get the next available whisper ID"""
+        next_id = self._data.get("next_whisper_id", 1)
+        self._data["next_whisper_id"] = next_id + 1
+        self._append({"op": "next_id", "value": next_id + 1})
+        return next_id
+    
+    def save_scheduled_actions(self, actions: Dict):
+        """Add or replace deferred actions as one record"""
+        self._data.setdefault("actions", {}).update(actions)
+        self._append({"op": "actions", "data": actions})
+    
+    def delete_scheduled_actions(self, action_ids: List[str]):
+        """Remove finished deferred actions as one record"""
+        pending = self._data.get("actions", {})
+        deleted = [action_id for action_id in action_ids if pending.pop(action_id, None) is not None]
+        if deleted:
+            self._append({"op": "actions_done", "ids": deleted})
+    
+    def sync(self):
+        """Force journal records written so far to stable storage"""
+        with self._lock:
+            self._log.flush()
+            os.fsync(self._log.fileno())
+            self._unsynced = 0
+    
+    def compact(self) -> bool:
+        """Fold the journal into a new snapshot.
+        
+        The live journal is rotated aside under the lock, so writers are only
+        paused for a rename. The new snapshot is then built from the previous
+        snapshot plus the rotated segment, without touching in-memory state.
+        Returns False if there was nothing to compact.
+        """
+        with self._lock:
+            if not os.path.exists(self.compacting_path):
+                if self._log.tell() == 0:
+                    return False
+                self._log.flush()
+                os.fsync(self._log.fileno())
+                self._unsynced = 0
+                self._log.close()
+                os.replace(self.log_path, self.compacting_path)
+                self._log = open(self.log_path, 'a')
+        
+        # Records are absolute values, so replaying a segment that already
+        # made it into the snapshot (crash before the unlink) is harmless.
+        data = self._load_snapshot()
+        self._replay(self.compacting_path, data)
+        
+        snapshot.dump(self.file_path, data, self.snapshot_format, durable=True)
+        os.remove(self.compacting_path)
+        self._last_compact = time.monotonic()
+        return True
+    
+    def _background(self):
+        """Batch fsyncs and compact the journal once it grows large enough"""
+        while not self._stop.wait(self.fsync_interval):
+            try:
+                if self.fsync == "batch" and self._unsynced:
+                    self.sync()
+                
+                due = time.monotonic() - self._last_compact >= self.compact_interval
+                if due and os.path.getsize(self.log_path) >= self.compact_bytes:
+                    self.compact()
+            except Exception:
+                logger.exception("Journal maintenance failed")
+    
+    def close(self):
+        """Stop the background thread and flush the journal"""
+        self._stop.set()
+        self._worker.join()
+        self.flush()
+        with self._lock:
+            self._log.flush()
+            if self.fsync != "never":
+                os.fsync(self._log.fileno())
+            self._log.close()
+
+class ShardedStorage(AsyncStorageMixin):
+    """JSON storage split over several files that processes can share.
+    
+    Whispers are spread over `shards` files by a stable hash of their ID;
+    users, the whisper ID counter and scheduled actions live in a separate
+    users file. Each file is guarded by an fcntl lock on a companion .lock
+    file, shared for reads and exclusive for read-modify-write, so several
+    worker processes on one host can use the same directory. Every process
+    keeps each file resident along with its indexes and counters, and
+    reloads a file under its lock when the file's (mtime, size) stamp shows
+    that another process has changed it.
+    
+    The shard count is part of the on-disk layout: changing it requires
+    redistributing the whispers.
+    """
+    
+    def __init__(self, directory: str = Config.SHARD_DIR, shards: int = Config.STORAGE_SHARDS):
+        if fcntl is None:
+            raise RuntimeError("Sharded storage needs fcntl file locking (POSIX only)")
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self._lock_files: Dict[str, Any] = {}
+        self.users = self._open_shard("users.json")
+        self.shards = [self._open_shard(f"whispers-{i:02d}.json") for i in range(shards)]
+    
+    def _open_shard(self, name: str) -> JSONStorage:
+        path = os.path.join(self.directory, name)
+        # Creating a missing file is a write, so it happens under the lock too
+        with self._locked(path):
+            return JSONStorage(path, resident=True, reload_interval=0)
+    
+    @contextmanager
+    def _locked(self, path: str, exclusive: bool = True):
+        """Hold the inter-process lock of one shard file"""
+        lock_file = self._lock_files.get(path)
+        if lock_file is None:
+            lock_file = self._lock_files[path] = open(path + ".lock", 'a')
+        fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+    
+    def _shard_index(self, whisper_id) -> int:
+        return zlib.crc32(str(whisper_id).encode()) % len(self.shards)
+    
+    def _shard(self, whisper_id) -> JSONStorage:
+        return self.shards[self._shard_index(whisper_id)]
+    
+    @staticmethod
+    def _timeline_key(whisper: Dict) -> tuple:
+        return TimelineIndex.key(str(whisper["id"]), whisper)
+    
+    def _read(self, shard: JSONStorage, method, *args, **kwargs):
+        with self._locked(shard.file_path, exclusive=False):
+            shard.reload_if_changed()
+            return method(*args, **kwargs)
+    
+    def _write(self, shard: JSONStorage, method, *args, **kwargs):
+        with self._locked(shard.file_path):
+            shard.reload_if_changed()
+            stamp = shard._file_stamp
+            result = method(*args, **kwargs)
+            if shard._file_stamp is not stamp:
+                self._advance_stamp(shard, stamp)
+            return result
+    
+    @staticmethod
+    def _advance_stamp(shard: JSONStorage, previous: Optional[tuple]):
+        """Make sure a rewritten file's stamp differs from the one it replaced.
+        
+        File times are only as fine as the kernel's clock tick, so two
+        same-sized writes within one tick would otherwise look unchanged
+        to the other processes.
+        """
+        if previous is None or shard._file_stamp is None or shard._file_stamp[0] > previous[0]:
+            return
+        os.utime(shard.file_path, ns=(previous[0] + 1, previous[0] + 1))
+        shard._file_stamp = shard._stat_file()
+    
+    def enable_write_behind(self, window: float, max_pending: int):
+        raise ValueError("Write-behind is not supported by sharded storage")
+    
+    def flush(self):
+        """Every write goes straight to its shard file"""
+    
+    def close(self):
+        """Release the shard lock files"""
+        for lock_file in self._lock_files.values():
+            lock_file.close()
+        self._lock_files = {}
+    
+    def get_user(self, user_id: int) -> Optional[Dict]:
+        """Get user by ID"""
+        return self._read(self.users, self.users.get_user, user_id)
+    
+    def save_user(self, user_id: int, user_data: Dict):
+        """Save user data"""
+        self._write(self.users, self.users.save_user, user_id, user_data)
+    
+    def save_users(self, users: Dict):
+        """Save several users with a single write"""
+        self._write(self.users, self.users.save_users, users)
+    
+    def resolve_username(self, username: str) -> Optional[str]:
+        """Get the ID of the user with this username (case-insensitive, @ optional)"""
+        return self._read(self.users, self.users.resolve_username, username)
+    
+    def get_whisper(self, whisper_id: int) -> Optional[Dict]:
+        """Get whisper by ID"""
+        shard = self._shard(whisper_id)
+        return self._read(shard, shard.get_whisper, whisper_id)
+    
+    def save_whisper(self, whisper_id: int, whisper_data: Dict):
+        """Save whisper data"""
+        shard = self._shard(whisper_id)
+        self._write(shard, shard.save_whisper, whisper_id, whisper_data)
+    
+    def delete_whisper(self, whisper_id: int):
+        """Delete whisper by ID"""
+        shard = self._shard(whisper_id)
+        self._write(shard, shard.delete_whisper, whisper_id)
+    
+    def delete_whispers(self, whisper_ids: List[str]):
+        """Delete several whispers with one write per affected shard"""
+        by_shard: Dict[int, List[str]] = {}
+        for whisper_id in whisper_ids:
+            by_shard.setdefault(self._shard_index(whisper_id), []).append(whisper_id)
+        for index, shard_ids in by_shard.items():
+            shard = self.shards[index]
+            self._write(shard, shard.delete_whispers, shard_ids)
+    
+    def purge_expired(self, now: Optional[float] = None) -> List[str]:
+        """Delete whispers past the retention policy, returning their IDs"""
+        if not (self.revealed_ttl or self.unrevealed_ttl):
+            return []
+        now = time.time() if now is None else now
+        expired = []
+        for shard in self.shards:
+            expired.extend(self._write(shard, shard.purge_expired, now))
+        return expired
+    
+    def get_user_whispers(self, user_id: int, as_sender: bool = True) -> List[Dict]:
+        """Get all whispers for a user (as sender or recipient), oldest first"""
+        result = []
+        for shard in self.shards:
+            result.extend(self._read(shard, shard.get_user_whispers, user_id, as_sender))
+        result.sort(key=self._timeline_key)
+        return result
+    
+    def get_next_whisper_id(self) -> int:
+        """Get the next available whisper ID"""
+        return self._write(self.users, self.users.get_next_whisper_id)
+    
     def get_all_whispers(self) -> Dict:
         """Get all whispers"""
-        data = self._read_data()
-        return data["whispers"]
+        whispers = {}
+        for shard in self.shards:
+            whispers.update(self._read(shard, shard.get_all_whispers))
+        return whispers
     
     def get_all_users(self) -> Dict:
         """Get all users"""
-        data = self._read_data()
-        return data["users"]
+        return self._read(self.users, self.users.get_all_users)
+    
+    def get_whispers_page(
+        self,
+        cursor: Optional[tuple] = None,
+        direction: str = "next",
+        limit: int = 10,
+        **filters,
+    ) -> Tuple[List[Dict], bool]:
+        """One page of whispers, newest first, merged from every shard's own page"""
+        candidates = []
+        has_more = False
+        for shard in self.shards:
+            page, shard_more = self._read(
+                shard, shard.get_whispers_page, cursor=cursor, direction=direction, limit=limit, **filters
+            )
+            candidates.extend(page)
+            has_more = has_more or shard_more
+        
+        # Keep the `limit` whispers nearest the cursor, then show newest first
+        forward = direction == "prev"
+        candidates.sort(key=self._timeline_key, reverse=not forward)
+        has_more = has_more or len(candidates) > limit
+        page = candidates[:limit]
+        if forward:
+            page.reverse()
+        return page, has_more
+    
+    def get_users_page(
+        self, cursor: Optional[str] = None, direction: str = "next", limit: int = 10
+    ) -> Tuple[List[Dict], bool]:
+        """One page of users ordered by ID, seeking from the ID at `cursor`"""
+        return self._read(self.users, self.users.get_users_page, cursor, direction, limit)
+    
+    def get_stats(self) -> Dict:
+        """Sum the running counters of every shard"""
+        counts = dict.fromkeys(STAT_FIELDS, 0)
+        for shard in self.shards:
+            shard_counts = self._read(shard, shard.get_stat_counts)
+            for field in STAT_FIELDS:
+                counts[field] += shard_counts[field]
+        users = self._read(self.users, lambda: len(self.users.get_all_users()))
+        return format_stats(counts, users)
+    
+    def rebuild_stats(self) -> Dict:
+        """Recount every shard from scratch, replacing its running counters"""
+        for shard in self.shards:
+            self._read(shard, shard.rebuild_stats)
+        return self.get_stats()
+    
+    def get_scheduled_actions(self) -> Dict:
+        """Get all pending deferred actions, keyed by action ID"""
+        return self._read(self.users, self.users.get_scheduled_actions)
+    
+    def save_scheduled_actions(self, actions: Dict):
+        """Add or replace deferred actions"""
+        self._write(self.users, self.users.save_scheduled_actions, actions)
+    
+    def delete_scheduled_actions(self, action_ids: List[str]):
+        """Remove finished deferred actions"""
+        self._write(self.users, self.users.delete_scheduled_actions, action_ids)
+
+class SQLiteStorage(AsyncStorageMixin):
+    """SQLite backend with the same interface as JSONStorage.
+    
+    Whispers and users are real tables; sender, recipient and creation time
+    are indexed so per-user lookups don't scan the whole dataset. The full
+    record is kept as JSON alongside the indexed columns, so both whisper
+    schemas (inline and /create) round-trip unchanged.
+    """
+    
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS users (
+            id TEXT PRIMARY KEY,
+            username TEXT,
+            first_name TEXT,
+            data TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS whispers (
+            id TEXT PRIMARY KEY,
+            sender_id TEXT,
+            recipient_id TEXT,
+            recipient TEXT,
+            recipient_type TEXT,
+            created_at INTEGER,
+            is_revealed INTEGER NOT NULL DEFAULT 0,
+            revealed_at INTEGER,
+            data TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS scheduled_actions (
+            id TEXT PRIMARY KEY,
+            data TEXT NOT NULL
+        );
+    """
+    
+    INDEXES = """
+        CREATE INDEX IF NOT EXISTS idx_whispers_sender ON whispers (sender_id);
+        CREATE INDEX IF NOT EXISTS idx_whispers_recipient_id ON whispers (recipient_id);
+        CREATE INDEX IF NOT EXISTS idx_whispers_recipient ON whispers (recipient COLLATE NOCASE);
+        CREATE INDEX IF NOT EXISTS idx_whispers_recipient_typed ON whispers (recipient_type, recipient);
+        CREATE INDEX IF NOT EXISTS idx_whispers_created_at ON whispers (created_at);
+        CREATE INDEX IF NOT EXISTS idx_whispers_sender_created ON whispers (sender_id, created_at);
+        CREATE INDEX IF NOT EXISTS idx_whispers_revealed_created ON whispers (is_revealed, created_at);
+        CREATE INDEX IF NOT EXISTS idx_whispers_revealed_at ON whispers (is_revealed, revealed_at);
+        CREATE INDEX IF NOT EXISTS idx_users_username ON users (username COLLATE NOCASE);
+    """
+    
+    WHISPER_INSERT = (
+        "INSERT OR REPLACE INTO whispers "
+        "(id, sender_id, recipient_id, recipient, recipient_type, created_at, is_revealed, revealed_at, data) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+    )
+    
+    def __init__(self, file_path: str = Config.SQLITE_FILE):
+        self.file_path = file_path
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(file_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        with self._conn:
+            self._conn.executescript(self.SCHEMA)
+            self._migrate()
+            self._conn.executescript(self.INDEXES)
+        if self._conn.execute("SELECT 1 FROM meta WHERE key = 'stats_whispers'").fetchone() is None:
+            self.rebuild_stats()
+            self._conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('next_whisper_id', 1)")
+    
+    def _stat_whisper(self, whisper_id: str) -> Optional[tuple]:
+        """Stat contribution of the stored version of a whisper, if any"""
+        row = self._conn.execute("SELECT data FROM whispers WHERE id = ?", (whisper_id,)).fetchone()
+        return whisper_stat_counts(json.loads(row[0])) if row else None
+    
+    def _bump_stats(self, deltas):
+        """Add (field, delta) pairs to the counters kept in the meta table"""
+        self._conn.executemany(
+            "UPDATE meta SET value = value + ? WHERE key = ?",
+            ((delta, "stats_" + field) for field, delta in deltas if delta),
+        )
+    
+    def _migrate(self):
+        """Bring databases created by older versions up to the current schema"""
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(whispers)")}
+        if "revealed_at" not in columns:
+            self._conn.execute("ALTER TABLE whispers ADD COLUMN revealed_at INTEGER")
+            self._conn.execute("UPDATE whispers SET revealed_at = json_extract(data, '$.revealed_at')")
+    
+    @staticmethod
+    def _user_row(user_id, user_data: Dict) -> tuple:
+        return (
+            str(user_id),
+            normalize_username(user_data.get("username")),
+            user_data.get("first_name"),
+            json.dumps(user_data, separators=(',', ':')),
+        )
+    
+    @staticmethod
+    def _whisper_row(whisper_id, whisper_data: Dict) -> tuple:
+        def text(value):
+            return None if value is None else str(value)
+        
+        return (
+            str(whisper_id),
+            text(whisper_data.get("sender_id")),
+            text(whisper_data.get("recipient_id")),
+            text(whisper_data.get("recipient")),
+            whisper_data.get("recipient_type"),
+            whisper_data.get("created_at"),
+            1 if whisper_data.get("is_revealed") else 0,
+            whisper_data.get("revealed_at"),
+            json.dumps(whisper_data, separators=(',', ':')),
+        )
+    
+    @contextmanager
+    def _transaction(self):
+        """Commit on exit, unless commits are deferred to flush()"""
+        with self._lock:
+            if self.write_behind:
+                yield
+            else:
+                with self._conn:
+                    yield
+    
+    def flush(self):
+        """Commit mutations held back by write-behind mode"""
+        with self._lock:
+            self._conn.commit()
+    
+    def close(self):
+        """Release resources held by the backend"""
+        with self._lock:
+            self._conn.commit()
+            self._conn.close()
+    
+    def get_user(self, user_id: int) -> Optional[Dict]:
+        """Get user by ID"""
+        with self._lock:
+            row = self._conn.execute("SELECT data FROM users WHERE id = ?", (str(user_id),)).fetchone()
+        return json.loads(row[0]) if row else None
+    
+    def save_user(self, user_id: int, user_data: Dict):
+        """Save user data"""
+        self.save_users({user_id: user_data})
+    
+    def save_users(self, users: Dict):
+        """Save several users in one transaction"""
+        with self._transaction():
+            for user_id, user_data in users.items():
+                self._save_user_row(user_id, user_data)
+    
+    def _save_user_row(self, user_id, user_data: Dict):
+        if self._conn.execute("SELECT 1 FROM users WHERE id = ?", (str(user_id),)).fetchone() is None:
+            self._bump_stats([("users", 1)])
+        username = normalize_username(user_data.get("username"))
+        if username:
+            # Usernames can change hands; only the latest owner stays indexed
+            self._conn.execute(
+                "UPDATE users SET username = NULL WHERE username = ? COLLATE NOCASE AND id != ?",
+                (username, str(user_id)),
+            )
+        self._conn.execute(
+            "INSERT OR REPLACE INTO users (id, username, first_name, data) VALUES (?, ?, ?, ?)",
+            self._user_row(user_id, user_data),
+        )
+    
+    def resolve_username(self, username: str) -> Optional[str]:
+        """Get the ID of the user with this username (case-insensitive, @ optional)"""
+        username = normalize_username(username)
+        if not username:
+            return None
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id FROM users WHERE username = ? COLLATE NOCASE", (username,)
+            ).fetchone()
+        return row[0] if row else None
+    
+    def get_whisper(self, whisper_id: int) -> Optional[Dict]:
+        """Get whisper by ID"""
+        with self._lock:
+            row = self._conn.execute("SELECT data FROM whispers WHERE id = ?", (str(whisper_id),)).fetchone()
+        return json.loads(row[0]) if row else None
+    
+    def save_whisper(self, whisper_id: int, whisper_data: Dict):
+        """Save whisper data"""
+        with self._transaction():
+            old = self._stat_whisper(str(whisper_id)) or (0,) * len(STAT_FIELDS)
+            new = whisper_stat_counts(whisper_data)
+            self._bump_stats(zip(STAT_FIELDS, (n - o for n, o in zip(new, old))))
+            self._conn.execute(self.WHISPER_INSERT, self._whisper_row(whisper_id, whisper_data))
+    
+    def delete_whisper(self, whisper_id: int):
+        """Delete whisper by ID"""
+        self.delete_whispers([whisper_id])
+    
+    def delete_whispers(self, whisper_ids: List[str]):
+        """Delete several whispers in one transaction"""
+        with self._transaction():
+            for whisper_id in whisper_ids:
+                old = self._stat_whisper(str(whisper_id))
+                if old is None:
+                    continue
+                self._bump_stats(zip(STAT_FIELDS, (-o for o in old)))
+                self._conn.execute("DELETE FROM whispers WHERE id = ?", (str(whisper_id),))
+    
+    def purge_expired(self, now: Optional[float] = None) -> List[str]:
+        """Delete whispers past the retention policy, returning their IDs"""
+        if not (self.revealed_ttl or self.unrevealed_ttl):
+            return []
+        now = time.time() if now is None else now
+        # Every branch is a range scan on one of the (is_revealed, ...) indexes
+        queries = []
+        if self.revealed_ttl:
+            cutoff = now - self.revealed_ttl
+            queries.append(("SELECT id FROM whispers WHERE is_revealed = 1 AND revealed_at <= ?", cutoff))
+            queries.append((
+                "SELECT id FROM whispers WHERE is_revealed = 1 AND revealed_at IS NULL AND created_at <= ?",
+                cutoff,
+            ))
+        if self.unrevealed_ttl:
+            queries.append((
+                "SELECT id FROM whispers WHERE is_revealed = 0 AND created_at <= ?",
+                now - self.unrevealed_ttl,
+            ))
+        
+        with self._lock:
+            expired = [row[0] for query, cutoff in queries for row in self._conn.execute(query, (cutoff,))]
+        self.delete_whispers(expired)
+        return expired
+    
+    def get_user_whispers(self, user_id: int, as_sender: bool = True) -> List[Dict]:
+        """Get all whispers for a user (as sender or recipient)"""
+        if as_sender:
+            query = "SELECT id, data FROM whispers WHERE sender_id = ?"
+            params = (str(user_id),)
+        else:
+            # Inline whispers addressed by ID keep it in the recipient column.
+            # One indexed SELECT per column; an OR across them would scan
+            # the table, as the recipient index is case-insensitive.
+            query = (
+                "SELECT id, data FROM whispers WHERE recipient_id = ? "
+                "UNION ALL "
+                "SELECT id, data FROM whispers "
+                "WHERE recipient_type = 'id' AND recipient = ? AND recipient_id IS NOT ?"
+            )
+            params = (str(user_id), str(user_id), str(user_id))
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return [{"id": whisper_id, **json.loads(data)} for whisper_id, data in rows]
+    
+    def get_next_whisper_id(self) -> int:
+        """Get the next available whisper ID"""
+        with self._transaction():
+            row = self._conn.execute("SELECT value FROM meta WHERE key = 'next_whisper_id'").fetchone()
+            self._conn.execute("UPDATE meta SET value = ? WHERE key = 'next_whisper_id'", (row[0] + 1,))
+        return row[0]
+    
+    def get_all_whispers(self) -> Dict:
+        """Get all whispers"""
+        with self._lock:
+            rows = self._conn.execute("SELECT id, data FROM whispers").fetchall()
+        return {whisper_id: json.loads(data) for whisper_id, data in rows}
+    
+    def get_all_users(self) -> Dict:
+        """Get all users"""
+        with self._lock:
+            rows = self._conn.execute("SELECT id, data FROM users").fetchall()
+        return {user_id: json.loads(data) for user_id, data in rows}
+    
+    def import_json(self, json_path: str) -> Dict:
+        """Load an existing whispers.json (or compact snapshot) into the database in one transaction.
+        
+        Existing rows with the same IDs are replaced. Returns the number of
+        users and whispers imported.
+        """
+        data = snapshot.load(json_path)
+        
+        users = data.get("users", {})
+        whispers = data.get("whispers", {})
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO users (id, username, first_name, data) VALUES (?, ?, ?, ?)",
+                (self._user_row(user_id, user) for user_id, user in users.items()),
+            )
+            self._conn.executemany(
+                self.WHISPER_INSERT,
+                (self._whisper_row(whisper_id, whisper) for whisper_id, whisper in whispers.items()),
+            )
+            self._conn.execute(
+                "UPDATE meta SET value = MAX(value, ?) WHERE key = 'next_whisper_id'",
+                (data.get("next_whisper_id", 1),),
+            )
+        # The bulk insert bypasses the running counters
+        self.rebuild_stats(report_drift=False)
+        return {"users": len(users), "whispers": len(whispers)}
+    
+    def get_whispers_page(
+        self,
+        cursor: Optional[tuple] = None,
+        direction: str = "next",
+        limit: int = 10,
+        revealed: Optional[bool] = None,
+        sender_id: Optional[int] = None,
+        since: Optional[int] = None,
+        until: Optional[int] = None,
+    ) -> Tuple[List[Dict], bool]:
+        """One page of whispers, newest first (see JSONStorage.get_whispers_page)"""
+        clauses, params = [], []
+        if revealed is not None:
+            clauses.append("is_revealed = ?")
+            params.append(1 if revealed else 0)
+        if sender_id is not None:
+            clauses.append("sender_id = ?")
+            params.append(str(sender_id))
+        if since is not None:
+            clauses.append("created_at >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append("created_at <= ?")
+            params.append(until)
+        
+        forward = direction == "prev"
+        if cursor is not None:
+            clauses.append("(created_at, id) > (?, ?)" if forward else "(created_at, id) < (?, ?)")
+            params.extend(cursor)
+        where = ("WHERE " + " AND ".join(clauses)) if clauses else ""
+        order = "ASC" if forward else "DESC"
+        
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT id, data FROM whispers {where} ORDER BY created_at {order}, id {order} LIMIT ?",
+                (*params, limit + 1),
+            ).fetchall()
+        
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if forward:
+            rows.reverse()
+        return [{"id": whisper_id, **json.loads(data)} for whisper_id, data in rows], has_more
+    
+    def get_users_page(
+        self, cursor: Optional[str] = None, direction: str = "next", limit: int = 10
+    ) -> Tuple[List[Dict], bool]:
+        """One page of users ordered by ID, seeking from the ID at `cursor`"""
+        forward = direction == "next"
+        where = ""
+        params = []
+        if cursor is not None:
+            where = "WHERE id > ?" if forward else "WHERE id < ?"
+            params.append(str(cursor))
+        order = "ASC" if forward else "DESC"
+        
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT id, data FROM users {where} ORDER BY id {order} LIMIT ?", (*params, limit + 1)
+            ).fetchall()
+        
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if not forward:
+            rows.reverse()
+        return [{"id": user_id, **json.loads(data)} for user_id, data in rows], has_more
+    
+    def get_stats(self) -> Dict:
+        """Get bot statistics from the running counters"""
+        with self._lock:
+            rows = self._conn.execute("SELECT key, value FROM meta WHERE key LIKE 'stats_%'").fetchall()
+        counts = {key[len("stats_"):]: value for key, value in rows}
+        return format_stats(counts, counts["users"])
+    
+    def rebuild_stats(self, report_drift: bool = True) -> Dict:
+        """Recount statistics from scratch, replacing the running counters"""
+        with self._transaction():
+            row = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(is_revealed), 0), "
+                "COALESCE(SUM(json_type(data, '$.media_items') = 'array'), 0), "
+                "COALESCE(SUM(CASE WHEN json_type(data, '$.media_items') = 'array' "
+                "THEN json_array_length(data, '$.media_items') ELSE 0 END), 0) "
+                "FROM whispers"
+            ).fetchone()
+            users = self._conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+            fresh = dict(zip(STAT_FIELDS, row), users=users)
+            
+            current = dict(self._conn.execute("SELECT key, value FROM meta WHERE key LIKE 'stats_%'").fetchall())
+            current = {key[len("stats_"):]: value for key, value in current.items()}
+            if report_drift and current and current != fresh:
+                logger.warning("Stats counters drifted: %s, recounted %s", current, fresh)
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                (("stats_" + field, value) for field, value in fresh.items()),
+            )
+        return format_stats(fresh, users)
+    
+    def get_scheduled_actions(self) -> Dict:
+        """Get all pending deferred actions, keyed by action ID"""
+        with self._lock:
+            rows = self._conn.execute("SELECT id, data FROM scheduled_actions").fetchall()
+        return {action_id: json.loads(data) for action_id, data in rows}
+    
+    def save_scheduled_actions(self, actions: Dict):
+        """Add or replace deferred actions in one transaction"""
+        with self._transaction():
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO scheduled_actions (id, data) VALUES (?, ?)",
+                ((action_id, json.dumps(action, separators=(',', ':'))) for action_id, action in actions.items()),
+            )
+    
+    def delete_scheduled_actions(self, action_ids: List[str]):
+        """Remove finished deferred actions in one transaction"""
+        with self._transaction():
+            self._conn.executemany("DELETE FROM scheduled_actions WHERE id = ?", ((action_id,) for action_id in action_ids))
+
+def create_storage():
+    """Create the storage backend selected by Config.STORAGE_BACKEND"""
+    backend = Config.STORAGE_BACKEND
+    if backend == "json":
+        backend_storage = JSONStorage()
+    elif backend == "log":
+        backend_storage = LogStorage()
+    elif backend == "sqlite":
+        backend_storage = SQLiteStorage()
+    elif backend == "sharded":
+        backend_storage = ShardedStorage()
+    else:
+        raise ValueError(f"Unknown storage backend: {backend!r}")
+    
+    if Config.WRITE_BEHIND:
+        backend_storage.enable_write_behind(
+            Config.WRITE_BEHIND_WINDOW_MS / 1000,
+            Config.WRITE_BEHIND_MAX_PENDING,
+        )
+    return backend_storage
 
 # Global storage instance
-storage = JSONStorage()
+storage = create_storage()
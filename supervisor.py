@@ -0,0 +1,181 @@
+"""Run several bot worker processes behind one webhook listener.
+
+Each worker is bot.py in webhook mode on a local port, with all of them
+sharing the sharded storage backend. The supervisor owns the public
+listener and forwards every update to the worker picked by its routing
+key, so all updates about one whisper or one user are handled by the same
+process, in the order they arrived.
+
+Usage: python supervisor.py
+"""
+import asyncio
+import json
+import logging
+import os
+import signal
+import sys
+from typing import Dict, List, Optional
+
+from config import Config
+from utils.webhook import SECRET_HEADER, WebhookServer, whisper_routing_key, worker_for
+
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger("supervisor")
+
+BOT_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bot.py")
+# Seconds before retrying a worker that is down or busy
+RETRY_DELAY = 1
+
+
+def routing_key(update: Dict) -> str:
+    """The whisper or user an update is about"""
+    callback = update.get("callback_query") or {}
+    data = callback.get("data") or ""
+    # Taps on one whisper's reveal button from different users must meet
+    # the same per-whisper lock; inline whisper ids are minted so this is
+    # also the worker holding the draft (see handlers.inline.new_whisper_id)
+    if data.startswith("reveal_"):
+        return whisper_routing_key(data.split("_", 1)[1])
+    # Everything else (conversations, inline drafts, settings) is per user
+    for value in update.values():
+        if isinstance(value, dict) and isinstance(value.get("from"), dict):
+            return f"user:{value['from']['id']}"
+    return f"update:{update.get('update_id')}"
+
+
+def worker_env(index: int, count: int) -> Dict[str, str]:
+    env = dict(os.environ)
+    env.update(
+        BOT_MODE="webhook",
+        STORAGE_BACKEND="sharded",
+        WEBHOOK_LISTEN="127.0.0.1",
+        WEBHOOK_PORT=str(Config.WORKER_BASE_PORT + index),
+        # Only the first worker registers the public URL with Telegram
+        WEBHOOK_URL=Config.WEBHOOK_URL if index == 0 else "",
+        WORKER_INDEX=str(index),
+        WORKER_COUNT=str(count),
+    )
+    return env
+
+
+class WorkerLink:
+    """Forwards updates to one worker over a keep-alive connection, in order"""
+
+    def __init__(self, port: int, queue_size: int):
+        self.port = port
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+
+    async def _post(self, body: bytes) -> int:
+        if self._writer is None:
+            self._reader, self._writer = await asyncio.open_connection("127.0.0.1", self.port)
+        self._writer.write(
+            f"POST {Config.WEBHOOK_PATH} HTTP/1.1\r\n"
+            f"Host: 127.0.0.1:{self.port}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"{SECRET_HEADER}: {Config.WEBHOOK_SECRET}\r\n"
+            f"Content-Length: {len(body)}\r\n\r\n".encode("latin-1") + body
+        )
+        await self._writer.drain()
+
+        status = int((await self._reader.readline()).split()[1])
+        length = 0
+        while True:
+            line = await self._reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            if name.strip().lower() == "content-length":
+                length = int(value)
+        await self._reader.readexactly(length)
+        return status
+
+    def _disconnect(self):
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = self._writer = None
+
+    async def run(self):
+        while True:
+            body = await self.queue.get()
+            while True:
+                try:
+                    status = await self._post(body)
+                except (OSError, asyncio.IncompleteReadError, ValueError, IndexError):
+                    # Worker not up yet, restarting, or it dropped the connection
+                    self._disconnect()
+                    status = None
+
+                if status == 200:
+                    break
+                if status in (400, 403):
+                    logger.warning("Worker on port %d rejected an update with %d", self.port, status)
+                    break
+                await asyncio.sleep(RETRY_DELAY)
+
+
+class ForwardingServer(WebhookServer):
+    """Public listener that hands each update to its worker's link"""
+
+    def __init__(self, links: List[WorkerLink]):
+        super().__init__(None)
+        self.links = links
+
+    async def handle_update(self, body: bytes) -> int:
+        try:
+            update = json.loads(body)
+            key = routing_key(update)
+        except (ValueError, AttributeError):
+            return 400
+        link = self.links[worker_for(key, len(self.links))]
+        try:
+            link.queue.put_nowait(body)
+        except asyncio.QueueFull:
+            return 503
+        return 200
+
+
+async def keep_worker_running(index: int, count: int, procs: Dict, stop: asyncio.Event):
+    """Run one worker process, restarting it if it dies"""
+    while not stop.is_set():
+        proc = await asyncio.create_subprocess_exec(sys.executable, BOT_SCRIPT, env=worker_env(index, count))
+        procs[index] = proc
+        code = await proc.wait()
+        if stop.is_set():
+            break
+        logger.warning("Worker %d exited with code %s, restarting", index, code)
+        await asyncio.sleep(RETRY_DELAY)
+
+
+async def supervise(count: int = Config.SUPERVISOR_WORKERS):
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    links = [WorkerLink(Config.WORKER_BASE_PORT + i, Config.WEBHOOK_QUEUE_SIZE) for i in range(count)]
+    server = ForwardingServer(links)
+    procs: Dict[int, asyncio.subprocess.Process] = {}
+    keepers = [asyncio.create_task(keep_worker_running(i, count, procs, stop)) for i in range(count)]
+    forwarders = [asyncio.create_task(link.run()) for link in links]
+
+    await server.start()
+    logger.info("Supervising %d workers", count)
+    try:
+        await stop.wait()
+    finally:
+        await server.stop()
+        for task in forwarders:
+            task.cancel()
+        for proc in procs.values():
+            if proc.returncode is None:
+                proc.terminate()
+        await asyncio.gather(*keepers, *forwarders, return_exceptions=True)
+
+
+if __name__ == "__main__":
+    asyncio.run(supervise())
@@ -0,0 +1,224 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from telegram import Bot
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TelegramError
+
+from utils.registry import user_registry
+
+logger = logging.getLogger(__name__)
+
+# Transient network errors are retried this many times per user
+MAX_ATTEMPTS = 3
+# Flood-control waits don't count as attempts: the user wasn't rejected,
+# the bot was just sending too fast. This only bounds a runaway loop.
+MAX_FLOOD_WAITS = 20
+
+
+def retry_after_seconds(error: RetryAfter) -> float:
+    """RetryAfter.retry_after is an int in PTB 21 and a timedelta in later versions"""
+    retry_after = error.retry_after
+    if hasattr(retry_after, "total_seconds"):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+
+class TokenBucket:
+    """Global send-rate limiter shared by every broadcast worker.
+
+    A flood-control response pauses the bucket as a whole, so all workers
+    back off together instead of each hammering the API on its own.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class BroadcastEngine:
+    """Send one message to many users with bounded concurrency.
+
+    Progress is checkpointed to `state_path` as a cursor below which every
+    user has been handled, so an interrupted broadcast resumes from there.
+    Users between the cursor and the furthest completed send may receive
+    the message twice after a crash; nobody is skipped. The outcome counts
+    only cover users below the cursor, so resending doesn't count anyone
+    twice.
+    """
+
+    def __init__(
+        self,
+        state_path: str,
+        rate: float,
+        concurrency: int,
+        checkpoint_interval: float,
+    ):
+        self.bot: Optional[Bot] = None
+        self.state_path = state_path
+        self.bucket = TokenBucket(rate)
+        self.concurrency = concurrency
+        self.checkpoint_interval = checkpoint_interval
+        self.state: Optional[Dict] = None
+        self.running = False
+        self._next = 0
+        # Outcomes of finished sends at or above the cursor, by index
+        self._done: Dict[int, str] = {}
+
+    @staticmethod
+    def new_state(message: str, user_ids: List[str], chat_id: int) -> Dict:
+        return {
+            "message": message,
+            "user_ids": user_ids,
+            "chat_id": chat_id,
+            "cursor": 0,
+            "success": 0,
+            "failures": 0,
+            "unreachable": 0,
+            "started_at": int(time.time()),
+            "finished": False,
+        }
+
+    def load_state(self) -> Optional[Dict]:
+        """Return the checkpoint of an unfinished broadcast, if any"""
+        try:
+            with open(self.state_path, 'r') as f:
+                state = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        return None if state.get("finished") else state
+
+    def _write_state(self, state: Dict):
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f, separators=(',', ':'))
+        os.replace(tmp_path, self.state_path)
+
+    async def checkpoint(self):
+        # Snapshot on the loop, write off it
+        state = dict(self.state)
+        await asyncio.to_thread(self._write_state, state)
+
+    async def _send(self, user_id: str) -> str:
+        """Deliver to one user: returns "success", "unreachable" or "failures" """
+        text = f"📢 Broadcast from admin:\n\n{self.state['message']}"
+        attempts = flood_waits = 0
+        while attempts < MAX_ATTEMPTS:
+            await self.bucket.acquire()
+            try:
+                await self.bot.send_message(chat_id=user_id, text=text)
+                return "success"
+            except RetryAfter as e:
+                flood_waits += 1
+                if flood_waits > MAX_FLOOD_WAITS:
+                    return "failures"
+                self.bucket.pause(retry_after_seconds(e))
+            except Forbidden:
+                return "unreachable"
+            except BadRequest as e:
+                if "chat not found" in str(e).lower():
+                    return "unreachable"
+                return "failures"
+            except NetworkError:
+                await asyncio.sleep(2 ** attempts)
+                attempts += 1
+            except TelegramError:
+                return "failures"
+        return "failures"
+
+    async def _mark_unreachable(self, user_id: str):
+        # Through the registry, so its copy of the user isn't left stale
+        if await user_registry.get(user_id) is not None:
+            await user_registry.update(user_id, unreachable=True)
+
+    def _complete(self, index: int, outcome: str):
+        """Record a finished index, advancing the cursor and counts past contiguous ones"""
+        self._done[index] = outcome
+        while self.state["cursor"] in self._done:
+            self.state[self._done.pop(self.state["cursor"])] += 1
+            self.state["cursor"] += 1
+
+    async def _worker(self):
+        user_ids = self.state["user_ids"]
+        while self._next < len(user_ids):
+            index = self._next
+            self._next += 1
+            user_id = user_ids[index]
+
+            outcome = await self._send(user_id)
+            if outcome == "unreachable":
+                await self._mark_unreachable(user_id)
+            self._complete(index, outcome)
+
+    def claim(self) -> bool:
+        """Reserve the engine for a broadcast; False if one is already running.
+
+        Handlers claim it before their first await, so two concurrent
+        commands can't both start a broadcast on the same state file.
+        run() releases it when done; call release() if run() never starts.
+        """
+        if self.running:
+            return False
+        self.running = True
+        return True
+
+    def release(self):
+        self.running = False
+
+    async def run(self, bot: Bot, state: Dict, on_progress: Callable[[Dict], Awaitable[None]]):
+        """Run (or resume) a broadcast claimed with claim(), reporting progress periodically"""
+        self.bot = bot
+        self.state = state
+        self.running = True
+        self._next = state["cursor"]
+        self._done = {}
+        await self.checkpoint()
+
+        workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+        all_done = asyncio.gather(*workers)
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(asyncio.shield(all_done), self.checkpoint_interval)
+                    break
+                except asyncio.TimeoutError:
+                    await self.checkpoint()
+                    try:
+                        await on_progress(self.state)
+                    except TelegramError:
+                        logger.warning("Could not report broadcast progress", exc_info=True)
+        finally:
+            if not all_done.done():
+                all_done.cancel()
+                await asyncio.gather(all_done, return_exceptions=True)
+            self.state["finished"] = all_done.done() and not all_done.cancelled() and all_done.exception() is None
+            self.running = False
+            await self.checkpoint()
+
+        await on_progress(self.state)
@@ -0,0 +1,72 @@
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+
+class TTLCache:
+    """Bounded in-memory mapping whose entries expire after a fixed TTL.
+
+    Every entry shares the same TTL, so insertion order is also expiry
+    order and expired entries are dropped from the front on each access
+    without any background task.
+    """
+
+    def __init__(self, ttl: float, maxsize: int):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+
+    def _expire(self):
+        now = time.monotonic()
+        while self._items:
+            key, (expires_at, _) = next(iter(self._items.items()))
+            if expires_at > now:
+                break
+            del self._items[key]
+
+    def set(self, key: Hashable, value: Any):
+        self._expire()
+        self._items.pop(key, None)
+        self._items[key] = (time.monotonic() + self.ttl, value)
+        while len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        self._expire()
+        entry = self._items.get(key)
+        return entry[1] if entry else None
+
+    def pop(self, key: Hashable) -> Optional[Any]:
+        self._expire()
+        entry = self._items.pop(key, None)
+        return entry[1] if entry else None
+
+    def __len__(self):
+        self._expire()
+        return len(self._items)
+
+
+class LRUCache:
+    """Bounded mapping that evicts the least recently used entry."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+
+    def set(self, key: Hashable, value: Any):
+        self._items[key] = value
+        self._items.move_to_end(key)
+        while len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        if key not in self._items:
+            return None
+        self._items.move_to_end(key)
+        return self._items[key]
+
+    def pop(self, key: Hashable) -> Optional[Any]:
+        return self._items.pop(key, None)
+
+    def __len__(self):
+        return len(self._items)
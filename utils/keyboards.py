@@ -45,3 +45,59 @@ def get_whisper_action_keyboard(whisper_id: int):
             InlineKeyboardButton("🗑️ Delete", callback_data=f"delete_{whisper_id}")
         ]
     ])
+
+def get_admin_keyboard():
+    """Create admin panel keyboard"""
+    return InlineKeyboardMarkup([
+        [
+            InlineKeyboardButton("📊 Stats", callback_data="admin_stats"),
+            InlineKeyboardButton("🔁 Recount", callback_data="admin_recount")
+        ],
+        [
+            InlineKeyboardButton("👥 Users", callback_data="admin_list_users"),
+            InlineKeyboardButton("📨 Whispers", callback_data="admin_list_whispers")
+        ],
+        [
+            InlineKeyboardButton("📢 Broadcast", callback_data="admin_broadcast"),
+            InlineKeyboardButton("🔬 Profile", callback_data="admin_profile")
+        ]
+    ])
+
+def get_profiler_keyboard(running: bool = False):
+    """Create profiler session keyboard"""
+    if running:
+        rows = [[InlineKeyboardButton("⏹ Stop and report", callback_data="admin_profile:stop")]]
+    else:
+        rows = [
+            [
+                InlineKeyboardButton("100 updates", callback_data="admin_profile:updates:100"),
+                InlineKeyboardButton("1000 updates", callback_data="admin_profile:updates:1000")
+            ],
+            [
+                InlineKeyboardButton("30 seconds", callback_data="admin_profile:seconds:30"),
+                InlineKeyboardButton("5 minutes", callback_data="admin_profile:seconds:300")
+            ]
+        ]
+    rows.append([InlineKeyboardButton("🔙 Back", callback_data="admin_panel")])
+    return InlineKeyboardMarkup(rows)
+
+def get_page_navigation(prefix: str, prev_cursor=None, next_cursor=None):
+    """Create the Prev/Next button row for a paginated listing"""
+    navigation = []
+    if prev_cursor is not None:
+        navigation.append(InlineKeyboardButton("⬅️ Prev", callback_data=f"{prefix}:p:{prev_cursor}"))
+    if next_cursor is not None:
+        navigation.append(InlineKeyboardButton("Next ➡️", callback_data=f"{prefix}:n:{next_cursor}"))
+    return navigation
+
+def get_admin_page_keyboard(prefix: str, prev_cursor=None, next_cursor=None):
+    """Create Prev/Next navigation for a paginated admin listing"""
+    navigation = get_page_navigation(prefix, prev_cursor, next_cursor)
+    rows = [navigation] if navigation else []
+    rows.append([InlineKeyboardButton("🔙 Back", callback_data="admin_panel")])
+    return InlineKeyboardMarkup(rows)
+
+def get_list_page_keyboard(user_id: int, prev_cursor=None, next_cursor=None):
+    """Create Prev/Next navigation for a user's /list pages"""
+    navigation = get_page_navigation(f"list:{user_id}", prev_cursor, next_cursor)
+    return InlineKeyboardMarkup([navigation]) if navigation else None
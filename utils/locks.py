@@ -0,0 +1,40 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Dict, Hashable, List
+
+
+class KeyedLock:
+    """One asyncio.Lock per key, created on demand.
+
+    Updates touching the same key (a whisper, a user) run one at a time,
+    while updates on different keys never wait on each other. A key's
+    lock is dropped as soon as nobody holds or waits for it, so the table
+    only ever holds keys that are in use.
+    """
+
+    def __init__(self):
+        # key -> [lock, number of holders and waiters]
+        self._locks: Dict[Hashable, List] = {}
+
+    @asynccontextmanager
+    async def lock(self, key: Hashable):
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+
+    def __len__(self):
+        return len(self._locks)
+
+
+# Guards read-modify-write of a single whisper (reveal)
+whisper_locks = KeyedLock()
+# Guards read-modify-write of a single user's settings
+user_locks = KeyedLock()
@@ -0,0 +1,223 @@
+import asyncio
+import bisect
+import functools
+import logging
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from telegram.error import RetryAfter
+from telegram.ext import ApplicationHandlerStop, ConversationHandler
+from telegram.request import HTTPXRequest
+
+logger = logging.getLogger(__name__)
+
+# Latency bucket upper bounds in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """Call count, error count and latency distribution of one operation"""
+
+    __slots__ = ("buckets", "count", "errors", "total")
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+
+    def observe(self, seconds: float, error: bool = False):
+        self.buckets[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if error:
+            self.errors += 1
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-quantile"""
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.buckets):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+class Metrics:
+    """Process-wide latency histograms, grouped by family and label.
+
+    Families are "handler" (update handlers, by callback name), "storage"
+    (backend methods, timed on the storage thread) and "bot_api" (Bot API
+    requests, by method). RetryAfter responses are counted separately.
+    """
+
+    FAMILIES = {
+        "handler": ("whispey_handler", "handler"),
+        "storage": ("whispey_storage", "op"),
+        "bot_api": ("whispey_bot_api", "method"),
+    }
+
+    def __init__(self):
+        self.histograms: Dict[Tuple[str, str], Histogram] = {}
+        self.retry_after: Dict[str, int] = {}
+        # Storage timings are recorded from the storage thread
+        self._lock = threading.Lock()
+
+    def observe(self, family: str, name: str, seconds: float, error: bool = False):
+        with self._lock:
+            histogram = self.histograms.get((family, name))
+            if histogram is None:
+                histogram = self.histograms[(family, name)] = Histogram()
+            histogram.observe(seconds, error)
+
+    def count_retry_after(self, method: str):
+        with self._lock:
+            self.retry_after[method] = self.retry_after.get(method, 0) + 1
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            items = sorted(self.histograms.items())
+            retry_after = sorted(self.retry_after.items())
+
+        for family, (prefix, label) in self.FAMILIES.items():
+            family_items = [(name, h) for (f, name), h in items if f == family]
+            if not family_items:
+                continue
+            lines.append(f"# TYPE {prefix}_seconds histogram")
+            for name, h in family_items:
+                cumulative = 0
+                for bound, count in zip(BUCKETS, h.buckets):
+                    cumulative += count
+                    lines.append(f'{prefix}_seconds_bucket{{{label}="{name}",le="{bound}"}} {cumulative}')
+                lines.append(f'{prefix}_seconds_bucket{{{label}="{name}",le="+Inf"}} {h.count}')
+                lines.append(f'{prefix}_seconds_sum{{{label}="{name}"}} {h.total:.6f}')
+                lines.append(f'{prefix}_seconds_count{{{label}="{name}"}} {h.count}')
+            lines.append(f"# TYPE {prefix}_errors_total counter")
+            for name, h in family_items:
+                lines.append(f'{prefix}_errors_total{{{label}="{name}"}} {h.errors}')
+
+        if retry_after:
+            lines.append("# TYPE whispey_bot_api_retry_after_total counter")
+            for method, count in retry_after:
+                lines.append(f'whispey_bot_api_retry_after_total{{method="{method}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+    def summary(self, family: str, top: int = 5) -> List[str]:
+        """Short lines for the busiest operations of a family, for the admin panel"""
+        with self._lock:
+            family_items = [(name, h) for (f, name), h in self.histograms.items() if f == family]
+        family_items.sort(key=lambda item: item[1].count, reverse=True)
+        return [
+            f"{name}: {h.count} calls, {h.errors} errors, "
+            f"p50 ≤{h.quantile(0.5) * 1000:g}ms, p95 ≤{h.quantile(0.95) * 1000:g}ms"
+            for name, h in family_items[:top]
+        ]
+
+
+metrics = Metrics()
+
+
+def timed_handler(callback):
+    """Wrap a handler callback to record its latency and failures"""
+    name = getattr(callback, "__name__", repr(callback))
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        start = time.perf_counter()
+        error = False
+        try:
+            return await callback(update, context)
+        except ApplicationHandlerStop:
+            raise
+        except Exception:
+            error = True
+            raise
+        finally:
+            metrics.observe("handler", name, time.perf_counter() - start, error)
+
+    return wrapper
+
+
+def instrument_handlers(application):
+    """Time every registered handler, including those inside conversations"""
+    def instrument(handler):
+        if isinstance(handler, ConversationHandler):
+            for inner in handler.entry_points + handler.fallbacks:
+                instrument(inner)
+            for state_handlers in handler.states.values():
+                for inner in state_handlers:
+                    instrument(inner)
+        elif hasattr(handler, "callback"):
+            handler.callback = timed_handler(handler.callback)
+
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            instrument(handler)
+
+
+class InstrumentedRequest(HTTPXRequest):
+    """HTTPXRequest that times every Bot API call and counts flood-control hits"""
+
+    async def post(self, url: str, *args, **kwargs):
+        method = url.rsplit("/", 1)[-1]
+        start = time.perf_counter()
+        error = False
+        try:
+            return await super().post(url, *args, **kwargs)
+        except RetryAfter:
+            metrics.count_retry_after(method)
+            error = True
+            raise
+        except Exception:
+            error = True
+            raise
+        finally:
+            metrics.observe("bot_api", method, time.perf_counter() - start, error)
+
+
+class MetricsServer:
+    """Serves metrics.render() to GET /metrics on a local port"""
+
+    def __init__(self, listen: str, port: int):
+        self.listen = listen
+        self.port = port
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self) -> bool:
+        """Start listening; a port that can't be bound is logged, not raised"""
+        try:
+            self._server = await asyncio.start_server(self._handle, self.listen, self.port)
+        except OSError as e:
+            logger.error("Metrics endpoint disabled, cannot listen on %s:%d: %s", self.listen, self.port, e)
+            return False
+        logger.info("Metrics on http://%s:%d/metrics", self.listen, self.port)
+        return True
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = await reader.readline()
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+            parts = request_line.decode("latin-1").split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?", 1)[0] == "/metrics":
+                body = metrics.render().encode()
+                head = "HTTP/1.1 200 OK\r\nContent-Type: text/plain; version=0.0.4"
+            else:
+                body = b""
+                head = "HTTP/1.1 404 Not Found"
+            writer.write(f"{head}\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
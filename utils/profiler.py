@@ -0,0 +1,227 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+from types import CodeType
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from config import Config
+from storage import AsyncStorageMixin
+from utils.metrics import timed_handler
+
+logger = logging.getLogger(__name__)
+
+
+async def _noop(update, context):
+    pass
+
+
+# Frames of these functions name the handler or storage operation running
+# beneath them (via their local `name`), which is how samples are attributed
+LABEL_FRAMES = {
+    timed_handler(_noop).__code__: "handler",
+    AsyncStorageMixin._timed.__code__: "storage",
+}
+
+
+def describe_code(code) -> str:
+    """pstats-like "dir/file.py:line(function)" for a code object"""
+    path = os.path.normpath(code.co_filename).split(os.sep)
+    return f"{'/'.join(path[-2:])}:{code.co_firstlineno}({code.co_name})"
+
+
+class Profile:
+    """Stack samples of one profiling session, aggregated as they arrive"""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.started_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.updates = 0
+        self.samples = 0
+        # Samples per handler / storage operation ("idle" when the loop waits)
+        self.by_label: Dict[str, int] = {}
+        # Samples per (label, code objects outer to inner); sampling only
+        # counts these, function names are worked out for the report
+        self.stacks: Dict[Tuple[str, Tuple[CodeType, ...]], int] = {}
+        self._names: Dict[CodeType, str] = {}
+
+    def add(self, frame, is_loop: bool):
+        """Record one thread's stack; returns False if there was nothing to attribute"""
+        codes = []
+        label = None
+        while frame is not None:
+            code = frame.f_code
+            kind = LABEL_FRAMES.get(code)
+            if kind is not None:
+                # Frames above the wrapper are event loop / executor plumbing
+                label = f"{kind}:{frame.f_locals.get('name', '?')}"
+                break
+            codes.append(code)
+            frame = frame.f_back
+
+        if label is None:
+            if not is_loop:
+                return False  # an idle worker thread
+            # The loop blocked in select() is waiting for work
+            label = "idle" if codes and codes[0].co_filename.endswith("selectors.py") else "event loop"
+
+        self.samples += 1
+        self.by_label[label] = self.by_label.get(label, 0) + 1
+        if label == "idle":
+            return True
+
+        if not codes:
+            return True
+        codes.reverse()
+        key = (label, tuple(codes))
+        self.stacks[key] = self.stacks.get(key, 0) + 1
+        return True
+
+    def _name(self, code: CodeType) -> str:
+        name = self._names.get(code)
+        if name is None:
+            name = self._names[code] = describe_code(code)
+        return name
+
+    def function_counts(self) -> Tuple[Dict[str, int], Dict[str, int]]:
+        """Samples per function on top of the stack (self), and anywhere on it (total)"""
+        self_counts: Dict[str, int] = {}
+        total_counts: Dict[str, int] = {}
+        for (_, codes), count in self.stacks.items():
+            names = [self._name(code) for code in codes]
+            self_counts[names[-1]] = self_counts.get(names[-1], 0) + count
+            for name in set(names):
+                total_counts[name] = total_counts.get(name, 0) + count
+        return self_counts, total_counts
+
+    @property
+    def duration(self) -> float:
+        return (self.finished_at or time.time()) - self.started_at
+
+    def format_report(self, top: int = Config.PROFILER_TOP) -> str:
+        """Plain-text summary: time per handler/storage op and the hottest functions"""
+        def share(count: int) -> str:
+            return f"{100 * count / self.samples:.1f}%"
+
+        def top_lines(counts: Dict[str, int]) -> List[str]:
+            ranked = sorted(counts.items(), key=lambda item: item[1], reverse=True)[:top]
+            return [f"• {share(count)} {name}" for name, count in ranked]
+
+        lines = [
+            f"🔬 Profile: {self.samples} samples every {self.interval * 1000:g}ms "
+            f"over {self.duration:.1f}s, {self.updates} updates",
+        ]
+        if not self.samples:
+            return lines[0]
+        lines += ["", "By handler / storage operation:"] + top_lines(self.by_label)
+        if self.stacks:
+            self_counts, total_counts = self.function_counts()
+            lines += ["", "Hot functions (self):"] + top_lines(self_counts)
+            lines += ["", "Hot functions (total):"] + top_lines(total_counts)
+        return "\n".join(lines)
+
+    def folded(self) -> str:
+        """Collapsed stacks, "label;outer;...;inner samples", for flamegraph.pl or speedscope"""
+        folded: Dict[str, int] = {}
+        for (label, codes), count in self.stacks.items():
+            stack = ";".join([label] + [self._name(code) for code in codes])
+            folded[stack] = folded.get(stack, 0) + count
+        return "".join(f"{stack} {count}\n" for stack, count in sorted(folded.items()))
+
+
+class Profiler:
+    """Sampling profiler the owner switches on from the admin panel.
+
+    While running, a background thread snapshots the stacks of the event
+    loop thread and the storage thread every `interval` seconds. Samples
+    are attributed to the handler or storage operation they fall under,
+    via the frames of the metrics wrappers. A session ends after a number
+    of updates or seconds, whichever comes first, and hands its Profile to
+    a callback. When no session runs, the only cost is the update counter
+    checking a flag.
+    """
+
+    def __init__(self, interval_ms: float = Config.PROFILER_INTERVAL_MS, max_seconds: int = Config.PROFILER_MAX_SECONDS):
+        self.interval = interval_ms / 1000
+        self.max_seconds = max_seconds
+        self.profile: Optional[Profile] = None
+        self._update_limit = 0
+        self._on_done: Optional[Callable[[Profile], Awaitable[None]]] = None
+        self._stop_sampling = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._timer: Optional[asyncio.Task] = None
+        self._finishing = False
+
+    @property
+    def running(self) -> bool:
+        return self.profile is not None
+
+    def start(
+        self,
+        on_done: Callable[[Profile], Awaitable[None]],
+        updates: int = 0,
+        seconds: float = 0,
+    ) -> bool:
+        """Profile the next `updates` updates or `seconds` seconds; False if already running"""
+        if self.running:
+            return False
+        self.profile = Profile(self.interval)
+        self._update_limit = updates
+        self._on_done = on_done
+        self._finishing = False
+        self._stop_sampling.clear()
+        self._thread = threading.Thread(
+            target=self._sample, args=(threading.get_ident(),), name="profiler", daemon=True
+        )
+        self._thread.start()
+        # Update-bounded sessions still end at the cap if traffic is slow
+        limit = min(seconds or self.max_seconds, self.max_seconds)
+        self._timer = asyncio.create_task(self._stop_after(limit))
+        logger.info("Profiler started (%s updates, %ss)", updates or "any", limit)
+        return True
+
+    async def count_update(self, update, context):
+        """TypeHandler callback that ends update-bounded sessions"""
+        if self.profile is None:
+            return
+        self.profile.updates += 1
+        if self._update_limit and self.profile.updates >= self._update_limit:
+            asyncio.create_task(self.stop())
+
+    async def _stop_after(self, seconds: float):
+        await asyncio.sleep(seconds)
+        await self.stop()
+
+    async def stop(self) -> Optional[Profile]:
+        """End the session and deliver its profile to the callback"""
+        if self.profile is None or self._finishing:
+            return None
+        self._finishing = True
+        self._stop_sampling.set()
+        await asyncio.to_thread(self._thread.join)
+        if self._timer is not None and self._timer is not asyncio.current_task():
+            self._timer.cancel()
+
+        profile, on_done = self.profile, self._on_done
+        profile.finished_at = time.time()
+        self.profile = self._on_done = self._thread = self._timer = None
+        logger.info("Profiler stopped after %d samples", profile.samples)
+        try:
+            await on_done(profile)
+        except Exception:
+            logger.exception("Could not deliver the profile")
+        return profile
+
+    def _sample(self, loop_thread: int):
+        profile = self.profile
+        own_thread = threading.get_ident()
+        while not self._stop_sampling.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id != own_thread:
+                    profile.add(frame, thread_id == loop_thread)
+
+
+profiler = Profiler()
@@ -0,0 +1,266 @@
+import sys
+from collections.abc import Mapping, MutableMapping
+from typing import Dict, Iterator, Optional
+
+# Marks an unset slot, i.e. a key the on-disk record doesn't have
+_MISSING = object()
+
+# One int object per user ID; IDs repeat across every whisper a user sends
+# or receives, and each parsed copy would otherwise cost its own 32 bytes
+_ids: Dict[int, int] = {}
+
+
+def shared(value):
+    """A single shared object for a value that repeats across records"""
+    if type(value) is str:
+        return sys.intern(value)
+    if type(value) is int:
+        return _ids.setdefault(value, value)
+    return value
+
+
+class Record(MutableMapping):
+    """Mapping whose known keys live in __slots__ instead of a hash table.
+
+    Subclasses list their on-disk keys in FIELDS, each of which must be a
+    slot, and the keys whose values repeat across records in SHARED. An
+    unset slot is an absent key, so to_dict() gives back the original dict;
+    unexpected keys are kept in a small side dict.
+    """
+
+    __slots__ = ("_extra",)
+    FIELDS: tuple = ()
+    SHARED: frozenset = frozenset()
+    _field_set: frozenset = frozenset()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._field_set = frozenset(cls.FIELDS)
+
+    def __init__(self, data: Mapping):
+        # Same as assigning each item, minus the method calls: every
+        # whisper goes through here when a dataset is loaded
+        self._extra = None
+        field_set, shared_keys, intern, ids = self._field_set, self.SHARED, sys.intern, _ids
+        for key, value in data.items():
+            if key in field_set:
+                if key in shared_keys:
+                    if type(value) is str:
+                        value = intern(value)
+                    elif type(value) is int:
+                        value = ids.setdefault(value, value)
+                setattr(self, key, value)
+            else:
+                self[key] = value
+
+    def __getitem__(self, key):
+        if key in self._field_set:
+            value = getattr(self, key, _MISSING)
+            if value is not _MISSING:
+                return value
+        elif self._extra is not None and key in self._extra:
+            return self._extra[key]
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        if key in self._field_set:
+            return getattr(self, key, default)
+        if self._extra is not None:
+            return self._extra.get(key, default)
+        return default
+
+    def __contains__(self, key) -> bool:
+        if key in self._field_set:
+            return hasattr(self, key)
+        return self._extra is not None and key in self._extra
+
+    def __setitem__(self, key, value):
+        if key in self._field_set:
+            setattr(self, key, shared(value) if key in self.SHARED else value)
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
+
+    def __delitem__(self, key):
+        if key in self._field_set and hasattr(self, key):
+            delattr(self, key)
+        elif self._extra is not None and key in self._extra:
+            del self._extra[key]
+        else:
+            raise KeyError(key)
+
+    def __iter__(self) -> Iterator[str]:
+        for key in self.FIELDS:
+            if hasattr(self, key):
+                yield key
+        if self._extra is not None:
+            yield from self._extra
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.to_dict()!r})"
+
+    def to_dict(self) -> Dict:
+        """Plain dict with the same keys and values, as stored on disk"""
+        data = {}
+        for key in self.FIELDS:
+            value = getattr(self, key, _MISSING)
+            if value is not _MISSING:
+                data[key] = value
+        if self._extra:
+            data.update(self._extra)
+        return data
+
+    def copy(self) -> "Record":
+        return type(self)(self)
+
+
+class MediaItem(Record):
+    """One photo, video, document, audio, voice or text item of a media whisper"""
+
+    __slots__ = ("type", "file_id", "caption", "text")
+    FIELDS = __slots__
+    SHARED = frozenset({"type"})
+
+
+class WhisperRecord(Record):
+    """Fields common to both whisper schemas; also holds records matching neither.
+
+    Inline whispers name their recipient by `recipient` and `recipient_type`
+    (plus `recipient_id` once resolved), /create whispers by `recipient_id`
+    and `recipient_display`. recipient_label and is_recipient() answer
+    the same questions for either kind.
+    """
+
+    __slots__ = ("id", "sender_id", "recipient_id", "created_at", "is_revealed", "revealed_by", "revealed_at")
+    FIELDS = __slots__
+    SHARED = frozenset({"sender_id", "recipient_id", "revealed_by"})
+
+    @property
+    def recipient_label(self) -> Optional[str]:
+        """How the recipient is shown to people (None if unknown)"""
+        display = self.get("recipient_display")
+        if display:
+            return display
+        recipient = self.get("recipient")
+        if recipient is None:
+            recipient_id = self.get("recipient_id")
+            return None if recipient_id is None else f"user {recipient_id}"
+        return f"user {recipient}" if self.get("recipient_type") == "id" else str(recipient)
+
+    def is_recipient(self, user_id: int, username: Optional[str] = None) -> bool:
+        """Whether this user may reveal the whisper.
+
+        A resolved recipient_id decides on its own; otherwise a username
+        recipient is matched case-insensitively and a numeric one by ID.
+        """
+        recipient_id = self.get("recipient_id")
+        if recipient_id:
+            return str(user_id) == str(recipient_id)
+        recipient = self.get("recipient")
+        if recipient is None:
+            return False
+        if self.get("recipient_type") == "username":
+            return bool(username) and username.lstrip("@").lower() == str(recipient).lstrip("@").lower()
+        return str(user_id) == str(recipient)
+
+
+class InlineWhisper(WhisperRecord):
+    """A text whisper sent through inline mode"""
+
+    __slots__ = ("sender_name", "recipient", "recipient_type", "message", "word_count")
+    FIELDS = (
+        "id", "sender_id", "sender_name", "recipient", "recipient_type", "recipient_id",
+        "message", "created_at", "is_revealed", "revealed_by", "revealed_at", "word_count",
+    )
+    SHARED = WhisperRecord.SHARED | {"sender_name", "recipient", "recipient_type"}
+
+
+class MediaWhisper(WhisperRecord):
+    """A whisper of media items created with /create"""
+
+    __slots__ = ("recipient_display", "media_items")
+    FIELDS = (
+        "id", "sender_id", "recipient_id", "recipient_display", "media_items",
+        "created_at", "is_revealed", "revealed_by", "revealed_at",
+    )
+    SHARED = WhisperRecord.SHARED | {"recipient_display"}
+
+    def __init__(self, data: Mapping):
+        super().__init__(data)
+        if hasattr(self, "media_items"):
+            self.media_items = self._media_items(self.media_items)
+
+    def __setitem__(self, key, value):
+        if key == "media_items":
+            value = self._media_items(value)
+        super().__setitem__(key, value)
+
+    @staticmethod
+    def _media_items(value):
+        """Items as a tuple of MediaItem records (anything unexpected is kept as is)"""
+        if not isinstance(value, (list, tuple)):
+            return value
+        return tuple(MediaItem(item) if isinstance(item, (dict, Record)) else item for item in value)
+
+    def to_dict(self) -> Dict:
+        data = super().to_dict()
+        if "media_items" in data:
+            data["media_items"] = [
+                item.to_dict() if isinstance(item, Record) else item for item in data["media_items"]
+            ]
+        return data
+
+
+def to_record(whisper: Mapping, whisper_id: Optional[str] = None) -> WhisperRecord:
+    """A new compact record for a whisper of either schema.
+
+    Passing the whisper's storage key lets the record share that string as
+    its id instead of holding an equal copy.
+    """
+    if "media_items" in whisper:
+        cls = MediaWhisper
+    elif "message" in whisper:
+        cls = InlineWhisper
+    else:
+        cls = WhisperRecord
+    record = cls(whisper)
+    if whisper_id is not None and record.get("id") == whisper_id:
+        record.id = whisper_id
+    return record
+
+
+def to_plain(whisper: Mapping) -> Dict:
+    """A plain-dict copy of a whisper record or dict"""
+    if isinstance(whisper, Record):
+        return whisper.to_dict()
+    return dict(whisper)
+
+
+def json_object_hook(obj: Dict):
+    """json object_hook that turns whisper objects into records as they are decoded.
+
+    Converting afterwards would first build the whole dataset as dicts,
+    and the freed dicts leave the heap too fragmented to shrink again.
+    Whisper objects are recognised by created_at plus is_revealed, which
+    no other object in the data file has.
+    """
+    if "is_revealed" in obj and "created_at" in obj:
+        return to_record(obj)
+    return obj
+
+
+def compact_whispers(whispers: Dict):
+    """Turn the whispers of a loaded dataset into records, in place.
+
+    Whispers that are records already (see json_object_hook) are kept and
+    only made to share their storage key as their id.
+    """
+    for whisper_id, whisper in whispers.items():
+        if not isinstance(whisper, WhisperRecord):
+            whispers[whisper_id] = to_record(whisper, whisper_id)
+        elif whisper.get("id") == whisper_id:
+            whisper.id = whisper_id
@@ -0,0 +1,116 @@
+import asyncio
+import logging
+from typing import Dict, Optional
+
+from telegram import User
+
+from config import Config
+from storage import storage
+from utils.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+
+class UserRegistry:
+    """Cached view of the users, with changes written back in batches.
+
+    Users are loaded from storage when needed and then served from a
+    bounded cache for `cache_ttl` seconds. A user is only marked dirty when
+    their profile or settings actually change, and only the changed fields
+    are kept: every `flush_interval` seconds the dirty users are re-read,
+    the changes merged in and the results saved together, so seeing a user
+    on every update costs no storage write at all and fields that another
+    worker process changed meanwhile are not overwritten.
+    """
+
+    def __init__(
+        self,
+        flush_interval: float = Config.USER_FLUSH_INTERVAL,
+        cache_ttl: float = Config.USER_CACHE_TTL,
+        cache_size: int = Config.USER_CACHE_SIZE,
+    ):
+        self.flush_interval = flush_interval
+        # Users as last read from or written to storage
+        self._users = TTLCache(ttl=cache_ttl, maxsize=cache_size)
+        # Users known not to exist in storage yet
+        self._missing = TTLCache(ttl=cache_ttl, maxsize=cache_size)
+        # Fields changed since the last flush, per user
+        self._changes: Dict[str, Dict] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    async def _load(self, user_id: str) -> Optional[Dict]:
+        """A user's stored data with their unsaved changes applied"""
+        user_data = self._users.get(user_id)
+        if user_data is None and self._missing.get(user_id) is None:
+            user_data = await storage.aget_user(user_id)
+            if user_data is None:
+                self._missing.set(user_id, True)
+            else:
+                self._users.set(user_id, user_data)
+        changes = self._changes.get(user_id)
+        if changes is not None:
+            user_data = {**(user_data or {}), **changes}
+        return user_data
+
+    async def get(self, user_id) -> Optional[Dict]:
+        """Get a copy of a user's data, or None if they never used the bot"""
+        user_data = await self._load(str(user_id))
+        return dict(user_data) if user_data is not None else None
+
+    async def update(self, user_id, **changes) -> Dict:
+        """Apply changes to a user, creating them if needed; returns a copy"""
+        user_id = str(user_id)
+        user_data = await self._load(user_id)
+        if user_data is None:
+            user_data = {}
+            self._changes.setdefault(user_id, {})
+        for key, value in changes.items():
+            if user_data.get(key) != value:
+                self._changes.setdefault(user_id, {})[key] = value
+        return {**user_data, **self._changes.get(user_id, {})}
+
+    async def register(self, user: User) -> Dict:
+        """Record a Telegram user's current username and first name"""
+        return await self.update(user.id, username=user.username, first_name=user.first_name)
+
+    async def flush(self):
+        """Save every changed user in one batch"""
+        if not self._changes:
+            return
+        changes, self._changes = self._changes, {}
+        try:
+            # Merge into the current records rather than writing back the
+            # cached ones, which another process may have updated since
+            stored = await storage.aget_users(list(changes))
+            batch = {user_id: {**(stored[user_id] or {}), **fields} for user_id, fields in changes.items()}
+            await storage.asave_users(batch)
+        except Exception:
+            # Try again with the next batch, under any newer changes
+            for user_id, fields in changes.items():
+                self._changes[user_id] = {**fields, **self._changes.get(user_id, {})}
+            raise
+        for user_id, user_data in batch.items():
+            self._users.set(user_id, user_data)
+            self._missing.pop(user_id)
+
+    async def _run_flusher(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Could not save changed users")
+
+    def start(self):
+        self._task = asyncio.create_task(self._run_flusher())
+
+    async def stop(self):
+        """Stop the periodic flush and save whatever is still pending"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+
+user_registry = UserRegistry()
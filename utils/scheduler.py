@@ -0,0 +1,161 @@
+import asyncio
+import heapq
+import logging
+import time
+from typing import Awaitable, Callable, Dict, List, Optional
+from uuid import uuid4
+
+from telegram import Bot
+from telegram.error import TelegramError
+
+from config import Config
+from storage import storage
+
+logger = logging.getLogger(__name__)
+
+ActionHandler = Callable[[Bot, Dict], Awaitable[None]]
+
+
+class Scheduler:
+    """Run deferred bot actions (message edits, deletions) when they fall due.
+
+    Pending actions are kept in a heap ordered by due time, so one task
+    sleeps until the earliest of them instead of one sleeping task per
+    action. Actions that must survive a restart are also kept in storage;
+    everything due at a wake-up runs as a batch and the stored ones are
+    removed with one write.
+    """
+
+    def __init__(self, batch_size: int = Config.SCHEDULER_BATCH_SIZE):
+        self.batch_size = batch_size
+        self.bot: Optional[Bot] = None
+        self._handlers: Dict[str, ActionHandler] = {}
+        self._actions: Dict[str, Dict] = {}
+        # IDs of pending actions that were never written to storage
+        self._transient = set()
+        self._heap: List[tuple] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def register(self, kind: str, handler: ActionHandler):
+        """Set the coroutine that carries out actions of this kind"""
+        self._handlers[kind] = handler
+
+    def __len__(self):
+        return len(self._actions)
+
+    def _push(self, action_id: str, action: Dict):
+        self._actions[action_id] = action
+        heapq.heappush(self._heap, (action["due_at"], action_id))
+        # Only a new earliest action changes how long the runner should sleep
+        if self._wakeup is not None and self._heap[0][1] == action_id:
+            self._wakeup.set()
+
+    async def schedule(
+        self, kind: str, delay: float, durable: bool = False, persist: bool = True, **params
+    ) -> str:
+        """Add an action to run `delay` seconds from now, returning its ID.
+
+        Pass persist=False for cosmetic actions that may be lost on a
+        restart; they cost no storage writes at all.
+        """
+        action_id = uuid4().hex
+        # The creating worker owns the action, also after a restart
+        action = {"kind": kind, "due_at": time.time() + delay, "params": params, "worker": Config.WORKER_INDEX}
+        if persist:
+            await storage.asave_scheduled_actions({action_id: action}, durable=durable)
+        else:
+            self._transient.add(action_id)
+        self._push(action_id, action)
+        return action_id
+
+    async def start(self, bot: Bot):
+        """Reload pending actions from storage and start the runner"""
+        self.bot = bot
+        self._wakeup = asyncio.Event()
+        for action_id, action in (await storage.aget_scheduled_actions()).items():
+            # With several worker processes, each reloads only the actions it
+            # created. Owners past WORKER_COUNT wrap around, and actions
+            # saved before owners were recorded go to worker 0.
+            if action.get("worker", 0) % Config.WORKER_COUNT == Config.WORKER_INDEX:
+                self._push(action_id, action)
+        if self._actions:
+            logger.info("Reloaded %d scheduled actions", len(self._actions))
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the runner; unfinished actions stay in storage for the next start"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            if not self._heap:
+                await self._wakeup.wait()
+                continue
+
+            delay = self._heap[0][0] - time.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            try:
+                await self._run_due()
+            except Exception:
+                logger.exception("Scheduled action batch failed")
+
+    async def _run_due(self):
+        """Run up to batch_size due actions together, then forget them"""
+        now = time.time()
+        batch = []
+        while self._heap and self._heap[0][0] <= now and len(batch) < self.batch_size:
+            _, action_id = heapq.heappop(self._heap)
+            action = self._actions.pop(action_id, None)
+            if action is not None:
+                batch.append((action_id, action))
+
+        await asyncio.gather(*(self._execute(action) for _, action in batch))
+        stored = [action_id for action_id, _ in batch if action_id not in self._transient]
+        self._transient.difference_update(action_id for action_id, _ in batch)
+        if stored:
+            await storage.adelete_scheduled_actions(stored)
+
+    async def _execute(self, action: Dict):
+        handler = self._handlers.get(action["kind"])
+        if handler is None:
+            logger.warning("No handler for scheduled action %r", action["kind"])
+            return
+        try:
+            await handler(self.bot, action["params"])
+        except TelegramError as e:
+            # Typically the message is already gone or was edited by hand
+            logger.warning("Scheduled %s failed: %s", action["kind"], e)
+        except Exception:
+            logger.exception("Scheduled %s failed", action["kind"])
+
+
+async def delete_messages(bot: Bot, params: Dict):
+    """Delete several messages of one chat in a single API call"""
+    await bot.delete_messages(params["chat_id"], params["message_ids"])
+
+
+async def edit_message_text(bot: Bot, params: Dict):
+    """Replace a message's text and drop its keyboard"""
+    await bot.edit_message_text(
+        params["text"],
+        chat_id=params.get("chat_id"),
+        message_id=params.get("message_id"),
+        inline_message_id=params.get("inline_message_id"),
+        reply_markup=None,
+    )
+
+
+scheduler = Scheduler()
+scheduler.register("delete_messages", delete_messages)
+scheduler.register("edit_message_text", edit_message_text)
@@ -0,0 +1,124 @@
+import gc
+import io
+import json
+import os
+import pickle
+import zlib
+from contextlib import contextmanager
+from typing import Dict
+
+# Binary snapshots start with MAGIC and a codec byte; JSON ones with "{"
+MAGIC = b"WSNAP1"
+RAW, ZLIB = 0, 1
+
+# "json" is the indented document JSONStorage has always written,
+# "json-compact" the same without whitespace, and "compact" / "compact-zlib"
+# the binary encoding, uncompressed or zlib-compressed
+FORMATS = ("json", "json-compact", "compact", "compact-zlib")
+
+
+class SnapshotError(ValueError):
+    """A snapshot file is truncated, corrupt or not a snapshot at all"""
+
+
+class DataUnpickler(pickle.Unpickler):
+    """Unpickler for plain data only.
+
+    Snapshots hold nothing but dicts, lists, strings, numbers, booleans and
+    None, none of which needs a global to rebuild. Refusing every global
+    means loading a tampered file can't run code.
+    """
+
+    def find_class(self, module, name):
+        raise SnapshotError(f"Snapshot refers to {module}.{name}, only plain data is allowed")
+
+
+@contextmanager
+def paused_gc():
+    """Keep the cyclic GC from repeatedly scanning a dataset while it is being built.
+
+    Loading creates millions of containers and none of them are garbage,
+    yet each allocation burst triggers a collection that walks them all.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def detect_format(raw: bytes) -> str:
+    """Format of an encoded snapshot, judged by its first bytes"""
+    if raw.startswith(MAGIC):
+        return "compact-zlib" if raw[len(MAGIC):len(MAGIC) + 1] == bytes([ZLIB]) else "compact"
+    return "json"
+
+
+def loads(raw: bytes, object_hook=None) -> Dict:
+    """Decode a snapshot in any of the formats.
+
+    object_hook is passed on to json.loads; binary snapshots always decode
+    to plain data. Whatever goes wrong while decoding damaged input is
+    raised as SnapshotError.
+    """
+    with paused_gc():
+        try:
+            if not raw.startswith(MAGIC):
+                data = json.loads(raw, object_hook=object_hook)
+            else:
+                codec, payload = raw[len(MAGIC):len(MAGIC) + 1], raw[len(MAGIC) + 1:]
+                if codec == bytes([ZLIB]):
+                    payload = zlib.decompress(payload)
+                elif codec != bytes([RAW]):
+                    raise SnapshotError(f"Unknown snapshot codec {codec!r}")
+                data = DataUnpickler(io.BytesIO(payload)).load()
+        except SnapshotError:
+            raise
+        except Exception as e:
+            # Damaged pickles and JSON fail in many ways besides the
+            # documented ones (UnicodeDecodeError, OverflowError, MemoryError...)
+            raise SnapshotError(f"Corrupt snapshot: {e!r}") from e
+
+    if not isinstance(data, dict):
+        raise SnapshotError("Snapshot does not hold a dataset")
+    return data
+
+
+def dumps(data: Dict, fmt: str) -> bytes:
+    """Encode a dataset in one of FORMATS"""
+    if fmt == "json":
+        return json.dumps(data, indent=4).encode()
+    if fmt == "json-compact":
+        return json.dumps(data, separators=(',', ':')).encode()
+    if fmt in ("compact", "compact-zlib"):
+        payload = pickle.dumps(data, protocol=5)
+        if fmt == "compact":
+            return MAGIC + bytes([RAW]) + payload
+        # Level 1: most of the size win at a fraction of the default's cost
+        return MAGIC + bytes([ZLIB]) + zlib.compress(payload, 1)
+    raise ValueError(f"Unknown snapshot format: {fmt!r}, expected one of {', '.join(FORMATS)}")
+
+
+def load(path: str, object_hook=None) -> Dict:
+    """Read a snapshot file of any format (FileNotFoundError if missing, SnapshotError if unreadable)"""
+    with open(path, 'rb') as f:
+        raw = f.read()
+    return loads(raw, object_hook)
+
+
+def dump(path: str, data: Dict, fmt: str, durable: bool = False):
+    """Write a snapshot file; durable writes go through an fsynced temp file and a rename"""
+    raw = dumps(data, fmt)
+    if not durable:
+        with open(path, 'wb') as f:
+            f.write(raw)
+        return
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(raw)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
@@ -0,0 +1,200 @@
+import asyncio
+import hmac
+import json
+import logging
+import signal
+import zlib
+from typing import Dict, Optional
+
+from telegram import Update
+from telegram.ext import Application
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "x-telegram-bot-api-secret-token"
+# Telegram updates are small; anything bigger is not from Telegram
+MAX_BODY = 1024 * 1024
+
+REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    403: "Forbidden",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    503: "Service Unavailable",
+}
+
+
+def worker_for(routing_key: str, workers: int) -> int:
+    """Index of the worker supervisor.py forwards updates with this routing key to"""
+    return zlib.crc32(routing_key.encode()) % workers
+
+
+def whisper_routing_key(whisper_id: str) -> str:
+    """Routing key of taps on a whisper's reveal button"""
+    return "whisper:" + whisper_id
+
+
+class WebhookServer:
+    """Minimal asyncio HTTP listener that feeds Telegram updates to the bot.
+
+    Each POST to `path` must carry the secret token header (when a secret
+    is set) and a JSON update, which is put on the application's update
+    queue. The queue is bounded: when it is full the request is answered
+    503 and Telegram redelivers the update later, instead of the bot
+    buffering an unbounded backlog. At most `max_connections` connections
+    are served at once; Telegram is told the same limit via setWebhook.
+    """
+
+    def __init__(
+        self,
+        application: Application,
+        listen: str = Config.WEBHOOK_LISTEN,
+        port: int = Config.WEBHOOK_PORT,
+        path: str = Config.WEBHOOK_PATH,
+        secret_token: str = Config.WEBHOOK_SECRET,
+        max_connections: int = Config.WEBHOOK_MAX_CONNECTIONS,
+    ):
+        self.application = application
+        self.listen = listen
+        self.port = port
+        self.path = path
+        self.secret_token = secret_token
+        self.max_connections = max_connections
+        # Open connections and the tasks serving them
+        self._connections: Dict[asyncio.StreamWriter, asyncio.Task] = {}
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle_connection, self.listen, self.port)
+        logger.info("Webhook listening on %s:%d%s", self.listen, self.port, self.path)
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            # Idle keep-alive connections would otherwise hold the server open
+            for writer in list(self._connections):
+                writer.close()
+            await asyncio.gather(*self._connections.values(), return_exceptions=True)
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        if len(self._connections) >= self.max_connections:
+            await self._respond(writer, 503, keep_alive=False)
+            writer.close()
+            return
+
+        self._connections[writer] = asyncio.current_task()
+        try:
+            # Telegram keeps connections open, so serve requests until it closes
+            while await self._handle_request(reader, writer):
+                pass
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            self._connections.pop(writer, None)
+            writer.close()
+
+    async def _handle_request(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> bool:
+        """Serve one request; returns whether the connection stays open"""
+        request_line = await reader.readline()
+        if not request_line:
+            return False
+        method, target, version = request_line.decode("latin-1").split()
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        length = int(headers.get("content-length", 0))
+        if length > MAX_BODY:
+            await self._respond(writer, 413, keep_alive=False)
+            return False
+        body = await reader.readexactly(length)
+        keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+
+        if target.split("?", 1)[0] != self.path:
+            status = 404
+        elif method != "POST":
+            status = 405
+        elif self.secret_token and not hmac.compare_digest(
+            headers.get(SECRET_HEADER, "").encode(), self.secret_token.encode()
+        ):
+            status = 403
+        else:
+            status = await self.handle_update(body)
+
+        await self._respond(writer, status, keep_alive)
+        return keep_alive
+
+    async def handle_update(self, body: bytes) -> int:
+        """Queue one update for the application, returning the HTTP status"""
+        try:
+            update = Update.de_json(json.loads(body), self.application.bot)
+        except (ValueError, TypeError, KeyError):
+            logger.warning("Rejected malformed webhook update")
+            return 400
+        try:
+            self.application.update_queue.put_nowait(update)
+        except asyncio.QueueFull:
+            logger.warning("Update queue full, asking Telegram to redeliver update %s", update.update_id)
+            return 503
+        return 200
+
+    async def _respond(self, writer: asyncio.StreamWriter, status: int, keep_alive: bool):
+        writer.write(
+            f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+            f"Content-Length: 0\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1")
+        )
+        await writer.drain()
+
+
+async def serve_webhook(application: Application):
+    """Run the bot behind the webhook listener until SIGINT/SIGTERM.
+
+    Mirrors Application.run_polling(): post_init and post_shutdown run
+    around the listener. setWebhook is only called when WEBHOOK_URL is set,
+    so the listener can be exercised locally by POSTing recorded updates
+    (see scripts/post_updates.py) without registering it with Telegram.
+    """
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    server = WebhookServer(application)
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    try:
+        await server.start()
+        if Config.WEBHOOK_URL:
+            await application.bot.set_webhook(
+                url=Config.WEBHOOK_URL,
+                secret_token=Config.WEBHOOK_SECRET or None,
+                max_connections=Config.WEBHOOK_MAX_CONNECTIONS,
+                allowed_updates=Update.ALL_TYPES,
+            )
+        await application.start()
+        await stop.wait()
+    finally:
+        await server.stop()
+        if application.running:
+            await application.stop()
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+
+def run_webhook(application: Application):
+    """Blocking entry point, the webhook counterpart of run_polling()"""
+    asyncio.run(serve_webhook(application))